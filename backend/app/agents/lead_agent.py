@@ -2,66 +2,184 @@ from .review_analyzer_agent import review_agent
 from .product_research_agent import product_agent
 from .price_quality_agent import price_agent
 from .budget_advisor_agent import budget_agent
+from app.core import config, sse, tracing
+from app.core.scheduler import AgentNode, AgentScheduler
 from PIL import Image
-import json
-import asyncio
+import functools
+import time
+from typing import Optional
 
 class LeadAgent:
-    def __init__(self):
+    # The field of each agent's result that is streamed back to the client.
+    OUTPUT_KEYS = {
+        "ReviewAnalyzer": "summary",
+        "ProductResearcher": "analysis",
+        "PriceQuality": "assessment",
+        "BudgetAdvisor": "advice",
+    }
+
+    def __init__(self, max_workers: int = 4):
         print("Initializing Lead Agent (Streaming).")
         self.review_agent = review_agent
         self.product_agent = product_agent
         self.price_agent = price_agent
         self.budget_agent = budget_agent
+        self.scheduler = AgentScheduler(max_workers=max_workers)
 
-    async def run_analysis_stream(self, query: str, image: Image.Image, price: float, user_budget: float):
+    @staticmethod
+    def _traced(trace, name: str, func):
+        """Runs an agent call as the 'agent.<name>' span, with `trace` current on the worker thread."""
+        def run(*args, **kwargs):
+            with tracing.use_trace(trace), tracing.span(f"agent.{name}"):
+                return func(*args, **kwargs)
+        return run
+
+    @staticmethod
+    def _retrieval_summary(review_analysis: dict) -> str:
+        """Stands in for the visual analysis, using the titles and descriptions of the closest catalog matches."""
+        products = review_analysis.get('top_products') or []
+        if not products:
+            return "A detailed visual analysis is not available yet, and no similar products were found in the catalog."
+        lines = [f"A detailed visual analysis is not available yet. This item most closely resembles '{products[0]['product_title']}'."]
+        for product in products[:3]:
+            snippet = (product.get('review_snippet') or '').strip()
+            if snippet and snippet != "No Description":
+                lines.append(f"{product['product_title']}: {snippet[:200]}")
+        return " ".join(lines)
+
+    async def run_analysis_events(self, query: str, image: Image.Image, price: float, user_budget: float,
+                                  clip_image: Optional[Image.Image] = None, deadline: Optional[float] = None):
         """
-        Orchestrates the analysis, yielding real-time updates for each agent's progress.
+        Orchestrates the analysis, yielding a dict for each agent's progress.
+        `clip_image` is a smaller copy of `image` for the similarity search; `image` is used if omitted.
+        Independent agents run concurrently; each update is sent as soon as its agent finishes.
+        The ProductResearcher also yields 'partial' updates carrying newly generated text.
+        With tracing enabled, 'responded' and 'complete' updates carry the per-stage timings so far.
+
+        If the visual analysis is not done by `deadline` (a time.monotonic() value), the ProductResearcher
+        reports 'deferred' and the recommendation is completed from the retrieved products. If the analysis
+        still arrives before the PriceQuality agent starts, it is used after all ('responded'). Otherwise,
+        with DEFERRED_VISUAL_SUMMARY on, it follows the 'complete' update as a 'late' update.
         """
         print("--- Lead Agent starting full analysis (streaming) ---")
 
-        # 1. Review Analyzer Agent
-        yield f"data: {json.dumps({'agent': 'ReviewAnalyzer', 'status': 'thinking'})}\n\n"
-        review_analysis = self.review_agent.analyze_with_image(image)
-        yield f"data: {json.dumps({'agent': 'ReviewAnalyzer', 'status': 'responded', 'output': review_analysis['summary']})}\n\n"
-        await asyncio.sleep(0.1) # short delay for streaming
-
-        # 2. Product Research Agent
-        yield f"data: {json.dumps({'agent': 'ProductResearcher', 'status': 'thinking'})}\n\n"
+        push_late = config.DEFERRED_VISUAL_SUMMARY
         visual_prompt = "Describe this product in detail. What are its key visual features, materials, and potential uses?"
-        visual_analysis = self.product_agent.analyze_image(image, visual_prompt)
-        yield f"data: {json.dumps({'agent': 'ProductResearcher', 'status': 'responded', 'output': visual_analysis['analysis']})}\n\n"
-        await asyncio.sleep(0.1)
-
-        # 3. Price-Quality Agent
-        yield f"data: {json.dumps({'agent': 'PriceQuality', 'status': 'thinking'})}\n\n"
-        price_assessment = self.price_agent.assess_value(
-            price=price,
-            review_summary=review_analysis['summary'],
-            product_features=visual_analysis['analysis']
-        )
-        yield f"data: {json.dumps({'agent': 'PriceQuality', 'status': 'responded', 'output': price_assessment['assessment']})}\n\n"
-        await asyncio.sleep(0.1)
-
-        # 4. Budget Advisor Agent
-        yield f"data: {json.dumps({'agent': 'BudgetAdvisor', 'status': 'thinking'})}\n\n"
-        budget_advice = self.budget_agent.check_budget(price, user_budget)
-        yield f"data: {json.dumps({'agent': 'BudgetAdvisor', 'status': 'responded', 'output': budget_advice['advice']})}\n\n"
-        await asyncio.sleep(0.1)
+        nodes = [
+            # The typed query also drives the lexical half of a hybrid search (brand and model names).
+            AgentNode("ReviewAnalyzer", functools.partial(self.review_agent.analyze_with_image, clip_image or image, query=query)),
+            AgentNode(
+                "ProductResearcher",
+                # A late analysis that will not be pushed is not worth starting.
+                lambda emit: self.product_agent.analyze_image(
+                    image, visual_prompt, on_chunk=emit, start_deadline=None if push_late else deadline
+                ),
+                streams=True,
+                deadline=deadline,
+                fallback=lambda: {"analysis": None, "deferred": True},
+            ),
+            AgentNode("BudgetAdvisor", functools.partial(self.budget_agent.check_budget, price, user_budget)),
+            # Price-Quality only needs the review summary and the visual analysis.
+            AgentNode(
+                "PriceQuality",
+                lambda review_analysis, visual_analysis: self.price_agent.assess_value(
+                    price=price,
+                    review_summary=review_analysis['summary'],
+                    product_features=visual_analysis['analysis'] or self._retrieval_summary(review_analysis),
+                    similar_products=review_analysis['top_products'],
+                ),
+                depends_on=["ReviewAnalyzer", "ProductResearcher"]
+            ),
+        ]
 
-        print("--- Synthesizing final recommendation. ---")
+        trace = tracing.new_trace()
+        if trace is not None:
+            for node in nodes:
+                node.func = self._traced(trace, node.name, node.func)
+
+        results = {}
+        deferred = set()  # nodes whose result is a stand-in
+        late, completed = None, False
+        events = self.scheduler.run(nodes)
+        try:
+            async for event in events:
+                if event.kind == "started":
+                    yield {'agent': event.node, 'status': 'thinking'}
+                    continue
+                if event.kind == "partial":
+                    yield {'agent': event.node, 'status': 'partial', 'output': event.result}
+                    continue
+
+                if event.kind == "late":
+                    # PriceQuality already ran on the stand-in, so the recommendation stays
+                    # deferred; the real visual summary is pushed after it.
+                    late = event
+                else:
+                    results[event.node] = event.result
+                    # A withdrawn VLM request finishes without an analysis.
+                    if event.kind == "timed_out" or event.result.get('analysis', '') is None:
+                        deferred.add(event.node)
+                        print(f"--- Lead Agent: {event.node} missed the latency budget; continuing without it. ---")
+                        update = {'agent': event.node, 'status': 'deferred',
+                                  'output': "Still analyzing the image; the recommendation uses catalog data for now."}
+                    else:
+                        # Possibly a timed-out node finishing before anything used its stand-in.
+                        deferred.discard(event.node)
+                        update = {'agent': event.node, 'status': 'responded', 'output': event.result[self.OUTPUT_KEYS[event.node]]}
+                    if trace is not None:
+                        update['timings'] = trace.summary()
+                    yield update
+
+                    if len(results) == len(nodes) and not completed:
+                        completed = True
+                        yield self._complete(results, bool(deferred), trace)
+                        if not (deferred and push_late):
+                            break
 
-        # 5. Yield the final synthesized result
+                if completed and late is not None:
+                    if late.result['analysis'] is not None:
+                        update = {'agent': late.node, 'status': 'late', 'output': late.result['analysis']}
+                        if trace is not None:
+                            update['timings'] = trace.summary()
+                        yield update
+                    break
+        finally:
+            await events.aclose()
+        print("--- Full analysis stream complete. ---")
+
+    def _complete(self, results: dict, deferred: bool, trace) -> dict:
+        """The final 'complete' update, synthesized from every agent's result."""
+        review_analysis = results["ReviewAnalyzer"]
+        visual_analysis = results["ProductResearcher"]
+        price_assessment = results["PriceQuality"]
+        budget_advice = results["BudgetAdvisor"]
+
+        print("--- Synthesizing final recommendation. ---")
         final_recommendation = {
             "title": review_analysis['top_products'][0]['product_title'] if review_analysis['top_products'] else "Recommended Product",
-            "visual_summary": visual_analysis['analysis'],
+            "visual_summary": visual_analysis['analysis'] or self._retrieval_summary(review_analysis),
+            "visual_summary_deferred": deferred,
             "review_summary": review_analysis['summary'],
             "value_assessment": price_assessment['assessment'],
             "budget_advice": budget_advice['advice'],
-            "similar_products": review_analysis['top_products']
+            # Each similar product carries its value score from the Price-Quality agent.
+            "similar_products": [
+                dict(product, value_score=candidate['value_score'], price_percentile=candidate['price_percentile'])
+                for product, candidate in zip(review_analysis['top_products'], price_assessment.get('candidates', []))
+            ] or review_analysis['top_products']
         }
-        yield f"data: {json.dumps({'agent': 'LeadAgent', 'status': 'complete', 'output': final_recommendation})}\n\n"
-        print("--- Full analysis stream complete. ---")
+        complete = {'agent': 'LeadAgent', 'status': 'complete', 'output': final_recommendation}
+        if trace is not None:
+            tracing.record("pipeline.agents", time.perf_counter() - trace.started, trace, degraded=deferred)
+            complete['timings'] = trace.summary()
+        return complete
+
+    async def run_analysis_stream(self, query: str, image: Image.Image, price: float, user_budget: float):
+        """
+        Same as `run_analysis_events`, formatted as Server-Sent Events.
+        """
+        async for event in self.run_analysis_events(query, image, price, user_budget):
+            yield f"data: {sse.dumps(event)}\n\n"
 
 # Singleton instance
 lead_agent = LeadAgent()
\ No newline at end of file
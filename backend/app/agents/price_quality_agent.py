@@ -1,35 +1,112 @@
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence
+
+from app.core import config
+from app.core.value_scoring import LexiconScorer, parse_prices, price_percentiles
+
 class PriceQualityAgent:
-    def __init__(self):
+    # Weighted phrases per signal. 'sentiment' is read from review text, 'premium' from
+    # product features and descriptions. PRICE_QUALITY_LEXICON_PATH can replace them.
+    DEFAULT_LEXICONS = {
+        "sentiment": {
+            "good": 1, "great": 1, "excellent": 1.5, "amazing": 1.5, "love": 1, "durable": 1,
+            "high quality": 1.5, "sturdy": 1, "reliable": 1, "well made": 1, "worth it": 1,
+            "poor": -1, "flimsy": -1, "broke": -1.5, "broken": -1.5, "defective": -1.5,
+            "cheaply made": -1.5, "disappointed": -1, "returned it": -1,
+        },
+        "premium": {
+            "premium": 1, "pro": 1, "plus": 0.5, "metal": 1, "advanced": 1, "stainless steel": 1,
+            "aluminum": 1, "leather": 1, "solid wood": 1, "professional": 1, "warranty": 0.5,
+        },
+    }
+
+    def __init__(self, lexicons: Optional[Dict[str, Dict[str, float]]] = None):
         print("Initializing Price-Quality Agent.")
-        # This agent is currently rule-based, no model loading needed.
+        # This agent is rule-based: the lexicons are compiled once, no model loading needed.
+        if lexicons is None and config.PRICE_QUALITY_LEXICON_PATH:
+            self.scorer = LexiconScorer.from_file(config.PRICE_QUALITY_LEXICON_PATH)
+        else:
+            self.scorer = LexiconScorer(lexicons or self.DEFAULT_LEXICONS)
+        self._sentiment = self.scorer.column("sentiment")
+        self._premium = self.scorer.column("premium")
+
+    @staticmethod
+    def _reference_prices(similar_products: Sequence[Dict[str, Any]]) -> np.ndarray:
+        """Prices of the similar products, if enough of them have one to compare against."""
+        prices = parse_prices([product.get("price") for product in similar_products])
+        prices = prices[~np.isnan(prices)]
+        return prices if len(prices) >= config.PRICE_QUALITY_MIN_REFERENCE_PRICES else prices[:0]
+
+    def score_products(self, products: Sequence[Dict[str, Any]],
+                       reference_prices: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        Scores many products (e.g. every similar product of a search) in one pass.
+        Quality comes from each product's title and description ('review_snippet' in search
+        hits); price from its position among `reference_prices` (by default, the products' own).
+        value_score is roughly -1.5 (poor and dear) to 1.5 (well reviewed and cheap).
+        """
+        if not products:
+            return []
+        texts = [f"{product.get('product_title') or ''}\n{product.get('review_snippet') or product.get('product_description') or ''}"
+                 for product in products]
+        scores = self.scorer.score_many(texts)
+        quality = np.tanh(scores[:, self._sentiment] + scores[:, self._premium])
+
+        if reference_prices is None:
+            reference_prices = self._reference_prices(products)
+        percentiles = price_percentiles(parse_prices([product.get("price") for product in products]), reference_prices)
+        # Unpriced products are neither rewarded nor penalized for price.
+        value = quality + np.where(np.isnan(percentiles), 0.0, 0.5 - np.nan_to_num(percentiles))
+        return [
+            {
+                "product_id": product.get("product_id"),
+                "value_score": round(float(score), 3),
+                "price_percentile": None if np.isnan(percentile) else round(float(percentile), 3),
+            }
+            for product, score, percentile in zip(products, value.tolist(), percentiles.tolist())
+        ]
 
-    def assess_value(self, price: float, review_summary: str, product_features: str):
+    def _price_comment(self, price: float, reference_prices: np.ndarray):
+        """(comment, point) for `price`, against the similar products if possible, else fixed bands."""
+        percentile = float(price_percentiles(parse_prices([price]), reference_prices)[0])
+        if not np.isnan(percentile):
+            count, median = len(reference_prices), float(np.median(reference_prices))
+            if percentile < 0.4:
+                return f"is priced below most of the {count} similar products found (median ${median:.2f}).", 1
+            if percentile <= 0.6:
+                return f"is priced in line with similar products (median ${median:.2f}).", 0
+            return f"is priced above most of the {count} similar products found (median ${median:.2f}).", 0
+
+        if price < 50:
+            return "is very affordable.", 1
+        elif 50 <= price < 150:
+            return "is in a moderate price range.", 0
+        return "is a premium-priced item.", 0
+
+    def assess_value(self, price: float, review_summary: str, product_features: str,
+                     similar_products: Optional[Sequence[Dict[str, Any]]] = None):
         """
         Assesses the value-for-money of a product based on price and qualitative data.
-        Currently uses simple heuristics.
+        With `similar_products` (search hits), the price is judged against theirs where
+        they have prices, and each of them gets a value score too ('candidates', in order).
         """
         print("Price-Quality Agent assessing value...")
+        similar_products = similar_products or []
+        scores = self.scorer.score_many([review_summary, product_features])
         score = 0
-        assessment = ""
 
-        # Heuristic 1: Analyze review summary for positive keywords
-        positive_words = ["good", "excellent", "great", "love", "durable", "high quality", "amazing"]
-        if any(word in review_summary.lower() for word in positive_words):
+        # Heuristic 1: Review summary leans positive
+        if scores[0, self._sentiment] > 0:
             score += 1
 
-        # Heuristic 2: Analyze product features for premium keywords
-        premium_words = ["premium", "pro", "plus", "metal", "advanced"]
-        if any(word in product_features.lower() for word in premium_words):
+        # Heuristic 2: Product features mention premium materials or tiers
+        if scores[1, self._premium] > 0:
             score += 1
-            
-        # Heuristic 3: Price-based assessment
-        if price < 50:
-            score += 1
-            price_comment = "is very affordable."
-        elif 50 <= price < 150:
-            price_comment = "is in a moderate price range."
-        else:
-            price_comment = "is a premium-priced item."
+
+        # Heuristic 3: Price, relative to similar products when their prices are known
+        reference_prices = self._reference_prices(similar_products)
+        price_comment, price_point = self._price_comment(price, reference_prices)
+        score += price_point
 
         # Final assessment based on score
         if score >= 3:
@@ -39,7 +116,11 @@ class PriceQualityAgent:
         else:
             assessment = f"Fair value. The product {price_comment} Consider if its specific features meet your needs."
 
-        return {"assessment": assessment}
+        return {
+            "assessment": assessment,
+            "score": score,
+            "candidates": self.score_products(similar_products, reference_prices),
+        }
 
 # Singleton instance
-price_agent = PriceQualityAgent()
\ No newline at end of file
+price_agent = PriceQualityAgent()
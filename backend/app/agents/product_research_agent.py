@@ -1,16 +1,78 @@
-import torch
-from transformers import (
-    AutoProcessor,
-    Qwen2_5_VLForConditionalGeneration,
-    BitsAndBytesConfig
-)
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from PIL import Image
+from typing import Callable, List, Optional, Tuple
+import threading
+import time
 import warnings
-import traceback
+
+from app.core import config, tracing
+from app.core.batching import BatchingWorker
+from app.core.model_registry import model_registry
 
 # Suppress known warnings for a cleaner console
 warnings.filterwarnings("ignore", category=FutureWarning)
 
+class BatchTextStreamer:
+    """
+    Incrementally decodes a (possibly batched) `generate` call and forwards each
+    row's newly decoded text to that row's callback. Rows without a callback are ignored.
+    Unlike transformers' TextIteratorStreamer, this works with batch sizes above 1,
+    so token streaming does not have to give up micro-batching.
+    Implements the `put`/`end` interface of transformers' BaseStreamer, which
+    `generate` calls directly, so transformers need not be imported here.
+    """
+    def __init__(self, tokenizer, callbacks: List[Optional[Callable[[str], None]]]):
+        self.tokenizer = tokenizer
+        self.callbacks = list(callbacks)
+        self.token_cache = [[] for _ in self.callbacks]
+        self.printed_len = [0] * len(self.callbacks)
+        self.next_tokens_are_prompt = True
+        # When the first generated token arrived, i.e. when prefill ended (for tracing).
+        self.first_token_at = None
+
+    def _emit(self, row: int, text: str):
+        try:
+            self.callbacks[row](text)
+        except Exception as e:
+            # A slow or disconnected client must never break generation for the whole batch.
+            print(f"WARNING: [ProductResearchAgent] Dropping stream for batch row {row}: {e}")
+            self.callbacks[row] = None
+
+    def _flush_row(self, row: int, final: bool = False):
+        text = self.tokenizer.decode(self.token_cache[row], skip_special_tokens=True)
+        # Wait for the rest of a multi-byte character before emitting it.
+        if text.endswith("\ufffd") and not final:
+            return
+        new_text = text[self.printed_len[row]:]
+        if new_text:
+            self._emit(row, new_text)
+        # Start over at line breaks so decoding cost stays bounded for long answers.
+        if text.endswith("\n") or final:
+            self.token_cache[row] = []
+            self.printed_len[row] = 0
+        else:
+            self.printed_len[row] = len(text)
+
+    def put(self, value):
+        # The first call carries the prompt ids, which are not part of the answer.
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        for row, token in enumerate(value.reshape(-1).tolist()):
+            if self.callbacks[row] is None:
+                continue
+            self.token_cache[row].append(token)
+            self._flush_row(row)
+
+    def end(self):
+        for row, callback in enumerate(self.callbacks):
+            if callback is not None and self.token_cache[row]:
+                self._flush_row(row, final=True)
+        self.next_tokens_are_prompt = True
+
 class ProductResearchAgent:
     """
     An AI Agent that uses Qwen-VL to conduct deep analysis of product images.
@@ -18,18 +80,35 @@ class ProductResearchAgent:
     """
     def __init__(self, model_id="Qwen/Qwen2.5-VL-3B-Instruct"):
         self.model_id = model_id
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = None
         self.model = None
         self.processor = None
+        self.batcher = None
+        self._batcher_lock = threading.Lock()
         
-        # This will be called when the agent is initialized at app startup.
-        self._load_model_and_processor()
+        # The model is loaded on first use, or by the warm-up task started with the app.
+        # With MODEL_BACKEND=remote, 'qwen_vl' is a connection to the model server instead.
+        self.remote = config.MODEL_BACKEND == "remote"
+        model_registry.register("qwen_vl", self._connect_model_server if self.remote else self._load_model_and_processor)
+
+    def _connect_model_server(self):
+        from app.core.model_client import ModelServerClient
+
+        client = ModelServerClient(config.VLM_SERVER_ADDRESS, config.MODEL_SERVER_AUTHKEY, config.MODEL_SERVER_ALLOW_REMOTE)
+        client.ensure_serves("qwen_vl")
+        print(f"--- [ProductResearchAgent] Using the model server at {config.VLM_SERVER_ADDRESS} ---")
+        return client
 
     def _load_model_and_processor(self):
         """
         Loads the necessary model and processor components.
-        This is a resource-intensive operation.
+        This is a resource-intensive operation, run once through the model registry.
         """
+        # Imported here so that importing the app does not pay for torch/transformers.
+        import torch
+        from transformers import AutoProcessor, Qwen2_5_VLForConditionalGeneration, BitsAndBytesConfig
+
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
         print(f"--- [ProductResearchAgent] Initializing with model: {self.model_id} ---")
         print(f"--- [ProductResearchAgent] Using device: {self.device} ---")
 
@@ -43,44 +122,181 @@ class ProductResearchAgent:
                 bnb_4bit_compute_dtype=torch.float16,
             )
             
-            self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
+            model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
                 self.model_id,
                 quantization_config=quantization_config,
                 device_map="auto",
                 trust_remote_code=True,
             )
-            self.processor = AutoProcessor.from_pretrained(self.model_id, trust_remote_code=True)
+            processor = AutoProcessor.from_pretrained(self.model_id, trust_remote_code=True)
+            # Batched generation with a decoder-only model needs left padding.
+            processor.tokenizer.padding_side = "left"
             print("✅ [ProductResearchAgent] Model and processor loaded successfully.")
+            return model, processor
         except Exception as e:
             print("❌ FATAL ERROR: [ProductResearchAgent] Failed to initialize.")
             print(f"Error: {e}")
-            print("Full Traceback:")
-            traceback.print_exc()
-            self.model = None
-            self.processor = None
+            raise
 
-    async def analyze_product_image(self, image: Image.Image, query: str):
+    def _ensure_loaded(self) -> bool:
+        """Loads the model on first use and starts the batching worker."""
+        if self.model is None:
+            loaded = model_registry.get("qwen_vl")
+            if loaded is None:
+                return False
+            self.model, self.processor = loaded
+        with self._batcher_lock:
+            if self.batcher is None:
+                self.batcher = BatchingWorker(
+                    self._generate_batch,
+                    max_batch_size=config.VLM_MAX_BATCH_SIZE,
+                    max_wait_ms=config.VLM_MAX_WAIT_MS,
+                    name="vlm-batcher",
+                )
+        return True
+
+    def _build_prompt(self, query: str) -> str:
+        messages = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": query}]}]
+        return self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+    def _generate_batch(self, requests: List[Tuple[Image.Image, str, Optional[Callable[[str], None]], Optional[tracing.Trace]]]) -> List[str]:
         """
-        Analyzes a product image and yields the analysis.
+        Runs a single padded `generate` over several (image, query, on_chunk, trace) requests.
+        Requests with an `on_chunk` callback receive their decoded text as it is generated.
+        Called by the batching worker thread.
         """
-        if not self.model or not self.processor:
-            print("ERROR: [ProductResearchAgent] Analysis called but agent is not initialized.")
-            yield "Product Research Agent is not initialized. Please check server logs for errors."
-            return
+        print(f"--- [ProductResearchAgent] Generating batch of {len(requests)} request(s). ---")
+        started = time.perf_counter()
+        text_prompts = [self._build_prompt(query) for _, query, _, _ in requests]
+        images = [image for image, _, _, _ in requests]
+        callbacks = [on_chunk for _, _, on_chunk, _ in requests]
+        inputs = self.processor(text_prompts, images=images, padding=True, return_tensors="pt").to(self.device)
 
-        print(f"--- [ProductResearchAgent] Starting analysis for query: '{query[:30]}...' ---")
-        messages = [{"role": "user", "content": [{"type": "image"}, {"type": "text", "text": query}]}]
-        text_prompt = self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        inputs = self.processor(text_prompt, images=[image], return_tensors="pt").to(self.device)
+        streamer = None
+        # With tracing on, the streamer also marks the end of prefill.
+        if any(callbacks) or config.TRACING_ENABLED:
+            streamer = BatchTextStreamer(self.processor.tokenizer, callbacks)
 
-        generated_ids = self.model.generate(**inputs, max_new_tokens=1024, do_sample=False)
+        generate_started = time.perf_counter()
+        generated_ids = self.model.generate(
+            **inputs, max_new_tokens=config.VLM_MAX_NEW_TOKENS, do_sample=False, streamer=streamer
+        )
+        finished = time.perf_counter()
+        # Prompts are left-padded, so every row's answer starts at the same offset.
         input_token_len = inputs["input_ids"].shape[1]
         response_ids = generated_ids[:, input_token_len:]
-        
-        analysis = self.processor.batch_decode(response_ids, skip_special_tokens=True)[0]
+
+        if config.TRACING_ENABLED:
+            self._record_batch(requests, inputs, response_ids, started, generate_started,
+                               streamer.first_token_at or finished, finished)
+        return self.processor.batch_decode(response_ids, skip_special_tokens=True)
+
+    def _record_batch(self, requests, inputs, response_ids, started, generate_started, first_token_at, finished):
+        """Publishes preprocessing, prefill and decode timings and token counts of one batch."""
+        prefill_s, decode_s = first_token_at - generate_started, finished - first_token_at
+        tokens_in = inputs["attention_mask"].sum(dim=1).tolist()
+        pad_token_id = self.processor.tokenizer.pad_token_id
+        if pad_token_id is None:
+            tokens_out = [response_ids.shape[1]] * len(requests)
+        else:
+            tokens_out = (response_ids != pad_token_id).sum(dim=1).tolist()
+
+        for stage, seconds in (("vlm.preprocess", generate_started - started), ("vlm.prefill", prefill_s), ("vlm.decode", decode_s)):
+            tracing.STAGE_SECONDS.observe(seconds, stage=stage)
+        tracing.VLM_TOKENS.inc(sum(tokens_in), kind="prompt")
+        tracing.VLM_TOKENS.inc(sum(tokens_out), kind="generated")
+        if decode_s > 0:
+            tracing.VLM_TOKENS_PER_SECOND.observe(sum(tokens_out) / decode_s)
+
+        # Every request in the batch waited for the whole batch, so each one gets the batch timings.
+        for (_, _, _, trace), row_in, row_out in zip(requests, tokens_in, tokens_out):
+            if trace is None:
+                continue
+            trace.record("vlm.preprocess", generate_started - started, batch_size=len(requests))
+            trace.record("vlm.prefill", prefill_s, tokens_in=row_in)
+            trace.record("vlm.decode", decode_s, tokens_out=row_out,
+                         tokens_per_s=round(row_out / decode_s, 2) if decode_s > 0 else None)
+
+    def analyze_image(self, image: Image.Image, query: str, on_chunk: Optional[Callable[[str], None]] = None,
+                      start_deadline: Optional[float] = None):
+        """
+        Runs a blocking analysis of a product image and returns it as a dict.
+        Concurrent callers are grouped into one batched generation by the batching worker.
+        If `on_chunk` is given, it is called from the worker thread with each newly decoded piece of text.
+        If generation has not started by `start_deadline` (a time.monotonic() value), the request
+        is withdrawn from the batch queue and the analysis is None (local models only).
+        Intended to be called from a worker thread, not the event loop.
+        """
+        if self.remote:
+            client = model_registry.get("qwen_vl")
+            if client is None:
+                return {"analysis": "Product Research Agent cannot reach the model server. Please check server logs for errors."}
+            # Batching happens in the model server, across every API worker process.
+            with tracing.span("vlm.total"):
+                return {"analysis": client.analyze_image(image, query, on_chunk=on_chunk)}
+
+        if not self._ensure_loaded():
+            print("ERROR: [ProductResearchAgent] Analysis called but agent is not initialized.")
+            return {"analysis": "Product Research Agent is not initialized. Please check server logs for errors."}
+
+        print(f"--- [ProductResearchAgent] Starting analysis for query: '{query[:30]}...' ---")
+        # The batching thread records its stages on this request's trace.
+        with tracing.span("vlm.total") as vlm_span:
+            pending = self.batcher.submit((image, query, on_chunk, tracing.current_trace()))
+            try:
+                wait_s = None if start_deadline is None else max(0.0, start_deadline - time.monotonic())
+                analysis = pending.result(timeout=wait_s)
+            except FutureTimeoutError:
+                # Still queued: give up on it. Once a batch has picked it up, it is cheaper to finish.
+                if pending.cancel():
+                    vlm_span.set(withdrawn=True)
+                    print("--- [ProductResearchAgent] Request withdrawn: not started before its deadline. ---")
+                    return {"analysis": None}
+                analysis = pending.result()
         print(f"--- [ProductResearchAgent] Analysis generation complete. ---")
         
-        yield analysis
+        return {"analysis": analysis}
+
+    def batching_stats(self):
+        """Throughput and latency counters of the batching worker."""
+        return self.batcher.stats() if self.batcher else {}
+
+    async def analyze_product_image(self, image: Image.Image, query: str):
+        """
+        Analyzes a product image and yields the analysis incrementally, as decoded text chunks.
+        Generation runs on a worker thread so the event loop is not blocked.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        def on_chunk(text: str):
+            loop.call_soon_threadsafe(chunks.put_nowait, text)
+
+        started = time.perf_counter()
+        generation = asyncio.ensure_future(asyncio.to_thread(self.analyze_image, image, query, on_chunk))
+        streamed_chunks = 0
+        stream_span = tracing.span("vlm.stream")
+        try:
+            with stream_span:
+                while not generation.done() or not chunks.empty():
+                    next_chunk = asyncio.ensure_future(chunks.get())
+                    await asyncio.wait({next_chunk, generation}, return_when=asyncio.FIRST_COMPLETED)
+                    if not next_chunk.done():
+                        next_chunk.cancel()
+                        continue
+                    if not streamed_chunks:
+                        stream_span.set(first_chunk_ms=round((time.perf_counter() - started) * 1000, 3))
+                    streamed_chunks += 1
+                    yield next_chunk.result()
+                stream_span.set(chunks=streamed_chunks)
+
+            result = generation.result()
+            # Nothing is streamed when the agent is not initialized; yield its message instead.
+            if not streamed_chunks:
+                yield result["analysis"]
+        finally:
+            if not generation.done():
+                generation.cancel()
 
 # --- Global Agent Instance ---
 # The application will create one instance of this agent on startup.
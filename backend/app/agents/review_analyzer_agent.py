@@ -3,82 +3,416 @@
 # REASON: This fixes the 'AttributeError' by including the missing
 #         'analyze_with_image' method and improves error handling.
 
-import faiss
-from sentence_transformers import SentenceTransformer
 import numpy as np
-import json
 import os
+import threading
+import time
 from PIL import Image
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from app.core import config, tracing
+from app.core.cache import TieredCache, image_cache_key, image_thumbnail, normalize_text, thumbnails_match
+from app.core.lexical_index import query_terms, tokenize
+from app.core.catalog import (
+    CatalogConflict, CatalogVersion, current_version, load_version, prune_versions, publish,
+)
+from app.core.model_registry import model_registry
+from app.core.vector_index import distances_to_scores, exact_scores, prepare_vectors
 
 class ReviewAnalyzerAgent:
-    def __init__(self):
-        print("Initializing Review Analyzer Agent...")
+    # Metadata fields read for each search hit.
+    RESULT_COLUMNS = ("product_id", "product_title", "product_description", "image_url", "price")
+    # Weights of the scaled vector score, scaled BM25 score and title coverage in the hybrid re-rank.
+    RERANK_WEIGHTS = (0.5, 0.3, 0.2)
+
+    def __init__(self, rag_data_path: Optional[str] = None):
+        print("Initializing Review Analyzer Agent (models load on first use).")
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        self.rag_data_path = rag_data_path or os.path.join(current_dir, '..', 'rag_data')
+        # The live catalog version (index + metadata); replaced wholesale by updates and reloads.
+        self.catalog: Optional[CatalogVersion] = None
+        self.model = None
+        self._update_lock = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._last_reload_check = time.monotonic()
+        self.cache = TieredCache(
+            max_entries=config.REVIEW_CACHE_MAX_ENTRIES,
+            ttl_s=config.REVIEW_CACHE_TTL_S,
+            disk_path=config.REVIEW_CACHE_DISK_PATH or None,
+            disk_max_entries=config.REVIEW_CACHE_DISK_MAX_ENTRIES,
+            namespace="review",
+        )
+        model_registry.register("product_index", self._load_index)
+
+    def _load_index(self) -> CatalogVersion:
+        """Loads the live catalog version (FAISS index and product metadata). Registered with the model registry."""
         try:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            self.rag_data_path = os.path.join(current_dir, '..', 'rag_data')
-            self.index_path = os.path.join(self.rag_data_path, 'product_reviews.index')
-            self.data_path = os.path.join(self.rag_data_path, 'product_data.json')
+            catalog = load_version(self.rag_data_path)
+            print(f"Catalog version '{catalog.name}': {catalog.info['kind']} index ({catalog.info['metric']}), "
+                  f"{catalog.index.ntotal} vectors, metadata from {catalog.metadata.path}")
+        except Exception:
+            print("This might be because the 'ingest_data.py' script has not been run yet.")
+            raise
+        return catalog
 
-            print("Loading CLIP model for semantic search...")
-            self.model = SentenceTransformer('clip-ViT-B-32')
+    def _ensure_loaded(self) -> bool:
+        """Loads (or picks up the shared) CLIP model and the index on first use."""
+        if self.model is None:
+            self.model = model_registry.get("clip")
+        if self.catalog is None:
+            self.catalog = model_registry.get("product_index")
+        else:
+            self._maybe_reload()
+        return self.model is not None and self.catalog is not None
 
-            print(f"Loading FAISS index from {self.index_path}")
-            self.index = faiss.read_index(self.index_path)
+    # --- Catalog updates and hot reload ---
 
-            print(f"Loading product data from {self.data_path}")
-            with open(self.data_path, 'r', encoding='utf-8') as f:
-                self.product_data = json.load(f)
+    def _swap(self, catalog: CatalogVersion):
+        """Makes `catalog` the live version. Searches already running finish on the one they started with."""
+        previous = self.catalog.name if self.catalog else None
+        self.catalog = catalog
+        model_registry.override("product_index", catalog)
+        print(f"--- [ReviewAnalyzerAgent] Serving catalog version '{catalog.name}' (was '{previous}'). ---")
 
-            print("Review Analyzer Agent initialized successfully.")
-        except Exception as e:
-            print(f"ERROR during Review Analyzer Agent initialization: {e}")
-            print("This might be because the 'ingest_data.py' script has not been run yet.")
-            self.index = self.product_data = self.model = None
+    def _maybe_reload(self):
+        """Every INDEX_RELOAD_CHECK_S, checks for a version published elsewhere and loads it in the background."""
+        now = time.monotonic()
+        if config.INDEX_RELOAD_CHECK_S <= 0 or now - self._last_reload_check < config.INDEX_RELOAD_CHECK_S:
+            return
+        self._last_reload_check = now
+        if current_version(self.rag_data_path) == self.catalog.name:
+            return
+        if self._reload_thread is None or not self._reload_thread.is_alive():
+            self._reload_thread = threading.Thread(target=self.reload_index, name="index-reload", daemon=True)
+            self._reload_thread.start()
 
-    def _perform_search(self, query_embedding: np.ndarray, top_k: int):
-        """Helper function to perform search and format results."""
-        if not self.index or not self.product_data:
-            return {"summary": "Agent not initialized.", "top_products": []}
+    def reload_index(self) -> Dict[str, Any]:
+        """Loads the live version from disk if it is not the one being served, and swaps it in."""
+        with self._update_lock:
+            name = current_version(self.rag_data_path)
+            if self.catalog is None or self.catalog.name != name:
+                self._swap(load_version(self.rag_data_path, name))
+            return self.catalog.stats()
 
-        distances, indices = self.index.search(np.array(query_embedding, dtype='float32'), top_k)
-        
-        results = []
-        if indices.size == 0 or len(indices[0]) == 0:
-            return {"summary": "Couldn't find any matching products.", "top_products": []}
-
-        for i in range(len(indices[0])):
-            idx = indices[0][i]
-            if idx < len(self.product_data):
-                product = self.product_data[idx]
-                results.append({
+    def _publish(self, **changes) -> Dict[str, Any]:
+        """Publishes a new version with `changes` (see app.core.catalog.publish) and serves it."""
+        with self._update_lock:
+            try:
+                catalog, report = publish(self.catalog, **changes)
+            except CatalogConflict:
+                # Another process published first: build on top of its version instead.
+                self._swap(load_version(self.rag_data_path))
+                catalog, report = publish(self.catalog, **changes)
+            self._swap(catalog)
+        prune_versions(self.rag_data_path, config.INDEX_KEEP_VERSIONS)
+        return report
+
+    def add_products(self, records: Sequence[Dict[str, Any]], images: Sequence[Image.Image]) -> Dict[str, Any]:
+        """
+        Adds (or replaces, by product_id) products without rebuilding the index.
+        `images` are embedded with CLIP in one call; each record is the product's metadata.
+        """
+        if not self._ensure_loaded():
+            raise RuntimeError("Review Analyzer Agent is not initialized.")
+        with tracing.span("review.clip_encode", inputs=len(images)):
+            embeddings = np.asarray(self.model.encode(list(images)), dtype='float32')
+        return self._publish(add_records=records, add_embeddings=embeddings)
+
+    def delete_products(self, product_ids: Sequence[str]) -> Dict[str, Any]:
+        """Removes products from search results by product_id."""
+        if not self._ensure_loaded():
+            raise RuntimeError("Review Analyzer Agent is not initialized.")
+        return self._publish(delete_ids=product_ids)
+
+    def index_status(self) -> Dict[str, Any]:
+        """The version being served and the live version on disk."""
+        status = self.catalog.stats() if self.catalog else {"version": None}
+        status["version_on_disk"] = current_version(self.rag_data_path)
+        return status
+
+    def _query_key(self, query: Union[str, Image.Image]) -> str:
+        """Cache key of a text or image query."""
+        if isinstance(query, Image.Image):
+            return f"image:{image_cache_key(query, config.REVIEW_CACHE_IMAGE_HASH)}"
+        return f"text:{normalize_text(query)}"
+
+    @staticmethod
+    def _query_check(query: Union[str, Image.Image]) -> Optional[bytes]:
+        """What confirms a cache hit for `query`: a thumbnail for perceptually keyed images, else None."""
+        if isinstance(query, Image.Image) and config.REVIEW_CACHE_IMAGE_HASH == "perceptual":
+            return image_thumbnail(query)
+        return None
+
+    def _cache_get(self, key: str, check: Optional[bytes]):
+        """The cached value of `key`, if it was stored for a query matching `check` (see `_query_check`)."""
+        value = self.cache.get(key)
+        if check is None or value is None:
+            return value
+        # Entries of perceptual keys are (thumbnail, value); the key alone may belong to another image.
+        if isinstance(value, tuple) and len(value) == 2 and \
+                thumbnails_match(value[0], check, config.REVIEW_CACHE_PERCEPTUAL_MAX_DIFF):
+            return value[1]
+        return None
+
+    def _cache_set(self, key: str, value, check: Optional[bytes]):
+        self.cache.set(key, value if check is None else (check, value))
+
+    @staticmethod
+    def _lexical_texts(queries: Sequence[Union[str, Image.Image]], texts: Optional[Sequence[Optional[str]]],
+                       mode: str) -> List[Optional[str]]:
+        """
+        The keywords searched with BM25 for each query in hybrid mode: `texts[i]` if given,
+        else the query itself if it is a text. None where there is nothing to search.
+        """
+        if mode != "hybrid":
+            return [None] * len(queries)
+        keywords = []
+        for i, query in enumerate(queries):
+            text = texts[i] if texts and texts[i] else (query if isinstance(query, str) else None)
+            keywords.append(text if query_terms(text) else None)
+        return keywords
+
+    def _cached_search(self, queries: Sequence[Union[str, Image.Image]], top_k: int,
+                       texts: Optional[Sequence[Optional[str]]] = None, mode: Optional[str] = None) -> List[dict]:
+        """
+        Looks up search results for each query, falling back to the cached embedding
+        and finally to CLIP. All queries that still need an embedding are encoded in
+        one call, and all queries without cached results share one FAISS search.
+        `texts` and `mode` (default RETRIEVAL_MODE) select hybrid retrieval; see `_search_many`.
+        """
+        # One version for the whole batch, even if an update is swapped in meanwhile. Results are
+        # keyed by its fingerprint; embeddings depend on the query alone and outlive every version.
+        catalog = self.catalog
+
+        texts = self._lexical_texts(queries, texts, mode or config.RETRIEVAL_MODE)
+        keys = [
+            self._query_key(query) + (f":bm25:{normalize_text(text)}" if text else "")
+            for query, text in zip(queries, texts)
+        ]
+        checks = [self._query_check(query) for query in queries]
+        results = [self._cache_get(f"results:{catalog.fingerprint}:{key}:{top_k}", check)
+                   for key, check in zip(keys, checks)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            # Embeddings depend on the query alone, not on its keywords. Identical queries in
+            # one batch are encoded once; images sharing only a perceptual key are not identical.
+            embedding_keys = [(self._query_key(query), check) for query, check in zip(queries, checks)]
+            embeddings = {key: self._cache_get(f"embedding:{key[0]}", key[1])
+                          for key in {embedding_keys[i] for i in missing}}
+            to_encode = {}
+            for i in missing:
+                if embeddings[embedding_keys[i]] is None:
+                    to_encode.setdefault(embedding_keys[i], queries[i])
+            if to_encode:
+                with tracing.span("review.clip_encode", inputs=len(to_encode)):
+                    encoded = np.asarray(self.model.encode(list(to_encode.values())), dtype='float32')
+                for row, (key, check) in enumerate(to_encode):
+                    embeddings[key, check] = encoded[row:row + 1]
+                    self._cache_set(f"embedding:{key}", embeddings[key, check], check)
+
+            searched = self._search_many(np.vstack([embeddings[embedding_keys[i]] for i in missing]), top_k,
+                                         catalog=catalog, texts=[texts[i] for i in missing])
+            for i, result in zip(missing, searched):
+                results[i] = result
+                self._cache_set(f"results:{catalog.fingerprint}:{keys[i]}:{top_k}", result, checks[i])
+
+        # Hand out copies so callers cannot modify the cached entries.
+        return [{"summary": r["summary"], "top_products": [dict(p) for p in r["top_products"]]} for r in results]
+
+    def cache_stats(self):
+        """Hit/miss counters and sizes of the embedding and result cache."""
+        return self.cache.stats() if self.cache else {}
+
+    def _search_many(self, query_embeddings: np.ndarray, top_k: int, nprobe: int = None, ef_search: int = None,
+                     catalog: Optional[CatalogVersion] = None, texts: Optional[Sequence[Optional[str]]] = None) -> List[dict]:
+        """
+        Searches the index for every row of `query_embeddings` at once and formats one result per row.
+        `nprobe` (IVF) and `ef_search` (HNSW) trade recall for speed; they default to the configured values.
+        Deleted products are skipped by FAISS itself. `catalog` defaults to the live version.
+        Where `texts[i]` is set, query i is a hybrid query: its vector candidates are fused with
+        the BM25 matches of that text (see `_fuse`), and its hits also carry both component scores.
+        With a compressed index and full-precision vectors on disk, the index only proposes
+        candidates and their exact scores decide the ranking (see `_rescore`).
+        """
+        catalog = catalog or self.catalog
+        if catalog is None or not len(catalog.metadata):
+            return [{"summary": "Agent not initialized.", "top_products": []} for _ in range(len(query_embeddings))]
+
+        metric = catalog.info["metric"]
+        queries = prepare_vectors(query_embeddings, metric)
+        if len(queries) == 0:
+            return []
+        texts = list(texts) if texts else [None] * len(queries)
+        # Hybrid queries need a deeper candidate list for the fusion.
+        depth = max(top_k, config.HYBRID_CANDIDATES) if any(texts) else top_k
+        rescore = config.INDEX_RESCORE and catalog.vectors is not None
+        with tracing.span("review.faiss_search", queries=len(queries)):
+            distances, indices = catalog.index.search(
+                queries, depth * max(1, config.INDEX_RESCORE_FACTOR) if rescore else depth,
+                nprobe=nprobe or config.INDEX_NPROBE, ef_search=ef_search or config.INDEX_EF_SEARCH)
+        scores = distances_to_scores(distances, metric)
+
+        # FAISS pads with -1 when fewer than top_k neighbours were found.
+        valid = (indices >= 0) & (indices < len(catalog.metadata))
+        ranked = [(rows[keep], row_scores[keep]) for rows, row_scores, keep in zip(indices, scores, valid)]
+        if rescore:
+            with tracing.span("review.rescore", candidates=sum(len(rows) for rows, _ in ranked)):
+                ranked = self._rescore(catalog, queries, ranked, depth)
+        components = [None] * len(ranked)
+        if any(texts):
+            with tracing.span("review.hybrid_fusion", queries=sum(1 for text in texts if text)):
+                for i, text in enumerate(texts):
+                    if text:
+                        ranked[i], components[i] = self._fuse(catalog, *ranked[i], text, top_k)
+                    else:
+                        ranked[i] = (ranked[i][0][:top_k], ranked[i][1][:top_k])
+
+        # Products hit by several queries are read from the metadata store once.
+        unique_rows, hit_product = np.unique(np.concatenate([rows for rows, _ in ranked]), return_inverse=True)
+        with tracing.span("review.metadata_fetch", rows=len(unique_rows)):
+            products = [
+                {
                     "product_id": product.get("product_id", "N/A"),
                     "product_title": product.get("product_title", "No Title"),
                     "review_snippet": product.get("product_description", "No Description"),
                     "image_url": product.get("image_url", ""),
-                    "relevance_score": float(1 - distances[0][i])
-                })
-        
-        if not results:
-            return {"summary": "Couldn't find any matching products.", "top_products": []}
+                    # Only catalogs ingested with prices have them.
+                    "price": product.get("price"),
+                }
+                for product in catalog.metadata.get_many(unique_rows, columns=self.RESULT_COLUMNS)
+            ]
+        hit_product = hit_product.tolist()
+        hit_score = np.concatenate([row_scores.astype(np.float64) for _, row_scores in ranked]).tolist()
+
+        all_results, position = [], 0
+        for (rows, _), extra in zip(ranked, components):
+            count = len(rows)
+            hits = [
+                dict(products[product], relevance_score=score)
+                for product, score in zip(hit_product[position:position + count], hit_score[position:position + count])
+            ]
+            position += count
+            for hit, scores_of_hit in zip(hits, extra or []):
+                hit.update(scores_of_hit)
+            if hits:
+                summary = f"Found several similar products. The top match is '{hits[0]['product_title']}'."
+                all_results.append({"summary": summary, "top_products": hits})
+            else:
+                all_results.append({"summary": "Couldn't find any matching products.", "top_products": []})
+        return all_results
+
+    @staticmethod
+    def _rescore(catalog: CatalogVersion, queries: np.ndarray, ranked, keep: int):
+        """
+        Re-scores each query's candidates with the full-precision vectors and keeps the best `keep`,
+        as (rows, scores). Rows wanted by several queries are read from disk once, in file order.
+        """
+        unique_rows, position = np.unique(np.concatenate([rows for rows, _ in ranked]), return_inverse=True)
+        vectors = catalog.vectors.take(unique_rows)
+        metric = catalog.info["metric"]
+        rescored, offset = [], 0
+        for query, (rows, _) in zip(queries, ranked):
+            exact = exact_scores(query, vectors[position[offset:offset + len(rows)]], metric)
+            offset += len(rows)
+            order = np.argsort(-exact, kind="stable")[:keep]
+            rescored.append((rows[order], exact[order].astype(np.float32)))
+        return rescored
 
-        summary = f"Found several similar products. The top match is '{results[0]['product_title']}'."
-        return {"summary": summary, "top_products": results}
+    def _fuse(self, catalog: CatalogVersion, vector_rows: np.ndarray, vector_scores: np.ndarray, text: str, top_k: int):
+        """
+        Merges one query's vector candidates with the BM25 matches of `text` by reciprocal rank
+        fusion, re-ranks them if HYBRID_RERANK is on, and returns the best `top_k` as
+        (rows, scores) plus the vector and BM25 score of each. The vector list is cut to
+        max(top_k, HYBRID_CANDIDATES), as it was retrieved, and the BM25 list to HYBRID_CANDIDATES,
+        which bounds the work per query.
+        """
+        depth = max(top_k, config.HYBRID_CANDIDATES)
+        vector_rows, vector_scores = vector_rows[:depth], vector_scores[:depth]
+        lexical_rows, lexical_scores = catalog.lexical.search(text, config.HYBRID_CANDIDATES, exclude=catalog.tombstone_rows)
+        if not len(lexical_rows):
+            return (vector_rows[:top_k], vector_scores[:top_k]), None
+
+        # The BM25 ranking counts in proportion to how selective the query's words are, so
+        # words found all over the catalog do not displace visually closer products.
+        lexical_weight = catalog.lexical.specificity(text)
+        candidates = np.union1d(vector_rows, lexical_rows)
+        vector_at, lexical_at = np.searchsorted(candidates, vector_rows), np.searchsorted(candidates, lexical_rows)
+        fused = np.zeros(len(candidates))
+        fused[vector_at] += 1.0 / (config.HYBRID_RRF_K + np.arange(1, len(vector_rows) + 1))
+        fused[lexical_at] += lexical_weight / (config.HYBRID_RRF_K + np.arange(1, len(lexical_rows) + 1))
+        vector = np.full(len(candidates), np.nan)
+        vector[vector_at] = vector_scores
+        lexical = np.zeros(len(candidates))
+        lexical[lexical_at] = lexical_scores
+        if config.HYBRID_RERANK:
+            with tracing.span("review.rerank", candidates=len(candidates)):
+                fused = self._rerank(catalog, text, candidates, vector, lexical, lexical_weight)
+
+        top = np.argsort(-fused, kind="stable")[:top_k]
+        components = [
+            {"vector_score": None if np.isnan(v) else round(v, 4), "lexical_score": round(l, 4)}
+            for v, l in zip(vector[top].tolist(), lexical[top].tolist())
+        ]
+        return (candidates[top], fused[top]), components
+
+    def _rerank(self, catalog: CatalogVersion, text: str, candidates: np.ndarray, vector: np.ndarray,
+                lexical: np.ndarray, specificity: float) -> np.ndarray:
+        """
+        Scores fused candidates by their vector similarity and BM25 score, each scaled to [0, 1]
+        over the candidates, and by the share of the query's terms found in their title
+        (weighted by RERANK_WEIGHTS, the two text signals also by the query's `specificity`).
+        A candidate found only by BM25 is given the lowest vector score retrieved, which its
+        own similarity does not exceed.
+        """
+        retrieved = vector[~np.isnan(vector)]
+        vector = np.where(np.isnan(vector), retrieved.min() if len(retrieved) else 0.0, vector)
+
+        def scaled(values: np.ndarray) -> np.ndarray:
+            spread = values.max() - values.min()
+            return (values - values.min()) / spread if spread > 0 else np.zeros_like(values)
+
+        terms = set(query_terms(text))
+        titles = [row.get("product_title") for row in catalog.metadata.get_many(candidates, columns=("product_title",))]
+        coverage = np.array([len(terms.intersection(tokenize(title if isinstance(title, str) else None))) / len(terms)
+                             for title in titles])
+        vector_weight, lexical_weight, title_weight = self.RERANK_WEIGHTS
+        return (vector_weight * scaled(vector)
+                + specificity * (lexical_weight * scaled(lexical) + title_weight * coverage))
+
+    def _perform_search(self, query_embedding: np.ndarray, top_k: int, nprobe: int = None, ef_search: int = None):
+        """Searches for a single query embedding; see `_search_many`."""
+        return self._search_many(query_embedding.reshape(1, -1), top_k, nprobe=nprobe, ef_search=ef_search)[0]
 
     def analyze(self, query: str, top_k: int = 5):
         """Analyzes a text query to find relevant products."""
         print(f"Agent received text query: '{query}'")
-        if not self.model: return {"summary": "Agent not initialized.", "top_products": []}
+        if not self._ensure_loaded(): return {"summary": "Agent not initialized.", "top_products": []}
         
-        query_embedding = self.model.encode([query])
-        return self._perform_search(query_embedding, top_k)
+        return self._cached_search([query], top_k)[0]
 
-    def analyze_with_image(self, image: Image.Image, top_k: int = 5):
-        """Analyzes an image to find visually similar products."""
+    def analyze_with_image(self, image: Image.Image, top_k: int = 5, query: Optional[str] = None):
+        """
+        Analyzes an image to find visually similar products. In hybrid mode, products whose
+        title or description match the words of `query` (e.g. a brand or model) are fused in.
+        """
         print("Agent received image for similarity search.")
-        if not self.model: return {"summary": "Agent not initialized.", "top_products": []}
+        if not self._ensure_loaded(): return {"summary": "Agent not initialized.", "top_products": []}
+
+        return self._cached_search([image], top_k, texts=[query])[0]
+
+    def analyze_batch(self, queries: Sequence[Union[str, Image.Image]], top_k: int = 5,
+                      texts: Optional[Sequence[Optional[str]]] = None, mode: Optional[str] = None) -> List[dict]:
+        """
+        Searches for many queries at once: texts, images, or a mix of both.
+        `texts[i]` optionally gives keywords for query i's lexical search (hybrid mode);
+        `mode` is 'hybrid' or 'vector' (default RETRIEVAL_MODE).
+        Returns one result per query, in order, shaped like the result of `analyze`.
+        """
+        print(f"Agent received a batch of {len(queries)} queries.")
+        if not self._ensure_loaded():
+            return [{"summary": "Agent not initialized.", "top_products": []} for _ in queries]
 
-        image_embedding = self.model.encode([image])
-        return self._perform_search(image_embedding, top_k)
+        return self._cached_search(list(queries), top_k, texts=texts, mode=mode)
 
 # Singleton instance of the agent
 review_agent = ReviewAnalyzerAgent()
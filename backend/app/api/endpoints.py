@@ -1,40 +1,188 @@
-from fastapi import APIRouter, Form, File, UploadFile
-from fastapi.responses import StreamingResponse
-from PIL import Image
-from io import BytesIO
-import json
+from fastapi import APIRouter, Form, File, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
 import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import time
+import traceback
 import uuid
+import weakref
+from typing import Optional
 
 # Import your context schema and agent instances
-from app.core.context import ProductContext
+from app.core import config, sse, tracing
+from app.core.admission import AdmissionController, AdmissionRejected
+from app.core.cache import normalize_text
+from app.core.catalog import CatalogError
+from app.core.context import AgentOutput, BatchSearchRequest, IndexAddRequest, IndexDeleteRequest, ProductContext
+from app.core.image_io import (
+    DecodedImage, UnsupportedImage, UploadTooLarge, decode_for_clip, decode_for_models, read_upload,
+)
+from app.core.model_registry import model_registry
+from app.core.single_flight import SingleFlight
+from app.agents.lead_agent import lead_agent
 from app.agents.product_research_agent import product_agent
+from app.agents.review_analyzer_agent import review_agent
 
 router = APIRouter()
 
-# The research pipeline stream function remains the same
-async def research_pipeline_stream_mcp(context: ProductContext, image: Image.Image):
+# Bounds concurrent and queued work; see app.core.admission.
+admission = AdmissionController(
+    lanes={
+        "search": {"priority": 0, "max_active": config.ADMISSION_MAX_ACTIVE_SEARCH},
+        "full": {"priority": 1, "max_active": config.ADMISSION_MAX_ACTIVE_FULL},
+    },
+    max_active=config.ADMISSION_MAX_ACTIVE,
+    max_queue=config.ADMISSION_MAX_QUEUE,
+    max_per_client=config.ADMISSION_MAX_PER_CLIENT,
+)
+
+# Concurrent identical analyses share one LeadAgent run; see _analysis_key.
+analysis_flights = SingleFlight(max_results=config.ANALYSIS_MAX_RESULTS, result_ttl_s=config.ANALYSIS_RESULT_TTL_S)
+
+
+def _analysis_key(image_bytes: bytes, query: str, price: float, budget: float, latency_budget_ms: float):
+    """Requests with the same key produce the same LeadAgent events."""
+    return hashlib.sha1(image_bytes).hexdigest(), normalize_text(query), float(price), float(budget), latency_budget_ms
+
+
+def _replayable(events) -> bool:
+    """Only a complete analysis is replayed: not one that missed its latency budget (e.g. under load)."""
+    if any(event['status'] in ('deferred', 'late') for event in events):
+        return False
+    return any(event['status'] == 'complete' and not event['output']['visual_summary_deferred'] for event in events)
+
+
+def _client_id(request: Request) -> str:
+    """Identifies the caller for per-client admission limits."""
+    if config.ADMISSION_CLIENT_HEADER and request.headers.get(config.ADMISSION_CLIENT_HEADER):
+        return request.headers[config.ADMISSION_CLIENT_HEADER].split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+def _rejected(e: AdmissionRejected) -> JSONResponse:
+    return JSONResponse(status_code=e.status_code, content={"message": str(e)},
+                        headers={"Retry-After": str(e.retry_after)})
+
+
+def _apply_agent_event(context: ProductContext, event: dict):
+    """Records a LeadAgent progress event on the shared context."""
+    agent, status, output = event['agent'], event['status'], event.get('output')
+    if event.get('timings'):
+        context.timings.update(event['timings'])
+    if status == 'thinking':
+        context.agent_outputs[agent] = AgentOutput()
+    elif status == 'responded':
+        context.agent_outputs[agent] = AgentOutput(message=output)
+        if agent == 'ProductResearcher':
+            context.identified_product.visual_summary = output
+        elif agent == 'PriceQuality':
+            context.identified_product.value_assessment = output
+    elif status == 'deferred':
+        context.agent_outputs[agent] = AgentOutput(message=output, data={"deferred": True})
+    elif status == 'late':
+        # The visual analysis that missed the latency budget replaces the catalog-based stand-in.
+        context.agent_outputs[agent] = AgentOutput(message=output)
+        context.identified_product.visual_summary = output
+        context.identified_product.visual_summary_deferred = False
+        lead = context.agent_outputs.get('LeadAgent')
+        if lead is not None and lead.data is not None:
+            lead.data.update(visual_summary=output, visual_summary_deferred=False)
+    elif status == 'complete':
+        context.identified_product.title = output['title']
+        context.identified_product.visual_summary = output['visual_summary']
+        context.identified_product.visual_summary_deferred = output['visual_summary_deferred']
+        context.agent_outputs[agent] = AgentOutput(message=output['review_summary'], data=output)
+
+
+async def research_pipeline_stream_mcp(context: ProductContext, image: DecodedImage, key, delivery: dict = None,
+                                       deadline: float = None, protocol: str = "snapshot", events=None):
     """
     The agentic workflow, driven by the Model Context Protocol.
+    Every agent update is recorded on the context and streamed as a `context_update`;
+    text generated by the ProductResearcher is forwarded as it is decoded in `partial` events.
+    Requests with the same `key` subscribe to a single LeadAgent run and receive the same events.
+    `delivery` is the counter filled in by `_timed_delivery`, reported in the final timings.
+    If the visual analysis misses `deadline`, `final_recommendation` is sent without it and the
+    analysis may follow in a `visual_summary` event.
+    With the 'delta' `protocol`, context events after the first carry only what changed (see app.core.sse).
+    `events` is a subscription already taken with `analysis_flights.join`, if any.
     """
-    # (No changes needed inside this function)
+    context_events = sse.ContextEvents(protocol)
+    if events is None:
+        events = analysis_flights.stream(key, lambda: lead_agent.run_analysis_events(
+            context.user_query, image.vlm, context.identified_product.identified_price, context.user_budget,
+            clip_image=image.clip, deadline=deadline,
+        ), cacheable=_replayable)
     try:
         # --- Stage 1: Lead Agent validates inputs and starts the process ---
-        yield f"event: context_update\ndata: {context.model_dump_json()}\n\n"
-        
-        if not product_agent.model:
-            # ... (rest of the logic)
-            return
-
-        # ... (rest of your agent logic) ...
-        
-        # --- Final Recommendation Synthesis ---
-        context.final_recommendation = f"Based on the analysis, the '{context.identified_product.title}' seems to be a good choice for you."
-        yield f"event: final_recommendation\ndata: {context.model_dump_json()}\n\n"
+        yield context_events.format("context_update", context)
+
+        async for event in events:
+            if event['status'] == 'partial':
+                # Only the new text is sent; the full analysis arrives with the next context_update.
+                yield sse.format_event("partial", sse.dumps({'agent': event['agent'], 'delta': event['output']}))
+                continue
+
+            _apply_agent_event(context, event)
+            if event['status'] == 'late':
+                yield context_events.format("visual_summary", context)
+            elif event['status'] != 'complete':
+                yield context_events.format("context_update", context)
+            else:
+                # --- Final Recommendation Synthesis ---
+                context.final_recommendation = f"Based on the analysis, the '{context.identified_product.title}' seems to be a good choice for you."
+                if config.TRACING_ENABLED and delivery is not None:
+                    context.timings["sse.delivery"] = {"ms": round(delivery["seconds"] * 1000, 3), "events": delivery["events"]}
+                yield context_events.format("final_recommendation", context)
 
     except Exception as e:
-        # ... (error handling logic)
-        pass
+        print(f"ERROR: Research pipeline failed for session {context.session_id}: {e}")
+        traceback.print_exc()
+        yield sse.format_event("error", sse.dumps({'message': str(e)}))
+    finally:
+        # Unsubscribe right away when the client disconnects, so an abandoned run can be cancelled.
+        await events.aclose()
+
+
+async def _timed_delivery(messages, delivery: dict):
+    """Passes SSE messages through, adding up how long the client connection took to accept them."""
+    try:
+        async for message in messages:
+            sent = time.perf_counter()
+            yield message
+            delivery["seconds"] += time.perf_counter() - sent
+            delivery["events"] += 1
+    finally:
+        await messages.aclose()
+        tracing.record("sse.delivery", delivery["seconds"])
+
+
+async def _admitted_stream(ticket, context: ProductContext, messages):
+    """
+    While the request waits for an admission slot, streams `queued` events with its
+    position; then streams `messages`. The slot is released when the stream ends.
+    """
+    try:
+        if ticket is not None:
+            try:
+                async for position in ticket.positions(config.ADMISSION_MAX_WAIT_S):
+                    yield sse.format_event("queued", sse.dumps({'position': position, 'lane': ticket.lane.name}))
+            except AdmissionRejected as e:
+                yield sse.format_event("error", sse.dumps({'message': str(e), 'retry_after': e.retry_after}))
+                return
+            if config.TRACING_ENABLED:
+                wait_s = ticket.admitted_at - ticket.enqueued_at
+                tracing.record("admission.queue_wait", wait_s)
+                context.timings["admission.queue_wait"] = {"ms": round(wait_s * 1000, 3)}
+        async for message in messages:
+            yield message
+    finally:
+        await messages.aclose()
+        if ticket is not None:
+            ticket.release()
 
 
 # =========================================================
@@ -43,16 +191,60 @@ async def research_pipeline_stream_mcp(context: ProductContext, image: Image.Ima
 # =========================================================
 @router.post("/get-recommendation")
 async def run_product_research(
+    request: Request,
     query: str = Form(...),
     price: float = Form(...), 
     budget: float = Form(...),
-    image_file: UploadFile = File(...)
+    image_file: UploadFile = File(...),
+    latency_budget_ms: Optional[float] = Query(None, ge=0),
+    protocol: str = Query("snapshot", pattern="^(snapshot|delta)$"),
 ):
     """
     This endpoint initializes the Context and starts the agent workflow.
+    Requests go through admission control: they may wait in a queue (reported with
+    `queued` events) or be rejected right away with 429/503 and Retry-After.
+    With a latency budget (`latency_budget_ms`, default LATENCY_BUDGET_MS, 0 = none),
+    the final recommendation is sent within it, without the visual analysis if need be.
+    With `protocol=delta`, context events after the first are JSON patches (see app.core.sse).
+    The stream is gzip-encoded when the client accepts it and SSE_COMPRESSION is 'gzip'.
     """
-    image_bytes = await image_file.read()
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    arrived = time.monotonic()
+    request_trace = tracing.new_trace()
+    try:
+        with tracing.span("upload.read", trace=request_trace):
+            image_bytes = await read_upload(image_file, config.UPLOAD_MAX_BYTES)
+    except UploadTooLarge as e:
+        return JSONResponse(status_code=413, content={"message": str(e)})
+
+    if latency_budget_ms is None:
+        latency_budget_ms = config.LATENCY_BUDGET_MS
+    deadline = None
+    if latency_budget_ms > 0:
+        deadline = arrived + max(0.0, latency_budget_ms - config.LATENCY_BUDGET_RESERVE_MS) / 1000
+
+    key = _analysis_key(image_bytes, query, price, budget, latency_budget_ms)
+    # Joining an identical analysis that is already running (or just finished) adds no work,
+    # so it needs no admission slot. The subscription is taken here, in the same step as
+    # the check, so it cannot turn into a new run; anything else must be admitted.
+    ticket, joined = None, analysis_flights.join(key)
+    if joined is None:
+        try:
+            ticket = admission.enter(_client_id(request), "full")
+        except AdmissionRejected as e:
+            return _rejected(e)
+
+    try:
+        # Decoding is CPU-bound; keep it off the event loop.
+        with tracing.span("upload.decode", trace=request_trace):
+            decoded = await asyncio.to_thread(
+                decode_for_models, image_bytes, config.VLM_IMAGE_MAX_SIDE, config.CLIP_IMAGE_SIZE, config.UPLOAD_MAX_PIXELS
+            )
+    except UnsupportedImage as e:
+        if ticket is not None:
+            ticket.release()
+        if joined is not None:
+            await joined.aclose()
+        return JSONResponse(status_code=400, content={"message": str(e)})
 
     initial_context = ProductContext(
         session_id=str(uuid.uuid4()),
@@ -60,9 +252,215 @@ async def run_product_research(
         user_budget=budget
     )
     initial_context.identified_product.identified_price = price
+    if request_trace is not None:
+        initial_context.timings.update(request_trace.summary())
+
+    delivery = {"seconds": 0.0, "events": 0}
+    pipeline = research_pipeline_stream_mcp(initial_context, decoded, key, delivery, deadline, protocol, joined)
+    stream = _admitted_stream(ticket, initial_context, pipeline)
+    if ticket is not None:
+        # If the client is gone before the stream ever starts, its finally block never
+        # runs; free the slot when the stream object is dropped instead.
+        weakref.finalize(stream, ticket.release)
+    body, headers = _timed_delivery(stream, delivery), {"Vary": "Accept-Encoding"}
+    if config.SSE_COMPRESSION == "gzip" and sse.accepts_gzip(request.headers.get("accept-encoding")):
+        body = sse.gzip_stream(body, config.SSE_COMPRESSION_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type="text/event-stream", headers=headers)
+
+
+def _decode_search_queries(request: BatchSearchRequest):
+    """Turns the request's queries into the texts and PIL images `analyze_batch` expects."""
+    queries = []
+    for position, query in enumerate(request.queries):
+        if (query.text is None) == (query.image_base64 is None):
+            raise ValueError(f"Query {position} must have exactly one of 'text' or 'image_base64'.")
+        if query.text is not None:
+            queries.append(query.text)
+            continue
+        try:
+            data = base64.b64decode(query.image_base64, validate=True)
+            queries.append(decode_for_clip(data, config.CLIP_IMAGE_SIZE, config.UPLOAD_MAX_PIXELS))
+        except (binascii.Error, UnsupportedImage) as e:
+            raise ValueError(f"Query {position} is not a valid base64-encoded image: {e}")
+    return queries
+
+
+@router.post("/search/batch")
+async def batch_search(request: BatchSearchRequest, http_request: Request):
+    """
+    Similarity search for many text and/or image queries in one request.
+    All queries are embedded in one CLIP call and searched with one FAISS call. In hybrid mode,
+    text queries and queries with `keywords` are also matched against product text (BM25).
+    Runs in the high-priority 'search' admission lane.
+    """
+    if len(request.queries) > config.SEARCH_BATCH_MAX_QUERIES:
+        return JSONResponse(status_code=413, content={
+            "message": f"At most {config.SEARCH_BATCH_MAX_QUERIES} queries per request."})
+    if not 1 <= request.top_k <= config.SEARCH_MAX_TOP_K:
+        return JSONResponse(status_code=400, content={
+            "message": f"top_k must be between 1 and {config.SEARCH_MAX_TOP_K}."})
+    if request.mode not in (None, "hybrid", "vector"):
+        return JSONResponse(status_code=400, content={"message": "mode must be 'hybrid' or 'vector'."})
+
+    def search():
+        # Image decoding, encoding and search are all blocking; keep them off the event loop.
+        return review_agent.analyze_batch(_decode_search_queries(request), top_k=request.top_k,
+                                          texts=[query.keywords for query in request.queries], mode=request.mode)
+
+    try:
+        ticket = admission.enter(_client_id(http_request), "search")
+    except AdmissionRejected as e:
+        return _rejected(e)
+    try:
+        await ticket.wait(config.ADMISSION_MAX_WAIT_S)
+        results = await asyncio.to_thread(search)
+    except AdmissionRejected as e:
+        return _rejected(e)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    finally:
+        ticket.release()
+    return {"results": results}
+
+
+def _admin_denied(request: Request):
+    """
+    A 403 response unless the request carries INDEX_ADMIN_TOKEN in X-Admin-Token, else None.
+    With no token configured, every request is denied unless INDEX_ADMIN_OPEN is set.
+    """
+    if not config.INDEX_ADMIN_TOKEN:
+        if config.INDEX_ADMIN_OPEN:
+            return None
+        return JSONResponse(status_code=403, content={
+            "message": "Index updates are disabled: set INDEX_ADMIN_TOKEN (or INDEX_ADMIN_OPEN=1) to enable them."})
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode(), config.INDEX_ADMIN_TOKEN.encode()):
+        return JSONResponse(status_code=403, content={"message": "A valid X-Admin-Token header is required."})
+    return None
 
-    return StreamingResponse(
-        research_pipeline_stream_mcp(initial_context, image),
-        media_type="text/event-stream"
-    )
 
+@router.get("/index")
+async def index_status():
+    """
+    The catalog version being served (rows, tombstoned rows and live products) and the live version on disk.
+    """
+    return review_agent.index_status()
+
+
+@router.post("/index/products")
+async def add_products(request: IndexAddRequest, http_request: Request):
+    """
+    Adds products to the search index, or replaces them by product_id, without a restart.
+    The update is published as a new catalog version and swapped in while searches continue.
+    """
+    denied = _admin_denied(http_request)
+    if denied is not None:
+        return denied
+    if not 1 <= len(request.products) <= config.INDEX_UPDATE_MAX_PRODUCTS:
+        return JSONResponse(status_code=413, content={
+            "message": f"Send between 1 and {config.INDEX_UPDATE_MAX_PRODUCTS} products per request."})
+
+    def update():
+        records, images = [], []
+        for position, product in enumerate(request.products):
+            try:
+                data = base64.b64decode(product.image_base64, validate=True)
+                images.append(decode_for_clip(data, config.CLIP_IMAGE_SIZE, config.UPLOAD_MAX_PIXELS))
+            except (binascii.Error, UnsupportedImage) as e:
+                raise ValueError(f"Product {position} does not have a valid base64-encoded image: {e}")
+            records.append(product.model_dump(exclude={"image_base64"}, exclude_none=True))
+        return review_agent.add_products(records, images)
+
+    try:
+        # Decoding, embedding and writing the new version are all blocking.
+        return await asyncio.to_thread(update)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+    except (CatalogError, RuntimeError) as e:
+        return JSONResponse(status_code=503, content={"message": str(e)})
+
+
+@router.post("/index/products/delete")
+async def delete_products(request: IndexDeleteRequest, http_request: Request):
+    """
+    Removes products from search results by product_id, as a new catalog version.
+    """
+    denied = _admin_denied(http_request)
+    if denied is not None:
+        return denied
+    try:
+        return await asyncio.to_thread(review_agent.delete_products, request.product_ids)
+    except (CatalogError, RuntimeError) as e:
+        return JSONResponse(status_code=503, content={"message": str(e)})
+
+
+@router.post("/index/reload")
+async def reload_index(http_request: Request):
+    """
+    Swaps in the live catalog version on disk now (e.g. one written by scripts/update_index.py),
+    instead of waiting for the periodic check.
+    """
+    denied = _admin_denied(http_request)
+    if denied is not None:
+        return denied
+    try:
+        return await asyncio.to_thread(review_agent.reload_index)
+    except (RuntimeError, OSError) as e:
+        return JSONResponse(status_code=503, content={"message": str(e)})
+
+
+@router.get("/stats/vlm-batching")
+async def vlm_batching_stats():
+    """
+    Throughput and latency counters of the ProductResearchAgent batching worker.
+    """
+    return product_agent.batching_stats()
+
+
+@router.get("/stats/admission")
+async def admission_stats():
+    """
+    Running and queued requests per lane, and how many were admitted, queued or rejected.
+    """
+    return admission.stats()
+
+
+@router.get("/stats/coalescing")
+async def coalescing_stats():
+    """
+    How many analyses were started, joined while running, or replayed from recent results.
+    """
+    return analysis_flights.stats()
+
+
+@router.get("/stats/review-cache")
+async def review_cache_stats():
+    """
+    Hit/miss counters and sizes of the ReviewAnalyzerAgent embedding and result cache.
+    """
+    return review_agent.cache_stats()
+
+
+@router.get("/health")
+async def health():
+    """
+    Liveness check: the API process is up. Does not wait for models.
+    """
+    return {"status": "ok", "models": model_registry.status()}
+
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness check: 200 once every warm-up model is loaded, 503 (with per-model state) until then.
+    """
+    models = model_registry.status()
+    required = config.MODEL_WARMUP or list(models)
+    if model_registry.is_ready(required):
+        status = "ready"
+    elif any(models.get(name, {}).get("state") == "failed" for name in required):
+        status = "failed"
+    else:
+        status = "loading"
+    return JSONResponse(status_code=200 if status == "ready" else 503, content={"status": status, "models": models})
@@ -0,0 +1,197 @@
+import asyncio
+import bisect
+import itertools
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+
+class AdmissionRejected(Exception):
+    """
+    The request cannot be queued. `status_code` is 429 when the client is over
+    its own limit and 503 when the server is saturated; `retry_after` is a hint in seconds.
+    """
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Lane:
+    """A class of requests: lower `priority` values are admitted first."""
+    def __init__(self, name: str, priority: int, max_active: int):
+        self.name = name
+        self.priority = priority
+        self.max_active = max_active
+        self.active = 0
+        # Smoothed service time, used for Retry-After hints.
+        self.avg_service_s = 1.0
+
+
+class Ticket:
+    """One request's place in the admission controller: queued, then active, then released."""
+    def __init__(self, controller: "AdmissionController", lane: Lane, client: str, order: tuple):
+        self.controller = controller
+        self.lane = lane
+        self.client = client
+        self.order = order
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        self.released = False
+        self._changed = asyncio.Event()
+
+    @property
+    def admitted(self) -> bool:
+        return self.admitted_at is not None
+
+    def position(self) -> int:
+        """1-based position among queued requests (0 once admitted)."""
+        return 0 if self.admitted else self.controller._position(self)
+
+    async def positions(self, timeout_s: float):
+        """
+        Yields this ticket's queue position every time it changes, until the ticket
+        is admitted. Raises AdmissionRejected if that takes longer than `timeout_s`.
+        """
+        deadline = self.enqueued_at + timeout_s
+        last = None
+        while not self.admitted:
+            # Cleared before reading the state, so a change while we yield is not missed.
+            self._changed.clear()
+            position = self.position()
+            if position != last:
+                last = position
+                yield position
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.controller._counters["timed_out"] += 1
+                self.release()
+                raise AdmissionRejected("Timed out waiting in the queue.", 503, self.controller._retry_after(self.lane))
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait(self, timeout_s: float):
+        """Waits until the ticket is admitted (see `positions`)."""
+        async for _ in self.positions(timeout_s):
+            pass
+
+    def release(self):
+        """Frees the ticket's slot (or queue place). Safe to call more than once."""
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Bounds how much work runs at once and how much waits.
+
+    - At most `max_active` requests run at a time, and at most `lane.max_active`
+      of them in each lane (so cheap lanes keep headroom next to expensive ones).
+    - Up to `max_queue` more wait; queued requests are admitted by lane priority,
+      then in arrival order.
+    - Each client may hold at most `max_per_client` running or queued requests.
+
+    Requests beyond these limits are rejected immediately instead of piling up.
+    All methods must be used from a single event loop.
+    """
+    def __init__(self, lanes: Dict[str, Dict[str, int]], max_active: int, max_queue: int, max_per_client: int):
+        self.lanes = {name: Lane(name, spec["priority"], spec["max_active"]) for name, spec in lanes.items()}
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_per_client = max_per_client
+        self.active = 0
+        self._queue: List[tuple] = []          # sorted (priority, sequence, ticket)
+        self._per_client: Dict[str, int] = {}
+        self._sequence = itertools.count()
+        self._counters = {"admitted": 0, "queued": 0, "rejected_client": 0, "rejected_full": 0, "timed_out": 0}
+
+    def _retry_after(self, lane: Lane) -> int:
+        """Rough time until a slot frees up: queued work ahead divided by parallelism."""
+        waiting = len(self._queue) + 1
+        return max(1, math.ceil(lane.avg_service_s * waiting / max(1, min(self.max_active, lane.max_active))))
+
+    def _has_room(self, lane: Lane) -> bool:
+        return self.active < self.max_active and lane.active < lane.max_active
+
+    def enter(self, client: str, lane_name: str) -> Ticket:
+        """
+        Admits the request right away if there is room, queues it otherwise,
+        and raises AdmissionRejected if neither is allowed.
+        """
+        lane = self.lanes[lane_name]
+        if self._per_client.get(client, 0) >= self.max_per_client:
+            self._counters["rejected_client"] += 1
+            raise AdmissionRejected(
+                f"Too many concurrent requests from this client (limit {self.max_per_client}).",
+                429, self._retry_after(lane))
+
+        # Only skip the queue when no one of equal or higher priority is waiting.
+        can_start = self._has_room(lane) and not (self._queue and self._queue[0][0] <= lane.priority)
+        if not can_start and len(self._queue) >= self.max_queue:
+            self._counters["rejected_full"] += 1
+            raise AdmissionRejected("Server is at capacity; please retry later.", 503, self._retry_after(lane))
+
+        ticket = Ticket(self, lane, client, (lane.priority, next(self._sequence)))
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        if can_start:
+            self._activate(ticket)
+        else:
+            bisect.insort(self._queue, (ticket.order[0], ticket.order[1], ticket))
+            self._counters["queued"] += 1
+        return ticket
+
+    def _activate(self, ticket: Ticket):
+        ticket.admitted_at = time.monotonic()
+        ticket.lane.active += 1
+        self.active += 1
+        self._counters["admitted"] += 1
+        ticket._changed.set()
+
+    def _position(self, ticket: Ticket) -> int:
+        return bisect.bisect_left(self._queue, ticket.order) + 1
+
+    def _release(self, ticket: Ticket):
+        self._per_client[ticket.client] -= 1
+        if not self._per_client[ticket.client]:
+            del self._per_client[ticket.client]
+
+        if ticket.admitted:
+            ticket.lane.active -= 1
+            self.active -= 1
+            service_s = time.monotonic() - ticket.admitted_at
+            ticket.lane.avg_service_s = 0.8 * ticket.lane.avg_service_s + 0.2 * service_s
+        else:
+            index = bisect.bisect_left(self._queue, ticket.order)
+            if index < len(self._queue) and self._queue[index][2] is ticket:
+                del self._queue[index]
+        self._admit_waiting()
+
+    def _admit_waiting(self):
+        """Starts queued requests, in priority order, while there is room in their lanes."""
+        index = 0
+        started = False
+        while index < len(self._queue) and self.active < self.max_active:
+            ticket = self._queue[index][2]
+            if ticket.lane.active < ticket.lane.max_active:
+                del self._queue[index]
+                self._activate(ticket)
+                started = True
+            else:
+                index += 1
+        if started:
+            # Everyone still waiting moved up.
+            for _, _, waiting in self._queue:
+                waiting._changed.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(
+            self._counters,
+            active=self.active,
+            queued_now=len(self._queue),
+            lanes={name: {"active": lane.active, "max_active": lane.max_active,
+                          "avg_service_s": round(lane.avg_service_s, 3)} for name, lane in self.lanes.items()},
+        )
@@ -0,0 +1,112 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+
+class BatchingWorker:
+    """
+    Groups individual requests into batches for a model that is more efficient
+    with several inputs at once.
+
+    Requests are queued by `submit`, a background thread collects them until
+    either `max_batch_size` is reached or `max_wait_ms` has passed since the first
+    one arrived, then calls `batch_fn` once with the whole list. `batch_fn` must
+    return one result per item, in the same order.
+    """
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 4,
+                 max_wait_ms: float = 20, name: str = "batching-worker"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[Any, Future, float]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "failed_batches": 0,
+            "max_batch_seen": 0,
+            "total_queue_wait_s": 0.0,
+            "total_latency_s": 0.0,
+            "total_batch_time_s": 0.0,
+        }
+        self._started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queues one item and returns a Future that resolves to its result."""
+        future: Future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def __call__(self, item: Any, timeout: float = None) -> Any:
+        """Blocking convenience wrapper around `submit`."""
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect_batch(self) -> List[Tuple[Any, Future, float]]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Skip requests whose caller has already given up on them.
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = self.batch_fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} inputs.")
+            except Exception as e:
+                print(f"ERROR: [BatchingWorker] Batch of {len(batch)} failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                with self._stats_lock:
+                    self._stats["failed_batches"] += 1
+                continue
+
+            finished = time.perf_counter()
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+            with self._stats_lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(batch))
+                self._stats["total_batch_time_s"] += finished - started
+                for _, _, enqueued in batch:
+                    self._stats["total_queue_wait_s"] += started - enqueued
+                    self._stats["total_latency_s"] += finished - enqueued
+
+    def stats(self) -> Dict[str, float]:
+        """Throughput and latency counters since the worker started."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        requests = stats["requests"] or 1
+        batches = stats["batches"] or 1
+        uptime = time.perf_counter() - self._started_at
+        stats.update({
+            "queue_depth": self._queue.qsize(),
+            "avg_batch_size": stats["requests"] / batches,
+            "avg_queue_wait_ms": 1000 * stats["total_queue_wait_s"] / requests,
+            "avg_latency_ms": 1000 * stats["total_latency_s"] / requests,
+            "avg_batch_time_ms": 1000 * stats["total_batch_time_s"] / batches,
+            "throughput_rps": stats["requests"] / uptime if uptime > 0 else 0.0,
+        })
+        return stats
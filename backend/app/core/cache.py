@@ -0,0 +1,161 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of a text query, used as a cache key."""
+    return " ".join(text.lower().split())
+
+
+def image_cache_key(image: Image.Image, mode: str = "content") -> str:
+    """
+    Hashes an image for cache lookups.
+    'content' hashes the decoded pixels, so only identical images share a key.
+    'perceptual' uses a 64-bit difference hash, so re-encoded or slightly resized
+    copies of the same photo also share a key. So can different images with similar
+    structure: confirm a hit with `image_thumbnail` / `thumbnails_match`.
+    """
+    if mode == "perceptual":
+        # dHash: compare neighbouring pixels of a 9x8 grayscale thumbnail.
+        pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+        bits = 0
+        for row in range(8):
+            for col in range(8):
+                bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+        return f"p{bits:016x}"
+
+    digest = hashlib.sha1(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return f"c{digest.hexdigest()}"
+
+
+def image_thumbnail(image: Image.Image) -> bytes:
+    """A 16x16 RGB thumbnail, stored with perceptually keyed entries to confirm a hit."""
+    return image.convert("RGB").resize((16, 16), Image.BILINEAR).tobytes()
+
+
+def thumbnails_match(a: bytes, b: bytes, max_diff: float) -> bool:
+    """Whether two thumbnails differ by at most `max_diff` (of 255) per channel on average."""
+    if len(a) != len(b):
+        return False
+    diff = np.frombuffer(a, dtype=np.uint8).astype(np.int16) - np.frombuffer(b, dtype=np.uint8)
+    return float(np.abs(diff).mean()) <= max_diff
+
+
+class TieredCache:
+    """
+    A two-tier cache: an in-process LRU in front of an optional SQLite file that
+    survives restarts. Both tiers honour `ttl_s` and their own size limit.
+
+    Disk entries are scoped to `namespace`, so several caches can share one file.
+    Values that depend on changing data should carry its version in their key;
+    entries of old versions are then never read again and age out by TTL and size.
+    """
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 3600, disk_path: Optional[str] = None,
+                 disk_max_entries: int = 100_000, namespace: str = ""):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_max_entries = disk_max_entries
+        self.namespace = namespace
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+        self._disk = None
+        if disk_path:
+            self._open_disk(disk_path)
+
+    def _open_disk(self, disk_path: str):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._disk.execute("CREATE INDEX IF NOT EXISTS cache_created_at ON cache (created_at)")
+        except sqlite3.Error as e:
+            print(f"WARNING: Could not open on-disk cache at {disk_path}, using memory only: {e}")
+            self._disk = None
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl_s:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT value, created_at FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+                ).fetchone()
+                if row is not None and now - row[1] <= self.ttl_s:
+                    value = pickle.loads(row[0])
+                    self._set_memory(key, value, row[1])
+                    self._stats["disk_hits"] += 1
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._set_memory(key, value, now)
+            self._stats["sets"] += 1
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO cache (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now),
+                )
+                # Trimming is amortised: only every 256 writes.
+                if self._stats["sets"] % 256 == 0:
+                    self._trim_disk(now)
+
+    def _set_memory(self, key: str, value: Any, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _trim_disk(self, now: float):
+        self._disk.execute("DELETE FROM cache WHERE created_at < ?", (now - self.ttl_s,))
+        self._disk.execute(
+            "DELETE FROM cache WHERE rowid IN ("
+            " SELECT rowid FROM cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current sizes of both tiers."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = (
+                self._disk.execute("SELECT COUNT(*) FROM cache").fetchone()[0] if self._disk is not None else 0
+            )
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,407 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+import time
+import weakref
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core import config
+from app.core.lexical_index import LexicalIndex, LexicalSearcher, lexical_path
+from app.core.metadata_store import SegmentedMetadata, open_metadata, write_metadata_store
+from app.core.vector_index import (
+    SegmentedIndex, VectorStore, build_index, info_path, load_index, prepare_vectors, save_index, save_vectors, vectors_path,
+)
+
+# The catalog is the searchable product set: a FAISS index plus product metadata.
+# Layout of the rag_data directory:
+#
+#   product_reviews.index, product_data.bin|json   the base, written by scripts/ingest_data.py
+#   product_data.bm25.npz                          BM25 index of the base's titles and descriptions
+#   segments/seg_000001.bin ...                    metadata of products added since (immutable)
+#   segments/seg_000001.bm25.npz ...               BM25 index of each segment
+#   segments/seg_000001.index ...                  flat FAISS index of added rows (immutable)
+#   versions/000001/manifest.json                  segments, index parts and tombstones of each version
+#   CURRENT                                        name of the live version ("base" if absent)
+#
+# FAISS ids are metadata rows. Rows are only ever appended, so an id stays valid in
+# every later version. A version's index is the base index plus one small index part per
+# update that added products, searched together (SegmentedIndex). An update therefore
+# writes and loads only its own rows, and every version shares the unchanged parts, on disk
+# and in memory. Once there are more than INDEX_MAX_PARTS added parts, an update merges
+# them into one (O(added rows), still not O(catalog)). Deleting (or replacing) a product
+# adds its row to the version's tombstones, which searches skip with an IDSelector;
+# re-running ingest rebuilds a compact base. A version is written to a temporary directory
+# and renamed into place before CURRENT is replaced, so readers only ever see complete versions.
+
+INDEX_FILE = "product_reviews.index"
+BASE_VERSION = "base"
+
+
+class CatalogError(RuntimeError):
+    """The catalog on disk cannot be read or updated as requested."""
+
+
+class CatalogConflict(CatalogError):
+    """Another writer published a version since the one an update was based on."""
+
+
+def _file_fingerprint(paths: Iterable[str]) -> str:
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+        except OSError:
+            parts.append("missing")
+    return "|".join(parts)
+
+
+# Segments are immutable once written, so every version loaded by this process shares one
+# open copy of each (and of its lexical index and vectors). Keyed by fingerprint too, since ingest
+# rewrites the base files in place.
+_segments: Dict[Tuple[str, str], Any] = {}
+_segments_lock = threading.Lock()
+
+
+def _open_segment(path: str):
+    key = (os.path.abspath(path), _file_fingerprint([path]))
+    with _segments_lock:
+        segment = _segments.get(key)
+        if segment is None:
+            segment = _segments[key] = open_metadata(path)
+        return segment
+
+
+def _open_lexical(metadata_path: str, metadata):
+    """The lexical index of a segment, built in memory from `metadata` if it has no index file."""
+    path = lexical_path(metadata_path)
+    key = (os.path.abspath(path), _file_fingerprint([path, metadata_path]))
+    with _segments_lock:
+        lexical = _segments.get(key)
+    if lexical is None:
+        if os.path.exists(path):
+            lexical = LexicalIndex.load(path)
+        else:
+            print(f"No lexical index at {path}; building it in memory (re-run ingest_data.py to store one).")
+            lexical = LexicalIndex.build(metadata.get_many(np.arange(len(metadata))))
+        with _segments_lock:
+            lexical = _segments.setdefault(key, lexical)
+    return lexical
+
+
+# Loaded index parts, shared by every version that uses them; dropped with the last such version.
+_index_parts: "weakref.WeakValueDictionary[Tuple[str, str], Any]" = weakref.WeakValueDictionary()
+_index_infos: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+
+def _open_index(path: str) -> Tuple[Any, Dict[str, Any]]:
+    key = (os.path.abspath(path), _file_fingerprint([path, info_path(path)]))
+    with _segments_lock:
+        index = _index_parts.get(key)
+        if index is None:
+            index, _index_infos[key] = load_index(path)
+            _index_parts[key] = index
+        return index, _index_infos[key]
+
+
+def _open_vectors(metadata_path: str):
+    """The memory-mapped full-precision vectors of a segment, or None if it has none."""
+    path = vectors_path(metadata_path)
+    if not os.path.exists(path):
+        return None
+    key = (os.path.abspath(path), _file_fingerprint([path]))
+    with _segments_lock:
+        vectors = _segments.get(key)
+        if vectors is None:
+            vectors = _segments[key] = np.load(path, mmap_mode="r")
+        return vectors
+
+
+class CatalogVersion:
+    """
+    One immutable snapshot of the catalog. A search takes a reference to the live
+    version once and uses it throughout, so swapping versions never disturbs it.
+    """
+    def __init__(self, root: str, name: str, parts: List[Tuple[Any, Dict[str, Any]]], segments: List[Dict[str, Any]],
+                 tombstones: Iterable[int], index_files: List[Dict[str, Any]], fingerprint: str):
+        self.root = root
+        self.name = name
+        self.segments = segments
+        self.tombstones = frozenset(int(row) for row in tombstones)
+        # [{"path", "rows"}] of the index parts, relative to root.
+        self.index_files = index_files
+        self.fingerprint = fingerprint
+        self.metadata = SegmentedMetadata([_open_segment(os.path.join(root, s["path"])) for s in segments])
+        # Sorted, for np.isin and the FAISS selectors.
+        self.tombstone_rows = np.fromiter(sorted(self.tombstones), dtype='int64', count=len(self.tombstones))
+        self.index = SegmentedIndex(parts, self.tombstone_rows)
+        # The base index's kind and metric describe the version.
+        self.info = dict(parts[0][1], ntotal=self.index.ntotal)
+        if self.index.ntotal != len(self.metadata):
+            print(f"WARNING: [Catalog] Index has {self.index.ntotal} vectors but metadata has {len(self.metadata)} rows.")
+        self._row_of: Optional[Dict[str, int]] = None
+        self._row_of_lock = threading.Lock()
+        self._lexical: Optional[LexicalSearcher] = None
+        self._vectors: Optional[VectorStore] = None
+        self._vectors_checked = False
+
+    @property
+    def row_of(self) -> Dict[str, int]:
+        """product_id -> row of its live entry. Built on first use (updates need it, searches don't)."""
+        with self._row_of_lock:
+            if self._row_of is None:
+                row_of = {}
+                records = self.metadata.get_many(np.arange(len(self.metadata)), columns=("product_id",))
+                for row, record in enumerate(records):
+                    product_id = record.get("product_id")
+                    if product_id is not None and row not in self.tombstones:
+                        # A re-added product supersedes its earlier rows.
+                        row_of[str(product_id)] = row
+                self._row_of = row_of
+            return self._row_of
+
+    @property
+    def lexical(self) -> LexicalSearcher:
+        """BM25 search over the version's product text. Loaded on first use, like `row_of`."""
+        with self._row_of_lock:
+            if self._lexical is None:
+                self._lexical = LexicalSearcher([
+                    _open_lexical(os.path.join(self.root, segment["path"]), metadata)
+                    for segment, metadata in zip(self.segments, self.metadata.segments)
+                ])
+            return self._lexical
+
+    @property
+    def vectors(self) -> Optional[VectorStore]:
+        """
+        Full-precision vectors for re-scoring, memory-mapped on first use; None unless every
+        segment has them (ingest keeps them for compressed index kinds only).
+        """
+        with self._row_of_lock:
+            if not self._vectors_checked:
+                arrays = [_open_vectors(os.path.join(self.root, segment["path"])) for segment in self.segments]
+                if arrays and all(array is not None for array in arrays):
+                    store = VectorStore(arrays)
+                    if len(store) == len(self.metadata):
+                        self._vectors = store
+                    else:
+                        print(f"WARNING: [Catalog] {len(store)} full-precision vectors for {len(self.metadata)} rows; not re-scoring.")
+                self._vectors_checked = True
+            return self._vectors
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.name,
+            "kind": self.info.get("kind"),
+            "metric": self.info.get("metric"),
+            "rows": len(self.metadata),
+            "tombstones": len(self.tombstones),
+            "live": len(self.metadata) - len(self.tombstones),
+            "segments": len(self.segments),
+            "index_parts": len(self.index.parts),
+        }
+
+
+def current_version(root: str) -> str:
+    """Name of the live version on disk."""
+    try:
+        with open(os.path.join(root, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or BASE_VERSION
+    except FileNotFoundError:
+        return BASE_VERSION
+
+
+def _base_metadata_path(root: str) -> str:
+    store_path = os.path.join(root, "product_data.bin")
+    return "product_data.bin" if os.path.exists(store_path) else "product_data.json"
+
+
+def version_fingerprint(root: str, name: Optional[str] = None) -> str:
+    """Identifies a version's contents, e.g. to scope cached search results. Cheap: no files are read."""
+    name = name or current_version(root)
+    if name != BASE_VERSION:
+        return f"version:{name}"
+    index_path = os.path.join(root, INDEX_FILE)
+    return _file_fingerprint([index_path, info_path(index_path), os.path.join(root, _base_metadata_path(root))])
+
+
+def load_version(root: str, name: Optional[str] = None) -> CatalogVersion:
+    """Loads version `name` (the live one by default) from disk."""
+    name = name or current_version(root)
+    if name == BASE_VERSION:
+        # Fingerprinted before reading, so a concurrent re-ingest shows up as a change later.
+        fingerprint = version_fingerprint(root, name)
+        metadata_file = _base_metadata_path(root)
+        segments = [{"path": metadata_file, "rows": None}]
+        index_files = [{"path": INDEX_FILE, "rows": None}]
+        return CatalogVersion(root, name, [_open_index(os.path.join(root, INDEX_FILE))], segments, (), index_files, fingerprint)
+
+    manifest_path = os.path.join(root, "versions", name, "manifest.json")
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise CatalogError(f"Catalog version '{name}' has no manifest at {manifest_path}.")
+    # Versions written before index parts existed have one full index of their own.
+    index_files = manifest.get("indexes") or [{"path": manifest["index"], "rows": None}]
+    parts = [_open_index(os.path.join(root, part["path"])) for part in index_files]
+    return CatalogVersion(root, name, parts, manifest["segments"], manifest["tombstones"],
+                          index_files, version_fingerprint(root, name))
+
+
+def _version_names(root: str) -> List[str]:
+    versions_dir = os.path.join(root, "versions")
+    if not os.path.isdir(versions_dir):
+        return []
+    return sorted(name for name in os.listdir(versions_dir) if name.isdigit())
+
+
+_publish_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _writer_lock(root: str):
+    """Serializes writers: threads of this process, and other processes where flock exists."""
+    with _publish_lock:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        with open(os.path.join(root, ".catalog.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def publish(base: CatalogVersion, add_records: Sequence[Dict[str, Any]] = (), add_embeddings: Optional[np.ndarray] = None,
+            delete_ids: Sequence[str] = ()) -> Tuple[CatalogVersion, Dict[str, Any]]:
+    """
+    Writes a new version on top of `base` and makes it the live one.
+    `add_records` (each with a product_id) are appended with the matching rows of
+    `add_embeddings`; a product that already exists is replaced. `delete_ids` are
+    tombstoned. Raises CatalogConflict if `base` is no longer the live version.
+    Returns the new version and a report of what changed.
+    """
+    root = base.root
+    add_records = list(add_records)
+    if add_records and (add_embeddings is None or len(add_embeddings) != len(add_records)):
+        raise ValueError("add_embeddings must have one row per added record.")
+    if any(record.get("product_id") in (None, "") for record in add_records):
+        raise ValueError("Every added product needs a product_id.")
+
+    delete_ids = list(dict.fromkeys(str(product_id) for product_id in delete_ids))
+
+    with _writer_lock(root):
+        if current_version(root) != base.name:
+            raise CatalogConflict(f"The catalog moved on from version '{base.name}'; reload and retry.")
+
+        existing = _version_names(root)
+        name = f"{int(existing[-1]) + 1 if existing else 1:06d}"
+        tombstones = set(base.tombstones)
+        row_of = base.row_of
+        not_found = [product_id for product_id in delete_ids if product_id not in row_of]
+        tombstones.update(row_of[product_id] for product_id in delete_ids if product_id in row_of)
+
+        segments = [dict(segment, rows=segment["rows"] if segment["rows"] is not None else len(base.metadata))
+                    for segment in base.segments]
+        parts = list(base.index.parts)
+        index_files = [dict(part, rows=int(index.ntotal)) for part, (index, _) in zip(base.index_files, parts)]
+        replaced = 0
+        if add_records:
+            vectors = prepare_vectors(add_embeddings, base.info["metric"])
+            if vectors.shape[1] != base.index.d:
+                raise ValueError(f"Embeddings have dimension {vectors.shape[1]}, the index expects {base.index.d}.")
+            first_row = len(base.metadata)
+            if base.index.ntotal != first_row:
+                raise CatalogError("Index and metadata are out of step; rebuild the catalog with ingest_data.py.")
+            for record in add_records:
+                old_row = row_of.get(str(record["product_id"]))
+                if old_row is not None:
+                    tombstones.add(old_row)
+                    replaced += 1
+
+            segment_file = os.path.join("segments", f"seg_{name}.bin")
+            os.makedirs(os.path.join(root, "segments"), exist_ok=True)
+            write_metadata_store(add_records, os.path.join(root, segment_file))
+            LexicalIndex.build(add_records).save(lexical_path(os.path.join(root, segment_file)))
+            # Keep full-precision vectors for the new rows if the catalog keeps them at all.
+            if os.path.exists(vectors_path(os.path.join(root, segments[0]["path"]))):
+                save_vectors(vectors, vectors_path(os.path.join(root, segment_file)))
+            segments.append({"path": segment_file, "rows": len(add_records)})
+
+            # The new rows get an index part of their own; the existing parts are shared,
+            # untouched (searches may be using them right now). Past INDEX_MAX_PARTS added
+            # parts, they are merged with the new rows into one. Added parts are flat, exact.
+            if len(parts) - 1 >= max(1, config.INDEX_MAX_PARTS):
+                vectors = np.concatenate([index.reconstruct_n(0, index.ntotal) for index, _ in parts[1:]] + [vectors])
+                parts, index_files = parts[:1], index_files[:1]
+            part_file = os.path.join("segments", f"seg_{name}.index")
+            part, part_info = build_index(vectors, kind="flat", metric=base.info["metric"])
+            save_index(part, os.path.join(root, part_file), part_info)
+            parts.append((part, part_info))
+            index_files.append({"path": part_file, "rows": int(part.ntotal)})
+
+        staging = os.path.join(root, "versions", f".staging-{name}-{os.getpid()}")
+        os.makedirs(staging)
+        try:
+            manifest = {
+                "version": name, "parent": base.name, "created_at": time.time(),
+                "indexes": index_files, "segments": segments, "tombstones": sorted(tombstones),
+            }
+            with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.rename(staging, os.path.join(root, "versions", name))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        current_tmp = os.path.join(root, f"CURRENT.tmp-{os.getpid()}")
+        with open(current_tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(current_tmp, os.path.join(root, "CURRENT"))
+
+    version = CatalogVersion(root, name, parts, segments, tombstones, index_files, version_fingerprint(root, name))
+    report = {
+        "version": name, "parent": base.name, "added": len(add_records) - replaced, "replaced": replaced,
+        "deleted": len(delete_ids) - len(not_found), "not_found": not_found, **version.stats(),
+    }
+    return version, report
+
+
+def prune_versions(root: str, keep: int):
+    """
+    Deletes all but the newest `keep` versions, and the index parts (merged away) that no
+    kept version uses. Index files still used by a kept version stay.
+    """
+    with _writer_lock(root):
+        names = _version_names(root)
+        kept, old = names[-keep:] if keep > 0 else [], names[:-keep] if keep > 0 else names
+        live = current_version(root)
+        needed = set()
+        for name in kept + [live]:
+            try:
+                with open(os.path.join(root, "versions", name, "manifest.json"), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            needed.update(part["path"] for part in manifest.get("indexes") or [{"path": manifest["index"]}])
+        for name in old:
+            version_dir = os.path.join("versions", name)
+            if name != live and not any(path.startswith(version_dir + os.sep) for path in needed):
+                shutil.rmtree(os.path.join(root, version_dir), ignore_errors=True)
+
+        # Writers hold the lock, so every index part on disk is either in a manifest or unused.
+        segments_dir = os.path.join(root, "segments")
+        for file_name in (os.listdir(segments_dir) if os.path.isdir(segments_dir) else []):
+            path = os.path.join("segments", file_name)
+            if file_name.endswith(".index") and path not in needed:
+                for unused in (path, info_path(path)):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(root, unused))
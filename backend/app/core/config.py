@@ -0,0 +1,161 @@
+import os
+
+# Runtime settings for the backend. Every value can be overridden with an
+# environment variable of the same name.
+
+# --- ProductResearchAgent (Qwen2.5-VL) batching ---
+# Maximum number of image+prompt pairs folded into a single `generate` call.
+VLM_MAX_BATCH_SIZE = int(os.getenv("VLM_MAX_BATCH_SIZE", "4"))
+# How long the batching worker waits for more requests after the first one arrives.
+VLM_MAX_WAIT_MS = float(os.getenv("VLM_MAX_WAIT_MS", "20"))
+VLM_MAX_NEW_TOKENS = int(os.getenv("VLM_MAX_NEW_TOKENS", "1024"))
+
+# --- Image uploads ---
+# Uploaded images larger than this are rejected with 413. Multipart request bodies are
+# cut off while they arrive once they pass this plus UPLOAD_FORM_OVERHEAD_BYTES (the
+# other form fields and the multipart framing).
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_FORM_OVERHEAD_BYTES = int(os.getenv("UPLOAD_FORM_OVERHEAD_BYTES", str(64 * 1024)))
+# Images with more pixels than this are rejected before their pixels are decoded.
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", "50000000"))
+# Uploads are decoded once, with the longer side at most VLM_IMAGE_MAX_SIDE;
+# the CLIP input is derived from that decode with its shorter side CLIP_IMAGE_SIZE.
+VLM_IMAGE_MAX_SIDE = int(os.getenv("VLM_IMAGE_MAX_SIDE", "1024"))
+CLIP_IMAGE_SIZE = int(os.getenv("CLIP_IMAGE_SIZE", "224"))
+
+# --- Admission control ---
+# Requests running at once, overall and per lane. The 'search' lane (/search/batch)
+# is admitted ahead of the 'full' lane (/get-recommendation, which uses the VLM).
+ADMISSION_MAX_ACTIVE = int(os.getenv("ADMISSION_MAX_ACTIVE", "8"))
+ADMISSION_MAX_ACTIVE_FULL = int(os.getenv("ADMISSION_MAX_ACTIVE_FULL", "4"))
+ADMISSION_MAX_ACTIVE_SEARCH = int(os.getenv("ADMISSION_MAX_ACTIVE_SEARCH", "8"))
+# Requests allowed to wait for a slot; beyond that, new requests get 503 + Retry-After.
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# Running plus queued requests per client; beyond that, 429 + Retry-After.
+ADMISSION_MAX_PER_CLIENT = int(os.getenv("ADMISSION_MAX_PER_CLIENT", "4"))
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "60"))
+# Header identifying the client (e.g. X-Forwarded-For behind a proxy); empty = the peer address.
+ADMISSION_CLIENT_HEADER = os.getenv("ADMISSION_CLIENT_HEADER", "")
+
+# --- Latency budget ---
+# Time (ms, from request arrival) within which /get-recommendation should deliver its
+# final recommendation; 0 disables it. Requests can set their own with ?latency_budget_ms=.
+# If the visual analysis is not ready in time, the recommendation is built from the
+# retrieved products instead and the visual summary is marked as deferred.
+LATENCY_BUDGET_MS = float(os.getenv("LATENCY_BUDGET_MS", "0"))
+# Part of the budget kept for the agents that run after the VLM and for synthesis.
+LATENCY_BUDGET_RESERVE_MS = float(os.getenv("LATENCY_BUDGET_RESERVE_MS", "250"))
+# Keep generating a deferred visual summary and push it on the same stream when ready
+# (1), or drop it, withdrawing the VLM request if it has not started yet (0).
+DEFERRED_VISUAL_SUMMARY = os.getenv("DEFERRED_VISUAL_SUMMARY", "1") == "1"
+
+# --- Coalescing of identical analyses ---
+# Identical /get-recommendation requests (same image bytes, query, price and budget)
+# share one running pipeline; complete event streams are replayed for this long (not
+# those that missed their latency budget).
+ANALYSIS_RESULT_TTL_S = float(os.getenv("ANALYSIS_RESULT_TTL_S", "30"))
+ANALYSIS_MAX_RESULTS = int(os.getenv("ANALYSIS_MAX_RESULTS", "256"))
+
+# --- ReviewAnalyzerAgent embedding / result cache ---
+REVIEW_CACHE_MAX_ENTRIES = int(os.getenv("REVIEW_CACHE_MAX_ENTRIES", "2048"))
+REVIEW_CACHE_TTL_S = float(os.getenv("REVIEW_CACHE_TTL_S", "86400"))
+# Path of the SQLite file for the on-disk tier; leave empty to keep the cache in memory only.
+REVIEW_CACHE_DISK_PATH = os.getenv("REVIEW_CACHE_DISK_PATH", "")
+REVIEW_CACHE_DISK_MAX_ENTRIES = int(os.getenv("REVIEW_CACHE_DISK_MAX_ENTRIES", "200000"))
+# 'content' (exact pixels) or 'perceptual' (also matches re-encoded copies of a photo).
+# The perceptual key is a 64-bit dHash of a grayscale 9x8 thumbnail, which different photos
+# with the same layout (e.g. similar products on a white background) can share. A hit is
+# therefore only used if a 16x16 colour thumbnail stored with the entry differs from the
+# query's by at most REVIEW_CACHE_PERCEPTUAL_MAX_DIFF (of 255) per channel on average;
+# otherwise the query is encoded and searched, and its result replaces the entry.
+REVIEW_CACHE_IMAGE_HASH = os.getenv("REVIEW_CACHE_IMAGE_HASH", "content")
+REVIEW_CACHE_PERCEPTUAL_MAX_DIFF = float(os.getenv("REVIEW_CACHE_PERCEPTUAL_MAX_DIFF", "6"))
+
+# --- Catalog updates ---
+# How often (seconds) each API process checks for a catalog version published by
+# another process or scripts/update_index.py; 0 disables the check.
+INDEX_RELOAD_CHECK_S = float(os.getenv("INDEX_RELOAD_CHECK_S", "2"))
+# Catalog versions kept on disk (older ones are deleted after each update).
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "5"))
+# Each update that adds products writes a small index part of its own, searched alongside
+# the base index. Once there are more than this many, the next update merges them into one.
+INDEX_MAX_PARTS = int(os.getenv("INDEX_MAX_PARTS", "8"))
+# Most products per /api/index/products request.
+INDEX_UPDATE_MAX_PRODUCTS = int(os.getenv("INDEX_UPDATE_MAX_PRODUCTS", "1024"))
+# The /api/index write endpoints require this value in the X-Admin-Token header. Without a
+# token they are refused, unless INDEX_ADMIN_OPEN=1 opens them to every client (local use only).
+INDEX_ADMIN_TOKEN = os.getenv("INDEX_ADMIN_TOKEN", "")
+INDEX_ADMIN_OPEN = os.getenv("INDEX_ADMIN_OPEN", "0") == "1"
+
+# --- PriceQualityAgent value scoring ---
+# JSON file of weighted lexicons ({"sentiment": {"phrase": weight, ...}, "premium": {...}})
+# replacing the agent's built-in ones; empty = built-in.
+PRICE_QUALITY_LEXICON_PATH = os.getenv("PRICE_QUALITY_LEXICON_PATH", "")
+# Priced similar products needed before a price is judged against them rather than
+# against the fixed price bands.
+PRICE_QUALITY_MIN_REFERENCE_PRICES = int(os.getenv("PRICE_QUALITY_MIN_REFERENCE_PRICES", "3"))
+
+# --- Vector index search ---
+# Number of IVF cells probed per query (ivf_flat / ivf_pq indexes). Higher = better recall, slower.
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+# Size of the HNSW candidate list per query (hnsw indexes). Higher = better recall, slower.
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+# With a compressed index (flat_fp16, flat_sq8, ivf_pq) and the full-precision vectors that
+# ingest keeps for it, searches fetch INDEX_RESCORE_FACTOR times the candidates needed and
+# re-score them exactly from the memory-mapped float32 file (1), or rank on the codes alone (0).
+INDEX_RESCORE = os.getenv("INDEX_RESCORE", "1") == "1"
+INDEX_RESCORE_FACTOR = int(os.getenv("INDEX_RESCORE_FACTOR", "4"))
+# Most queries accepted by one /api/search/batch request, and most results per query.
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "1024"))
+SEARCH_MAX_TOP_K = int(os.getenv("SEARCH_MAX_TOP_K", "100"))
+
+# --- Hybrid retrieval ---
+# 'hybrid' fuses the CLIP vector search with a BM25 search over product titles and
+# descriptions whenever a query has text; 'vector' uses CLIP only.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Candidates taken from each of the two searches before fusion.
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+# Reciprocal rank fusion constant: score = sum of 1 / (HYBRID_RRF_K + rank) over both searches,
+# the BM25 term scaled by how selective the query's words are (see LexicalSearcher.specificity).
+HYBRID_RRF_K = float(os.getenv("HYBRID_RRF_K", "60"))
+# Re-rank the fused candidates on normalized vector and BM25 scores and title coverage
+# of the query terms (1), or keep the fusion order (0).
+HYBRID_RERANK = os.getenv("HYBRID_RERANK", "1") == "1"
+
+# --- Tracing and metrics ---
+# Per-stage timings in the SSE stream and histograms at /metrics. When disabled,
+# spans are shared no-op objects.
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") == "1"
+
+# --- Streaming ---
+# Compression of the recommendation stream for clients that accept it: "gzip" or "none".
+# Each event is flushed as soon as it is produced, so compression never delays one.
+# With "none", have the frontend use the delta protocol (REACT_APP_SSE_PROTOCOL=delta).
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "gzip")
+SSE_COMPRESSION_LEVEL = int(os.getenv("SSE_COMPRESSION_LEVEL", "6"))
+
+# --- Model loading ---
+# Comma-separated models loaded in the background when the app starts ("" = load on first request only).
+MODEL_WARMUP = [name for name in os.getenv("MODEL_WARMUP", "clip,product_index,qwen_vl").split(",") if name]
+# A model whose loader failed (e.g. a transient download error) is retried on the next use after
+# this many seconds, doubling after each further failure up to MODEL_RETRY_MAX_S (0 = never retry).
+MODEL_RETRY_BACKOFF_S = float(os.getenv("MODEL_RETRY_BACKOFF_S", "30"))
+MODEL_RETRY_MAX_S = float(os.getenv("MODEL_RETRY_MAX_S", "600"))
+
+# --- Model placement ---
+# 'local' loads CLIP and Qwen2.5-VL inside each API process. 'remote' forwards
+# encoding and generation to a model server (python -m app.core.model_server),
+# so every model is loaded once per host no matter how many API workers run.
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "local")
+# A Unix socket path or 'host:port'.
+MODEL_SERVER_ADDRESS = os.getenv("MODEL_SERVER_ADDRESS", "/tmp/agentic-rag-model-server.sock")
+# CLIP and the VLM can be served by separate processes on different addresses.
+CLIP_SERVER_ADDRESS = os.getenv("CLIP_SERVER_ADDRESS", MODEL_SERVER_ADDRESS)
+VLM_SERVER_ADDRESS = os.getenv("VLM_SERVER_ADDRESS", MODEL_SERVER_ADDRESS)
+# Shared secret of the model server and its clients. The connection carries pickled
+# messages, so anyone holding the key can run code in the other process. There is no
+# default: the model server and MODEL_BACKEND=remote refuse to start without one
+# (e.g. MODEL_SERVER_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")).
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "").encode()
+# TCP addresses must be on the loopback interface unless this is set to 1.
+MODEL_SERVER_ALLOW_REMOTE = os.getenv("MODEL_SERVER_ALLOW_REMOTE", "0") == "1"
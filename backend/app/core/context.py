@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 # Pydantic models define the structure of your data.
 
@@ -12,6 +12,8 @@ class Product(BaseModel):
     identified_price: Optional[float] = None
     image_url: Optional[str] = None # If found online
     visual_summary: Optional[str] = None
+    # True while visual_summary is a stand-in built from catalog data (see LATENCY_BUDGET_MS).
+    visual_summary_deferred: bool = False
     value_assessment: Optional[str] = None
     
 class AgentOutput(BaseModel):
@@ -40,3 +42,47 @@ class ProductContext(BaseModel):
     # The final recommendation synthesized from all agent outputs.
     final_recommendation: Optional[str] = None
 
+    # Per-stage timings ({"ms": ..., plus attributes such as token counts}), filled in while tracing is enabled.
+    timings: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+
+class SearchQuery(BaseModel):
+    """
+    One query of a batch similarity search: either a text or a base64-encoded image.
+    `keywords` are matched against product titles and descriptions in hybrid mode;
+    a text query is its own keywords by default.
+    """
+    text: Optional[str] = None
+    image_base64: Optional[str] = None
+    keywords: Optional[str] = None
+
+class BatchSearchRequest(BaseModel):
+    """
+    Body of /api/search/batch. Results come back in the order of `queries`.
+    """
+    queries: List[SearchQuery]
+    top_k: int = 5
+    # 'hybrid' or 'vector'; defaults to RETRIEVAL_MODE.
+    mode: Optional[str] = None
+
+class CatalogProduct(BaseModel):
+    """
+    A product to add to the search index. The image is embedded with CLIP; the other fields are stored as its metadata.
+    """
+    product_id: str
+    product_title: Optional[str] = None
+    product_description: Optional[str] = None
+    image_url: Optional[str] = None
+    price: Optional[float] = None
+    image_base64: str
+
+class IndexAddRequest(BaseModel):
+    """
+    Body of POST /api/index/products. Products whose product_id already exists are replaced.
+    """
+    products: List[CatalogProduct]
+
+class IndexDeleteRequest(BaseModel):
+    """
+    Body of POST /api/index/products/delete.
+    """
+    product_ids: List[str]
@@ -0,0 +1,154 @@
+import math
+from io import BytesIO
+from typing import NamedTuple, Tuple
+
+from PIL import Image
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+# Upload handling for product photos. Phone photos are often 12+ megapixels,
+# while CLIP looks at 224x224 and the VLM at about a megapixel, so images are
+# decoded once, directly at (roughly) the largest size any model needs, and the
+# smaller inputs are derived from that decode.
+
+
+class UploadTooLarge(ValueError):
+    """The upload exceeds the configured byte limit."""
+
+
+class UnsupportedImage(ValueError):
+    """The upload is not an image Pillow can decode, or has too many pixels."""
+
+
+class DecodedImage(NamedTuple):
+    """The model inputs produced from one upload."""
+    vlm: Image.Image
+    clip: Image.Image
+    original_size: Tuple[int, int]
+
+
+class MultipartBodyLimit:
+    """
+    ASGI middleware that rejects multipart request bodies larger than `max_bytes` with
+    413 while they arrive: before reading anything if Content-Length is over the limit,
+    otherwise as soon as the bytes received pass it. Starlette's multipart parser spools
+    a whole file part before the endpoint sees the UploadFile, so this is where an
+    oversized upload can be stopped.
+    """
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if not headers.get(b"content-type", b"").lower().startswith(b"multipart/"):
+            return await self.app(scope, receive, send)
+
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            response = JSONResponse(status_code=413, content={
+                "message": f"Request body is {int(length)} bytes; the limit is {self.max_bytes}."})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Re-raised as is by FastAPI's body parsing, and answered with 413.
+                    raise HTTPException(status_code=413, detail=f"Request body is larger than the {self.max_bytes} byte limit.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def read_upload(upload, max_bytes: int, chunk_size: int = 1 << 16) -> bytes:
+    """
+    Reads an UploadFile (already spooled by Starlette) chunk by chunk, failing as soon as
+    more than `max_bytes` have been read. The body as a whole is capped while it arrives
+    by MultipartBodyLimit; this is the exact limit on the file itself.
+    """
+    declared = getattr(upload, "size", None)
+    if declared is not None and declared > max_bytes:
+        raise UploadTooLarge(f"Image is {declared} bytes; the limit is {max_bytes}.")
+
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            return bytes(buffer)
+        buffer += chunk
+        if len(buffer) > max_bytes:
+            raise UploadTooLarge(f"Image is larger than the {max_bytes} byte limit.")
+
+
+def _open(data: bytes, max_pixels: int) -> Image.Image:
+    """Parses the image header only; pixels are not decoded yet."""
+    try:
+        image = Image.open(BytesIO(data))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise UnsupportedImage(f"Cannot read image: {e}")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise UnsupportedImage(f"Image is {width}x{height}; at most {max_pixels} pixels are accepted.")
+    return image
+
+
+def _decode(image: Image.Image, min_size: Tuple[int, int]) -> Image.Image:
+    """
+    Decodes `image` to RGB, at a reduced size no smaller than `min_size` when possible.
+    For JPEGs, `draft` lets the decoder itself work at 1/2, 1/4 or 1/8 scale,
+    which is much cheaper than decoding full resolution and shrinking afterwards.
+    """
+    if image.format == "JPEG":
+        image.draft("RGB", min_size)
+    try:
+        return image.convert("RGB")
+    except OSError as e:
+        raise UnsupportedImage(f"Cannot decode image: {e}")
+
+
+def _scaled(size: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    return max(1, math.ceil(size[0] * scale)), max(1, math.ceil(size[1] * scale))
+
+
+def vlm_input(image: Image.Image, max_side: int) -> Image.Image:
+    """
+    Shrinks an RGB image by an integer factor until its longer side is at most
+    `max_side`. `reduce` averages whole pixel blocks, which is several times
+    faster than resampling; the VLM processor does the final resize anyway.
+    """
+    factor = math.ceil(max(image.size) / max_side)
+    return image.reduce(factor) if factor > 1 else image
+
+
+def clip_input(image: Image.Image, short_side: int) -> Image.Image:
+    """
+    Shrinks an RGB image by an integer factor while keeping its shorter side at
+    least `short_side`, which is all CLIP's preprocessing uses (it resizes the
+    short side to 224 and center-crops).
+    """
+    factor = min(image.size) // short_side
+    return image.reduce(factor) if factor > 1 else image
+
+
+def decode_for_models(data: bytes, vlm_max_side: int, clip_short_side: int, max_pixels: int) -> DecodedImage:
+    """
+    Decodes an uploaded image once and returns the VLM input (longer side at most
+    `vlm_max_side`) and the CLIP input derived from it. Blocking; run it off the event loop.
+    """
+    image = _open(data, max_pixels)
+    original_size = image.size
+    # Anything above half the final size still reduces to at most vlm_max_side with a factor of 2.
+    vlm = vlm_input(_decode(image, _scaled(original_size, vlm_max_side / 2 / max(original_size))), vlm_max_side)
+    return DecodedImage(vlm=vlm, clip=clip_input(vlm, clip_short_side), original_size=original_size)
+
+
+def decode_for_clip(data: bytes, clip_short_side: int, max_pixels: int) -> Image.Image:
+    """Decodes an image straight to CLIP input size, for searches that never reach the VLM."""
+    image = _open(data, max_pixels)
+    decoded = _decode(image, _scaled(image.size, clip_short_side / min(image.size)))
+    return clip_input(decoded, clip_short_side)
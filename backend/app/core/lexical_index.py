@@ -0,0 +1,187 @@
+import json
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# An in-process BM25 index over product text, complementing the CLIP vectors with exact
+# matches on brand and model names. Postings are stored CSR-style: the documents (rows)
+# containing term t are docs[offsets[t]:offsets[t + 1]], with their term frequencies in
+# freqs. Each metadata file gets its own index file next to it (product_data.bm25.npz,
+# segments/seg_000001.bm25.npz, ...), and LexicalSearcher scores several of them as one
+# index, with collection statistics (document count, lengths, document frequencies)
+# summed across them.
+
+# Fields indexed, with the number of times each occurrence is counted: a title match
+# weighs more than a description match.
+FIELD_WEIGHTS = {"product_title": 2, "product_description": 1}
+
+# Frequent function words that carry no product information ("is this a good deal?").
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from how i in is it its me my of on or "
+    "should so that the this to was what which with would you your".split()
+)
+
+_TOKEN = re.compile(r"\w+")
+FORMAT_VERSION = 1
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercased word tokens; punctuation splits tokens, so 'WH-1000XM4' gives 'wh', '1000xm4'."""
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def query_terms(text: Optional[str]) -> List[str]:
+    """The distinct, non-stopword terms of a query, in order."""
+    return list(dict.fromkeys(term for term in tokenize(text) if term not in STOPWORDS))
+
+
+def lexical_path(metadata_path: str) -> str:
+    """Where the lexical index of a metadata file lives."""
+    return os.path.splitext(metadata_path)[0] + ".bm25.npz"
+
+
+class LexicalIndex:
+    """Term postings for one block of rows (a metadata file); row ids are positions in it."""
+    def __init__(self, terms: Sequence[str], offsets: np.ndarray, docs: np.ndarray, freqs: np.ndarray,
+                 doc_lengths: np.ndarray, path: Optional[str] = None):
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.freqs = freqs
+        self.doc_lengths = doc_lengths
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @classmethod
+    def build(cls, records: Iterable[Dict[str, Any]]) -> "LexicalIndex":
+        """Indexes the FIELD_WEIGHTS fields of `records`."""
+        vocabulary: Dict[str, int] = {}
+        term_ids, doc_ids, counts, doc_lengths = [], [], [], []
+        for row, record in enumerate(records):
+            counter: Counter = Counter()
+            for field, weight in FIELD_WEIGHTS.items():
+                value = record.get(field)
+                for term in tokenize(value if isinstance(value, str) else None):
+                    counter[term] += weight
+            for term, count in counter.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(row)
+                counts.append(count)
+            doc_lengths.append(sum(counter.values()))
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        # A stable sort keeps each term's postings in row order.
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(
+            list(vocabulary), offsets,
+            np.asarray(doc_ids, dtype=np.int32)[order],
+            np.minimum(np.asarray(counts, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            np.asarray(doc_lengths, dtype=np.int32),
+        )
+
+    def save(self, path: str):
+        """Writes the index to `path` (an uncompressed .npz), via a temporary file."""
+        terms = json.dumps(list(self.vocabulary), ensure_ascii=False).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, version=np.int32(FORMAT_VERSION), terms=np.frombuffer(terms, dtype=np.uint8),
+                     offsets=self.offsets, docs=self.docs, freqs=self.freqs, doc_lengths=self.doc_lengths)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path) as data:
+            if int(data["version"]) != FORMAT_VERSION:
+                raise ValueError(f"{path} is not a version {FORMAT_VERSION} lexical index.")
+            terms = json.loads(data["terms"].tobytes().decode("utf-8"))
+            return cls(terms, data["offsets"], data["docs"], data["freqs"], data["doc_lengths"], path=path)
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(rows, term frequencies) of the documents containing `term`, or None."""
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return None
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.docs[start:end], self.freqs[start:end]
+
+
+class LexicalSearcher:
+    """
+    BM25 search over several LexicalIndex parts read as one, the rows of each part
+    following those of the previous one (as in SegmentedMetadata).
+    """
+    def __init__(self, parts: Sequence[LexicalIndex], k1: float = 1.2, b: float = 0.75):
+        self.parts = list(parts)
+        self.k1 = k1
+        self.b = b
+        self._starts = np.cumsum([0] + [len(part) for part in self.parts])
+        self.num_docs = int(self._starts[-1])
+        total_length = sum(int(part.doc_lengths.sum()) for part in self.parts)
+        # 1.0 when there is no text at all, so that length normalization never divides by zero.
+        self.avg_length = (total_length / self.num_docs if self.num_docs else 0.0) or 1.0
+
+    def _idf(self, doc_freq: int) -> float:
+        return float(np.log(1.0 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5)))
+
+    def doc_freq(self, term: str) -> int:
+        """Number of documents containing `term`, over all parts."""
+        return sum(len(part.postings(term)[0]) for part in self.parts if term in part.vocabulary)
+
+    def specificity(self, text: str) -> float:
+        """
+        How selective the query's rarest known term is: its IDF relative to that of a term
+        found in a single document, in [0, 1]. A model number scores about 1; words used
+        all over the catalog ("durable") score near 0, and their BM25 ranking means little.
+        """
+        if self.num_docs < 2:
+            return 0.0
+        doc_freqs = [doc_freq for doc_freq in map(self.doc_freq, query_terms(text)) if doc_freq]
+        return min(1.0, self._idf(min(doc_freqs)) / self._idf(1)) if doc_freqs else 0.0
+
+    def search(self, text: str, k: int, exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The `k` best BM25 matches for `text`: (rows, scores), best first. Rows in
+        `exclude` (a sorted array, e.g. tombstones) are never returned.
+        """
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        if not self.num_docs or k <= 0:
+            return empty
+
+        rows, contributions = [], []
+        for term in query_terms(text):
+            found = []
+            for start, part in zip(self._starts.tolist(), self.parts):
+                hit = part.postings(term)
+                if hit is not None:
+                    found.append((start, part, *hit))
+            doc_freq = sum(len(docs) for _, _, docs, _ in found)
+            if not doc_freq:
+                continue
+            idf = self._idf(doc_freq)
+            for start, part, docs, freqs in found:
+                tf = freqs.astype(np.float32)
+                norm = self.k1 * (1.0 - self.b + self.b * part.doc_lengths[docs] / self.avg_length)
+                rows.append(docs.astype(np.int64) + start)
+                contributions.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not rows:
+            return empty
+
+        # Sum each row's contributions over the query terms.
+        unique_rows, position = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(position, weights=np.concatenate(contributions)).astype(np.float32)
+        if exclude is not None and len(exclude):
+            keep = ~np.isin(unique_rows, exclude, assume_unique=True)
+            unique_rows, scores = unique_rows[keep], scores[keep]
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            unique_rows, scores = unique_rows[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return unique_rows[order], scores[order]
@@ -0,0 +1,236 @@
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# On-disk layout of a metadata store (all integers little-endian):
+#
+#   magic "PMDS" | uint32 version | uint32 header length | header (JSON, padded to 8 bytes)
+#   body; for every column, at the positions recorded in the header:
+#       uint64[num_rows + 1] offsets into the column's data block
+#       uint8[num_rows]      1 if the row has a value for this column, else 0 (padded to 8 bytes)
+#       bytes                UTF-8 data of all rows, back to back
+#
+# Columns whose values are all strings store raw UTF-8; other columns store each
+# value as JSON. Row i of a column is data[offsets[i]:offsets[i + 1]], so a lookup
+# is O(1) and only touches the pages it reads. The file is memory-mapped read-only,
+# which lets every worker process share one copy through the OS page cache.
+
+MAGIC = b"PMDS"
+VERSION = 1
+_PREAMBLE = struct.Struct("<4sII")
+
+
+def _pad8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def write_metadata_store(records: Sequence[Dict[str, Any]], path: str, columns: Optional[List[str]] = None):
+    """
+    Writes `records` (a list of dicts) as a columnar metadata store at `path`.
+    Row ids are positions in `records`. The file is written to a temporary name
+    and renamed into place, so readers never observe a partial file.
+    """
+    if columns is None:
+        columns = []
+        for record in records:
+            for key in record:
+                if key not in columns:
+                    columns.append(key)
+
+    num_rows = len(records)
+    blocks = []
+    header_columns = []
+    for name in columns:
+        values = [record.get(name) for record in records]
+        present = np.fromiter((name in record for record in records), dtype=np.uint8, count=num_rows)
+        is_text = all(isinstance(value, str) for value, has_value in zip(values, present) if has_value)
+        encoded = [
+            b"" if not has_value else (value.encode("utf-8") if is_text else json.dumps(value).encode("utf-8"))
+            for value, has_value in zip(values, present)
+        ]
+        offsets = np.zeros(num_rows + 1, dtype="<u8")
+        np.cumsum([len(cell) for cell in encoded], out=offsets[1:])
+        blocks.append((offsets, present, b"".join(encoded)))
+        header_columns.append({"name": name, "kind": "text" if is_text else "json"})
+
+    # Column positions are relative to the start of the body, which follows the header.
+    position = 0
+    for column, (offsets, present, data) in zip(header_columns, blocks):
+        column["offsets_at"] = position
+        position += offsets.nbytes
+        column["present_at"] = position
+        position = _pad8(position + present.nbytes)
+        column["data_at"] = position
+        column["data_len"] = len(data)
+        position = _pad8(position + len(data))
+
+    header_bytes = json.dumps({"num_rows": num_rows, "columns": header_columns}).encode("utf-8")
+    body_at = _pad8(_PREAMBLE.size + len(header_bytes))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for column, (offsets, present, data) in zip(header_columns, blocks):
+            f.seek(body_at + column["offsets_at"])
+            f.write(offsets.tobytes())
+            f.seek(body_at + column["present_at"])
+            f.write(present.tobytes())
+            f.seek(body_at + column["data_at"])
+            f.write(data)
+        f.truncate(body_at + position)
+    os.replace(tmp_path, path)
+
+
+class MetadataStore:
+    """
+    Read-only, memory-mapped view of a metadata store written by `write_metadata_store`.
+    Rows are returned as dicts, like the entries of the old product_data.json.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if self._mmap is None:
+            raise ValueError(f"{path} is empty.")
+
+        magic, version, header_len = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} metadata store.")
+        header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_len])
+        body_at = _pad8(_PREAMBLE.size + header_len)
+
+        self.num_rows = header["num_rows"]
+        self.columns = [column["name"] for column in header["columns"]]
+        self._columns = {}
+        for column in header["columns"]:
+            offsets = np.frombuffer(self._mmap, dtype="<u8", count=self.num_rows + 1, offset=body_at + column["offsets_at"])
+            present = np.frombuffer(self._mmap, dtype=np.uint8, count=self.num_rows, offset=body_at + column["present_at"])
+            self._columns[column["name"]] = (column["kind"], offsets, present, body_at + column["data_at"])
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def _cell(self, name: str, row: int):
+        kind, offsets, present, data_at = self._columns[name]
+        start, end = int(offsets[row]), int(offsets[row + 1])
+        raw = self._mmap[data_at + start:data_at + end].decode("utf-8")
+        return raw if kind == "text" else json.loads(raw)
+
+    def get(self, row: int, columns: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """Returns one row as a dict, limited to `columns` if given."""
+        if not 0 <= row < self.num_rows:
+            raise IndexError(f"Row {row} is out of range for {self.num_rows} rows.")
+        names = self.columns if columns is None else [name for name in columns if name in self._columns]
+        return {name: self._cell(name, row) for name in names if self._columns[name][2][row]}
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return self.get(int(row))
+
+    def get_many(self, rows: Sequence[int], columns: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Returns several rows (e.g. the top-k hits of a search) in the given order.
+        Offsets and presence flags for all rows are gathered in one vectorized step per column.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if rows.size and (rows.min() < 0 or rows.max() >= self.num_rows):
+            raise IndexError(f"Row ids out of range for {self.num_rows} rows.")
+        names = self.columns if columns is None else [name for name in columns if name in self._columns]
+        results = [{} for _ in range(len(rows))]
+        for name in names:
+            kind, offsets, present, data_at = self._columns[name]
+            starts, ends, has_value = offsets[rows], offsets[rows + 1], present[rows]
+            for result, start, end, flag in zip(results, starts.tolist(), ends.tolist(), has_value.tolist()):
+                if flag:
+                    raw = self._mmap[data_at + start:data_at + end].decode("utf-8")
+                    result[name] = raw if kind == "text" else json.loads(raw)
+        return results
+
+    def close(self):
+        self._columns = {}
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Rows handed out earlier may still reference the map; it is released with them.
+            pass
+
+
+class JsonMetadata:
+    """Adapter giving a list of dicts (a legacy product_data.json) the MetadataStore interface."""
+    def __init__(self, records: List[Dict[str, Any]], path: Optional[str] = None):
+        self.records = records
+        self.path = path
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return self.records[row]
+
+    def get(self, row: int, columns: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        record = self.records[row]
+        return dict(record) if columns is None else {name: record[name] for name in columns if name in record}
+
+    def get_many(self, rows: Sequence[int], columns: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        return [self.get(int(row), columns) for row in rows]
+
+
+class SegmentedMetadata:
+    """
+    Several metadata stores read as one: the rows of each segment follow those of
+    the previous one. Used for catalogs that grow by appending new segments.
+    """
+    def __init__(self, segments: Sequence[Any], path: Optional[str] = None):
+        self.segments = list(segments)
+        self._starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+        self.path = path or ", ".join(str(getattr(segment, "path", "?")) for segment in self.segments)
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def _locate(self, row: int):
+        if not 0 <= row < len(self):
+            raise IndexError(f"Row {row} is out of range for {len(self)} rows.")
+        segment = int(np.searchsorted(self._starts, row, side="right")) - 1
+        return self.segments[segment], row - int(self._starts[segment])
+
+    def get(self, row: int, columns: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        segment, local_row = self._locate(int(row))
+        return segment.get(local_row, columns)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return self.get(int(row))
+
+    def get_many(self, rows: Sequence[int], columns: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Returns rows in the given order, fetching them with one `get_many` per segment touched."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(self.segments) == 1:
+            return self.segments[0].get_many(rows, columns)
+        if rows.size and (rows.min() < 0 or rows.max() >= len(self)):
+            raise IndexError(f"Row ids out of range for {len(self)} rows.")
+        owners = np.searchsorted(self._starts, rows, side="right") - 1
+        results: List[Dict[str, Any]] = [None] * len(rows)
+        for segment in np.unique(owners).tolist():
+            positions = np.flatnonzero(owners == segment)
+            local_rows = rows[positions] - self._starts[segment]
+            for position, record in zip(positions.tolist(), self.segments[segment].get_many(local_rows, columns)):
+                results[position] = record
+        return results
+
+
+def open_metadata(path: str):
+    """Opens one metadata file: a legacy JSON list or a memory-mapped store."""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return JsonMetadata(json.load(f), path=path)
+    return MetadataStore(path)
+
+
+def load_metadata(store_path: str, json_path: str):
+    """Opens the memory-mapped store if it exists, otherwise falls back to the legacy JSON file."""
+    return open_metadata(store_path if os.path.exists(store_path) else json_path)
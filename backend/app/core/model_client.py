@@ -0,0 +1,183 @@
+import ipaddress
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+# Wire protocol between the API processes and the model server
+# (multiprocessing.connection, i.e. pickled messages over a socket):
+#
+#   request:  {"op": <name>, ...arguments}
+#   response: ("chunk", text)      zero or more, only for streaming ops
+#             ("ok", result)       final message on success
+#             ("error", message)   final message on failure
+#
+# Images never travel through pickle: the client copies the decoded RGB pixels
+# into a shared-memory block and sends only its name and shape.
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """'host:port' becomes a TCP address; anything else is treated as a Unix socket path."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def checked_address(address: str, authkey: bytes, allow_remote: bool = False) -> Union[str, Tuple[str, int]]:
+    """
+    Parses `address`, refusing settings that would expose the model server: an empty
+    authkey, or a TCP address off the loopback interface unless `allow_remote`.
+    """
+    if not authkey:
+        raise ModelServerError("MODEL_SERVER_AUTHKEY is not set. The model server exchanges pickled messages, "
+                               "so it needs a secret shared with its clients.")
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple) and not allow_remote and not _is_loopback(parsed[0]):
+        raise ModelServerError(f"Model server address {address} is not on the loopback interface. "
+                               f"Use a Unix socket path, or set MODEL_SERVER_ALLOW_REMOTE=1 to allow it.")
+    return parsed
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:  # another host name
+        return False
+
+
+def put_image(image: Image.Image) -> Tuple[Dict[str, Any], shared_memory.SharedMemory]:
+    """Copies an image's RGB pixels into a new shared-memory block; the caller must release it."""
+    pixels = np.asarray(image.convert("RGB"), dtype=np.uint8)
+    block = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+    np.ndarray(pixels.shape, dtype=np.uint8, buffer=block.buf)[...] = pixels
+    return {"shm": block.name, "shape": pixels.shape}, block
+
+
+def release_image(block: shared_memory.SharedMemory):
+    block.close()
+    block.unlink()
+
+
+def take_image(descriptor: Dict[str, Any]) -> Image.Image:
+    """Rebuilds an image from a shared-memory descriptor (server side). The block stays owned by the client."""
+    block = shared_memory.SharedMemory(name=descriptor["shm"])
+    try:
+        # The client owns (and unlinks) the block; stop this process's resource
+        # tracker from also trying to clean it up when we exit.
+        resource_tracker.unregister(block._name, "shared_memory")
+        pixels = np.ndarray(tuple(descriptor["shape"]), dtype=np.uint8, buffer=block.buf)
+        # fromarray copies RGB data, so the image stays valid after the block is closed.
+        image = Image.fromarray(pixels, mode="RGB")
+        del pixels
+        return image
+    finally:
+        block.close()
+
+
+class ModelServerError(RuntimeError):
+    """Raised when the model server reports a failure or cannot be reached."""
+
+
+class ModelServerClient:
+    """
+    Talks to a model server (see app.core.model_server). Each thread gets its own
+    connection, since a connection carries one request/response exchange at a time.
+    """
+    def __init__(self, address: str, authkey: bytes, allow_remote: bool = False):
+        self.address = checked_address(address, authkey, allow_remote)
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, "conn", None) is None:
+            try:
+                self._local.conn = Client(self.address, authkey=self.authkey)
+            except OSError as e:
+                raise ModelServerError(f"Cannot reach model server at {self.address}: {e}") from e
+        return self._local.conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, request: Dict[str, Any], on_chunk: Optional[Callable[[str], None]] = None) -> Any:
+        """Sends one request and waits for its result, forwarding streamed chunks to `on_chunk`."""
+        for attempt in (1, 2):
+            conn = self._connection()
+            received = False
+            try:
+                conn.send(request)
+                while True:
+                    kind, payload = conn.recv()
+                    received = True
+                    if kind != "chunk":
+                        break
+                    if on_chunk is not None:
+                        on_chunk(payload)
+            except (EOFError, OSError) as e:
+                self._drop_connection()
+                # The server restarted or the socket went stale: reconnect once, but only if
+                # nothing came back yet; a request that already streamed text is not run twice.
+                if received or attempt == 2:
+                    raise ModelServerError(f"Lost connection to model server at {self.address}: {e}") from e
+                continue
+            except BaseException:
+                # e.g. on_chunk raised: the rest of the reply is still unread, so this
+                # connection cannot carry the thread's next request.
+                self._drop_connection()
+                raise
+            if kind == "error":
+                raise ModelServerError(payload)
+            return payload
+
+    def ensure_serves(self, model: str):
+        """Checks that the server is reachable and hosts `model`."""
+        served = self.call({"op": "ping"})
+        if model not in served:
+            raise ModelServerError(f"Model server at {self.address} does not host '{model}' (it hosts {served}).")
+
+    def encode(self, inputs: Sequence[Union[str, Image.Image]], **kwargs) -> np.ndarray:
+        """CLIP embeddings for a mixed list of texts and images, like SentenceTransformer.encode."""
+        blocks = []
+        try:
+            payload = []
+            for item in inputs:
+                if isinstance(item, Image.Image):
+                    descriptor, block = put_image(item)
+                    blocks.append(block)
+                    payload.append({"image": descriptor})
+                else:
+                    payload.append({"text": item})
+            return self.call({"op": "clip_encode", "inputs": payload})
+        finally:
+            for block in blocks:
+                release_image(block)
+
+    def analyze_image(self, image: Image.Image, query: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """Runs the VLM analysis on the server, streaming text to `on_chunk` if given."""
+        descriptor, block = put_image(image)
+        try:
+            return self.call({"op": "vlm_analyze", "image": descriptor, "query": query,
+                              "stream": on_chunk is not None}, on_chunk=on_chunk)
+        finally:
+            release_image(block)
+
+
+class RemoteCLIPEncoder:
+    """Stands in for the SentenceTransformer CLIP model when it runs in a model server."""
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def encode(self, inputs: List[Union[str, Image.Image]], **kwargs) -> np.ndarray:
+        return self.client.encode(inputs, **kwargs)
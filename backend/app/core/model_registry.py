@@ -0,0 +1,148 @@
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from app.core import config
+
+# Load states reported by ModelRegistry.status().
+NOT_LOADED, LOADING, READY, FAILED = "not_loaded", "loading", "ready", "failed"
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of heavy resources (models, indexes).
+
+    Loaders are registered cheaply at import time and only run on first use via
+    `get`, or ahead of time via `warm_up`. Each resource is loaded at most once,
+    even when several threads ask for it at the same time, and every agent that
+    asks for the same name shares the same instance. A failed load is retried on a
+    later `get` once its backoff (MODEL_RETRY_BACKOFF_S, doubling) has passed, or
+    right away after `unload`.
+    """
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._status: Dict[str, Dict[str, Any]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._registry_lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        """Registers `loader` for `name`. Re-registering an unloaded name replaces its loader."""
+        with self._registry_lock:
+            if self._status.get(name, {}).get("state") in (LOADING, READY):
+                return
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+            self._status[name] = {"state": NOT_LOADED}
+
+    def get(self, name: str) -> Optional[Any]:
+        """
+        Returns the resource, loading it first if needed. Returns None if loading
+        failed; the error is logged once per attempt and reported by `status`.
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"No model registered under '{name}'.")
+
+        with self._locks[name]:
+            # Another thread may have finished loading while we waited for the lock.
+            if name in self._models:
+                return self._models[name]
+            status = self._status[name]
+            if status["state"] == FAILED and time.monotonic() < status["retry_at"]:
+                return None
+
+            attempts = status.get("attempts", 0) + 1
+            self._status[name] = {"state": LOADING, "started_at": time.time(), "attempts": attempts}
+            started = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                backoff = self._backoff(attempts)
+                print(f"ERROR: [ModelRegistry] Failed to load '{name}' (attempt {attempts}): {e}"
+                      + (f". Retrying on next use after {backoff:g}s." if backoff != float("inf") else ""))
+                traceback.print_exc()
+                self._status[name] = {"state": FAILED, "error": str(e), "attempts": attempts,
+                                      "load_seconds": round(time.perf_counter() - started, 3),
+                                      "retry_at": time.monotonic() + backoff}
+                return None
+
+            self._models[name] = model
+            self._status[name] = {"state": READY, "load_seconds": round(time.perf_counter() - started, 3)}
+            print(f"[ModelRegistry] '{name}' ready in {self._status[name]['load_seconds']}s.")
+            return model
+
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        """Seconds before a resource that failed `attempts` times in a row is loaded again."""
+        if config.MODEL_RETRY_BACKOFF_S <= 0:
+            return float("inf")
+        return min(config.MODEL_RETRY_BACKOFF_S * 2 ** (attempts - 1), max(config.MODEL_RETRY_MAX_S, config.MODEL_RETRY_BACKOFF_S))
+
+    def peek(self, name: str) -> Optional[Any]:
+        """Returns the resource only if it is already loaded; never triggers a load."""
+        return self._models.get(name)
+
+    def override(self, name: str, model: Any):
+        """Installs an already-built resource (e.g. a stub in benchmarks) under `name`."""
+        with self._registry_lock:
+            self._loaders.setdefault(name, lambda: model)
+            self._locks.setdefault(name, threading.Lock())
+            self._models[name] = model
+            self._status[name] = {"state": READY, "load_seconds": 0.0}
+
+    def unload(self, name: str):
+        """Drops a loaded (or failed) resource so the next `get` loads it again."""
+        if name not in self._loaders:
+            return
+        with self._locks[name]:
+            self._models.pop(name, None)
+            self._status[name] = {"state": NOT_LOADED}
+
+    def warm_up(self, names: Optional[Iterable[str]] = None):
+        """Loads the given resources (all registered ones by default), blocking until done."""
+        for name in list(names if names is not None else self._loaders):
+            if name in self._loaders:
+                self.get(name)
+
+    def is_ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        return all(name in self._models for name in (names if names is not None else self._loaders))
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Per-resource load state, for health and readiness endpoints."""
+        now = time.monotonic()
+        with self._registry_lock:
+            statuses = {name: dict(status) for name, status in self._status.items()}
+        for status in statuses.values():
+            retry_at = status.pop("retry_at", None)
+            if retry_at is not None and retry_at != float("inf"):
+                status["retry_in_s"] = round(max(0.0, retry_at - now), 1)
+        return statuses
+
+
+def _load_clip():
+    # Imported here so that importing the app does not pay for torch/sentence-transformers.
+    from sentence_transformers import SentenceTransformer
+
+    print("Loading CLIP model for semantic search...")
+    return SentenceTransformer('clip-ViT-B-32')
+
+
+def _connect_remote_clip():
+    from app.core.model_client import ModelServerClient, RemoteCLIPEncoder
+
+    client = ModelServerClient(config.CLIP_SERVER_ADDRESS, config.MODEL_SERVER_AUTHKEY, config.MODEL_SERVER_ALLOW_REMOTE)
+    client.ensure_serves("clip")
+    print(f"Using CLIP from the model server at {config.CLIP_SERVER_ADDRESS}")
+    return RemoteCLIPEncoder(client)
+
+
+# The single registry shared by every agent in this process.
+model_registry = ModelRegistry()
+
+# CLIP is shared by every agent that needs image or text embeddings. With
+# MODEL_BACKEND=remote it lives in the model server and this entry is a client.
+model_registry.register("clip", _connect_remote_clip if config.MODEL_BACKEND == "remote" else _load_clip)
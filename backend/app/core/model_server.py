@@ -0,0 +1,138 @@
+# Model server: loads CLIP and/or Qwen2.5-VL exactly once per host and serves
+# every API worker process over a local socket. Start it before the API:
+#
+#   cd backend
+#   python -m app.core.model_server                       # both models
+#   python -m app.core.model_server --models clip         # CLIP only, e.g. on its own address
+#
+# and run the API with MODEL_BACKEND=remote (see app.core.config). Both sides need the
+# same MODEL_SERVER_AUTHKEY. The server listens on a Unix socket by default; a TCP
+# address must be on the loopback interface unless MODEL_SERVER_ALLOW_REMOTE=1.
+
+import os
+
+# This process hosts the real models, so it must never try to forward to itself.
+os.environ["MODEL_BACKEND"] = "local"
+
+import argparse
+import importlib
+import socket
+import stat
+import sys
+import threading
+import traceback
+from multiprocessing.connection import Listener
+
+import numpy as np
+
+from app.core import config
+from app.core.model_client import ModelServerError, checked_address, take_image
+from app.core.model_registry import model_registry
+
+
+class ModelServer:
+    """Accepts connections and handles each one on its own thread."""
+    def __init__(self, address: str, authkey: bytes, models, allow_remote: bool = False):
+        self.address = checked_address(address, authkey, allow_remote)
+        self.authkey = authkey
+        self.models = set(models)
+
+    def _product_agent(self):
+        # Imported lazily so a CLIP-only server never touches the VLM code.
+        from app.agents.product_research_agent import product_agent
+        return product_agent
+
+    def _handle(self, request, send):
+        op = request.get("op")
+        if op == "ping":
+            return sorted(self.models)
+
+        if op == "clip_encode" and "clip" in self.models:
+            clip = model_registry.get("clip")
+            if clip is None:
+                raise RuntimeError("CLIP model failed to load on the model server.")
+            inputs = [take_image(item["image"]) if "image" in item else item["text"] for item in request["inputs"]]
+            return np.asarray(clip.encode(inputs), dtype='float32')
+
+        if op == "vlm_analyze" and "qwen_vl" in self.models:
+            image = take_image(request["image"])
+            on_chunk = (lambda text: send(("chunk", text))) if request.get("stream") else None
+            # Requests from every API worker meet in the agent's batching worker.
+            return self._product_agent().analyze_image(image, request["query"], on_chunk=on_chunk)["analysis"]
+
+        raise ValueError(f"Unsupported operation '{op}' (this server hosts: {', '.join(sorted(self.models))}).")
+
+    def _serve_connection(self, conn):
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                conn.send(message)
+
+        try:
+            while True:
+                request = conn.recv()
+                try:
+                    send(("ok", self._handle(request, send)))
+                except Exception as e:
+                    traceback.print_exc()
+                    send(("error", f"{type(e).__name__}: {e}"))
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def _remove_stale_socket(self):
+        """Removes a Unix socket left behind by a server that is no longer running."""
+        if not isinstance(self.address, str) or not os.path.exists(self.address):
+            return
+        if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+            raise ModelServerError(f"{self.address} exists and is not a socket.")
+        with socket.socket(socket.AF_UNIX) as probe:
+            try:
+                probe.connect(self.address)
+            except ConnectionRefusedError:
+                os.unlink(self.address)
+                return
+        raise ModelServerError(f"Another model server is already listening on {self.address}.")
+
+    def serve_forever(self):
+        self._remove_stale_socket()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            if isinstance(self.address, str):
+                os.chmod(self.address, 0o660)  # owner and group only
+            print(f"[ModelServer] Serving {', '.join(sorted(self.models))} on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # e.g. a client with the wrong authkey; keep serving everyone else.
+                    print(f"WARNING: [ModelServer] Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve CLIP and Qwen2.5-VL to API worker processes.")
+    parser.add_argument("--models", default="clip,qwen_vl", help="Comma-separated: clip, qwen_vl.")
+    parser.add_argument("--address", default=config.MODEL_SERVER_ADDRESS,
+                        help="A Unix socket path or 'host:port' (loopback only unless MODEL_SERVER_ALLOW_REMOTE=1).")
+    args = parser.parse_args()
+
+    models = [name for name in args.models.split(",") if name]
+    try:
+        server = ModelServer(args.address, config.MODEL_SERVER_AUTHKEY, models, config.MODEL_SERVER_ALLOW_REMOTE)
+    except ModelServerError as e:
+        print(f"FATAL ERROR: [ModelServer] {e}")
+        sys.exit(1)
+    if "qwen_vl" in models:
+        # Registers the 'qwen_vl' loader.
+        importlib.import_module("app.agents.product_research_agent")
+
+    print(f"[ModelServer] Loading models: {', '.join(models)}")
+    model_registry.warm_up(models)
+    try:
+        server.serve_forever()
+    except ModelServerError as e:
+        print(f"FATAL ERROR: [ModelServer] {e}")
+        sys.exit(1)
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+
+class AgentNode:
+    """
+    A single step in the agent graph.
+    `func` is a blocking callable that receives the results of `depends_on`
+    as positional arguments, in the order they are listed. If `streams` is set,
+    it also receives an `emit` keyword argument it can call (from any thread)
+    to publish partial output before it returns.
+    If `deadline` (a time.monotonic() value) passes before the node finishes,
+    `fallback()` (or None) stands in for its result. If the call was already
+    running, its real result is reported later: as 'finished' if no dependent
+    has started yet (they get the real result), else as a 'late' event.
+    """
+    def __init__(self, name: str, func: Callable[..., Any], depends_on: Sequence[str] = (), streams: bool = False,
+                 deadline: Optional[float] = None, fallback: Optional[Callable[[], Any]] = None):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+        self.streams = streams
+        self.deadline = deadline
+        self.fallback = fallback
+
+
+class NodeEvent(NamedTuple):
+    """
+    An update emitted by the scheduler: kind is 'started', 'partial', 'finished',
+    'timed_out' (result is the fallback) or 'late' (result of a timed-out node whose
+    dependents already ran with the fallback). A timed-out node that finishes before
+    any dependent started reports 'finished' after its 'timed_out'.
+    """
+    kind: str
+    node: str
+    result: Optional[Any] = None
+
+
+def _validate_graph(nodes: List[AgentNode]) -> Dict[str, AgentNode]:
+    """Checks for duplicate names, unknown dependencies and cycles."""
+    by_name: Dict[str, AgentNode] = {}
+    for node in nodes:
+        if node.name in by_name:
+            raise ValueError(f"Duplicate agent node '{node.name}'.")
+        by_name[node.name] = node
+
+    for node in nodes:
+        for dep in node.depends_on:
+            if dep not in by_name:
+                raise ValueError(f"Agent node '{node.name}' depends on unknown node '{dep}'.")
+
+    # Kahn's algorithm: if we cannot resolve every node, there is a cycle.
+    remaining = {name: set(node.depends_on) for name, node in by_name.items()}
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError(f"Agent graph has a cycle between: {sorted(remaining)}")
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return by_name
+
+
+class AgentScheduler:
+    """
+    Runs a small DAG of blocking agent calls on a shared thread pool.
+    Each node starts as soon as all of its dependencies have finished, so
+    independent agents run side by side and the event loop stays free.
+    """
+    def __init__(self, max_workers: int = 4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-worker")
+
+    async def run(self, nodes: List[AgentNode]):
+        """
+        Executes the graph, yielding a NodeEvent whenever a node starts, emits
+        partial output, finishes or misses its deadline.
+        If a node raises, nodes that have not started yet are abandoned and the
+        exception is propagated to the caller. Errors of nodes that already timed
+        out are only logged. Once every node has a result, the caller may stop
+        iterating instead of waiting for 'late' events.
+        """
+        graph = _validate_graph(nodes)
+        pending = dict(graph)
+        loop = asyncio.get_running_loop()
+        results: Dict[str, Any] = {}
+        running = set()
+        # Nodes that timed out while their call was still running.
+        late = set()
+        # Partial output and completions from worker threads arrive here, in order.
+        updates: asyncio.Queue = asyncio.Queue()
+
+        def make_emit(name: str) -> Callable[[Any], None]:
+            def emit(partial: Any):
+                loop.call_soon_threadsafe(updates.put_nowait, ("partial", name, partial))
+            return emit
+
+        def launch_ready() -> List[str]:
+            started = []
+            for name, node in list(pending.items()):
+                if all(dep in results for dep in node.depends_on):
+                    del pending[name]
+                    args = [results[dep] for dep in node.depends_on]
+                    kwargs = {"emit": make_emit(name)} if node.streams else {}
+                    future = loop.run_in_executor(self.executor, functools.partial(node.func, *args, **kwargs))
+                    future.add_done_callback(lambda f, name=name: updates.put_nowait(("done", name, f)))
+                    running.add(name)
+                    started.append(name)
+            return started
+
+        def expire() -> List[str]:
+            """Gives every unfinished node whose deadline has passed its fallback result."""
+            now = time.monotonic()
+            expired = []
+            for name, node in graph.items():
+                if node.deadline is None or node.deadline > now or name in results:
+                    continue
+                if name in running:
+                    running.discard(name)
+                    late.add(name)
+                else:
+                    del pending[name]
+                results[name] = node.fallback() if node.fallback else None
+                expired.append(name)
+            return expired
+
+        def next_deadline() -> Optional[float]:
+            deadlines = [graph[name].deadline for name in list(running) + list(pending)
+                         if graph[name].deadline is not None]
+            return min(deadlines) if deadlines else None
+
+        for name in launch_ready():
+            yield NodeEvent("started", name)
+
+        while running or late:
+            deadline = next_deadline()
+            try:
+                if deadline is None:
+                    kind, name, payload = await updates.get()
+                else:
+                    kind, name, payload = await asyncio.wait_for(updates.get(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                for name in expire():
+                    yield NodeEvent("timed_out", name, results[name])
+                for started in launch_ready():
+                    yield NodeEvent("started", started)
+                continue
+
+            if kind == "partial":
+                yield NodeEvent("partial", name, payload)
+                continue
+
+            if name in late:
+                late.discard(name)
+                if payload.exception() is not None:
+                    print(f"ERROR: [AgentScheduler] Timed-out node '{name}' failed: {payload.exception()}")
+                    continue
+                if any(name in graph[other].depends_on and other not in pending for other in graph):
+                    yield NodeEvent("late", name, payload.result())
+                    continue
+                # Nothing has used the fallback yet: the real result replaces it.
+                results[name] = payload.result()
+                yield NodeEvent("finished", name, results[name])
+                continue
+
+            running.discard(name)
+            # Raises the node's exception, if any.
+            results[name] = payload.result()
+            yield NodeEvent("finished", name, results[name])
+
+            for started in launch_ready():
+                yield NodeEvent("started", started)
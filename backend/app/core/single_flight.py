@@ -0,0 +1,177 @@
+import asyncio
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+
+class _Flight:
+    """One running producer and the events it has published so far."""
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # Set when every subscriber left and the producer was cancelled.
+        self.abandoned = False
+        self.task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def publish(self, event: Any = None, done: bool = False):
+        if not done:
+            self.events.append(event)
+        self.done = self.done or done
+        # Wake everyone waiting for the next event, then arm a fresh Event for the one after.
+        wakeup, self._wakeup = self._wakeup, asyncio.Event()
+        wakeup.set()
+
+    async def wait(self):
+        await self._wakeup.wait()
+
+
+class SingleFlight:
+    """
+    Runs at most one producer (an async iterator of events) per key at a time.
+
+    Concurrent callers with the same key subscribe to the running producer and
+    all receive its full event sequence, including events published before they
+    joined. Successful sequences are kept for `result_ttl_s` seconds (at most
+    `max_results` of them), so identical requests arriving shortly afterwards
+    are replayed without running the producer again. Failed or cancelled runs are
+    not kept, nor runs whose events `stream`'s `cacheable` rejects.
+
+    All methods must be used from a single event loop.
+    """
+    def __init__(self, max_results: int = 256, result_ttl_s: float = 30.0):
+        self.max_results = max_results
+        self.result_ttl_s = result_ttl_s
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._results: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._counters = {"started": 0, "joined": 0, "replayed": 0, "failed": 0, "abandoned": 0}
+
+    def _cached(self, key: Hashable) -> Optional[List[Any]]:
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        finished_at, events = entry
+        if time.monotonic() - finished_at > self.result_ttl_s:
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return events
+
+    def _remember(self, key: Hashable, events: List[Any]):
+        if self.result_ttl_s <= 0 or self.max_results <= 0:
+            return
+        self._results[key] = (time.monotonic(), events)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    async def _produce(self, key: Hashable, flight: _Flight, start: Callable[[], AsyncIterator[Any]],
+                       cacheable: Optional[Callable[[List[Any]], bool]]):
+        try:
+            async for event in start():
+                flight.publish(event)
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            # Re-raised once the finally block has told the subscribers.
+            raise
+        except Exception as e:
+            flight.error = e
+            self._counters["failed"] += 1
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            # A producer that swallowed its cancellation may end early without an error.
+            if flight.error is None and not flight.abandoned and (cacheable is None or cacheable(flight.events)):
+                self._remember(key, flight.events)
+            flight.publish(done=True)
+
+    async def stream(self, key: Hashable, start: Callable[[], AsyncIterator[Any]],
+                     cacheable: Optional[Callable[[List[Any]], bool]] = None) -> AsyncIterator[Any]:
+        """
+        Yields the events of the producer for `key`, starting it with `start()` if
+        none is running or cached. Re-raises the producer's exception, if any.
+        The producer is cancelled once every subscriber has gone away. Its events are
+        replayed to later callers only if `cacheable(events)` is true (or not given).
+        """
+        events = self.join(key)
+        if events is None:
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(self._produce(key, flight, start, cacheable))
+            self._counters["started"] += 1
+            events = self._subscribe(key, flight)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+    def join(self, key: Hashable) -> Optional[AsyncIterator[Any]]:
+        """
+        The events of the producer for `key` if one is running or its result is cached,
+        else None; never starts a producer. The subscription is taken before returning,
+        so the producer cannot be abandoned (and a later call start a new one) before
+        the events are read.
+        """
+        events = self._cached(key)
+        if events is not None:
+            self._counters["replayed"] += 1
+            return self._replay(events)
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        self._counters["joined"] += 1
+        return self._subscribe(key, flight)
+
+    @staticmethod
+    async def _replay(events: List[Any]) -> AsyncIterator[Any]:
+        for event in events:
+            yield event
+
+    def _subscribe(self, key: Hashable, flight: _Flight) -> AsyncIterator[Any]:
+        flight.subscribers += 1
+        left = False
+
+        def leave():
+            nonlocal left
+            if left:
+                return
+            left = True
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more (e.g. every client disconnected).
+                self._counters["abandoned"] += 1
+                flight.abandoned = True
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+        async def follow():
+            position = 0
+            try:
+                while True:
+                    while position < len(flight.events):
+                        yield flight.events[position]
+                        position += 1
+                    if flight.done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    await flight.wait()
+            finally:
+                leave()
+
+        events = follow()
+        # A subscription that is never iterated (its request went away first) never runs
+        # its finally block; leave when it is dropped instead.
+        weakref.finalize(events, leave)
+        return events
+
+    def has(self, key: Hashable) -> bool:
+        """True if a producer for `key` is running or its recent result is cached."""
+        return key in self._flights or self._cached(key) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._counters, in_flight=len(self._flights), cached_results=len(self._results))
@@ -0,0 +1,128 @@
+import json
+import zlib
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional: the standard library serializer is used instead.
+    orjson = None
+
+# Server-Sent Events formatting for the recommendation stream.
+#
+# Snapshot protocol (the default): every context event carries the whole ProductContext.
+# Delta protocol (?protocol=delta): the first context event carries {"snapshot": context}
+# and every later one {"patch": ops}, a JSON Patch (RFC 6902; add/replace/remove) against
+# the context sent before it. The VLM text and the similar products are then sent once
+# instead of with every event. frontend/src/contextStream.js rebuilds the context.
+#
+# Either protocol can be gzip-encoded (see `gzip_stream`). gzip removes the repetition
+# of snapshots about as well as deltas do, so a gzip-encoded delta stream is within a
+# few percent of a snapshot one (scripts/bench_sse_protocol.py); deltas pay off for
+# clients or deployments without compression.
+
+PROTOCOLS = ("snapshot", "delta")
+
+
+def dumps(value: Any) -> str:
+    """Compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def format_event(event: str, data: str) -> str:
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+def _pointer(path: str, key: str) -> str:
+    return f"{path}/{key.replace('~', '~0').replace('/', '~1')}"
+
+
+def diff(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """
+    JSON Patch ops turning `old` into `new`. Objects are compared key by key; any other
+    value that changed (including lists) is replaced whole.
+    """
+    if _same(old, new):
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+            elif not _same(old[key], value):
+                ops.extend(diff(old[key], value, _pointer(path, key)))
+        ops.extend({"op": "remove", "path": _pointer(path, key)} for key in old if key not in new)
+        return ops
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def _same(old: Any, new: Any) -> bool:
+    # Unchanged subtrees are compared in C, without walking them here. The type check
+    # keeps 1, 1.0 and True apart (equal, but serialized differently) where values are compared directly.
+    return old is new or (type(old) is type(new) and old == new)
+
+
+def apply_patch(document: Any, ops: List[Dict[str, Any]]) -> Any:
+    """Applies JSON Patch `ops` (as produced by `diff`) to `document` in place; returns the result."""
+    for op in ops:
+        if op["path"] == "":
+            document = op.get("value")
+            continue
+        keys = [key.replace("~1", "/").replace("~0", "~") for key in op["path"].split("/")[1:]]
+        parent = document
+        for key in keys[:-1]:
+            parent = parent[int(key)] if isinstance(parent, list) else parent[key]
+        last = int(keys[-1]) if isinstance(parent, list) else keys[-1]
+        if op["op"] == "remove":
+            del parent[last]
+        else:
+            parent[last] = op["value"]
+    return document
+
+
+class ContextEvents:
+    """Formats the ProductContext events of one stream in the snapshot or delta protocol."""
+    def __init__(self, protocol: str = "snapshot"):
+        if protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown stream protocol '{protocol}'. Expected one of {PROTOCOLS}.")
+        self.protocol = protocol
+        self._sent: Optional[Dict[str, Any]] = None
+
+    def format(self, event: str, context) -> str:
+        if self.protocol == "snapshot":
+            return format_event(event, context.model_dump_json())
+        state = context.model_dump(mode="json")
+        payload = {"snapshot": state} if self._sent is None else {"patch": diff(self._sent, state)}
+        self._sent = state
+        return format_event(event, dumps(payload))
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Whether an Accept-Encoding header allows gzip (and does not give it q=0 or an unreadable q)."""
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() in ("gzip", "*"):
+            quality = params.strip()
+            if not quality.startswith("q="):
+                return True
+            try:
+                return float(quality[2:] or 0) > 0
+            except ValueError:
+                return False
+    return False
+
+
+async def gzip_stream(messages, level: int = 6):
+    """
+    gzip-encodes a stream of SSE messages. Each message is flushed on its own, so the
+    client can decode every event as soon as it arrives; later events still compress
+    against the earlier ones (the repeated JSON keys, product titles, ...).
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        async for message in messages:
+            yield compressor.compress(message.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        await messages.aclose()
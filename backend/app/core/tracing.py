@@ -0,0 +1,213 @@
+import bisect
+import contextvars
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.core import config
+
+# Lightweight tracing and Prometheus-style metrics for the agent pipeline.
+#
+# `span(name)` times a block of code. Every span is observed in the
+# `agent_stage_seconds` histogram (served at /metrics) and, if a Trace is active
+# for the current request, added to it so the per-stage timings can be sent to
+# the client. With TRACING_ENABLED=0, `span` returns a shared no-op object.
+
+
+# --- Metrics ---
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """A monotonically increasing value per label set."""
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label set."""
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help_text, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric of the process and renders them in the Prometheus text format."""
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram("agent_stage_seconds", "Time spent in each stage of the agent pipeline.", ("stage",))
+VLM_TOKENS = metrics.counter("vlm_tokens_total", "Tokens processed by the VLM.", ("kind",))
+VLM_TOKENS_PER_SECOND = metrics.histogram(
+    "vlm_decode_tokens_per_second", "Generated tokens per second of decoding, per batch.",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+
+
+# --- Traces ---
+
+class Trace:
+    """Per-request stage timings (milliseconds) plus attributes such as token counts."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, **attrs):
+        with self._lock:
+            stage = self._stages.setdefault(name, {"ms": 0.0})
+            # A stage that runs several times (e.g. once per chunk) accumulates.
+            stage["ms"] = round(stage["ms"] + seconds * 1000, 3)
+            stage.update(attrs)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {name: dict(stage) for name, stage in self._stages.items()}
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+
+def new_trace() -> Optional[Trace]:
+    """A fresh Trace, or None when tracing is disabled."""
+    return Trace() if config.TRACING_ENABLED else None
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+class use_trace:
+    """Makes `trace` the current trace for the enclosed block (in this thread / task)."""
+    __slots__ = ("trace", "_token")
+
+    def __init__(self, trace: Optional[Trace]):
+        self.trace = trace
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current_trace.reset(self._token)
+
+
+def record(name: str, seconds: float, trace: Optional[Trace] = None, **attrs):
+    """Records an already measured stage, e.g. one timed on a batching thread."""
+    if not config.TRACING_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=name)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.record(name, seconds, **attrs)
+
+
+class _Span:
+    __slots__ = ("name", "trace", "attrs", "started")
+
+    def __init__(self, name: str, trace: Optional[Trace], attrs: Dict[str, Any]):
+        self.name, self.trace, self.attrs = name, trace, attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.started, self.trace, **self.attrs)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, trace: Optional[Trace] = None, **attrs):
+    """
+    Times the enclosed block as stage `name`. Attributes can be attached up front
+    or with `.set(...)` inside the block.
+    """
+    if not config.TRACING_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, trace or _current_trace.get(), attrs)
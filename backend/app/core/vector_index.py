@@ -0,0 +1,285 @@
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+# Index types understood by `build_index`.
+#   flat      - exact brute-force search (the original behaviour).
+#   flat_fp16 - brute-force over float16 codes; half the memory, near-exact.
+#   flat_sq8  - brute-force over 8-bit scalar-quantized codes; a quarter of the memory.
+#   ivf_flat  - inverted lists over k-means cells; searches `nprobe` cells.
+#   ivf_pq    - IVF with product-quantized vectors; much smaller, approximate distances.
+#   hnsw      - graph-based; no training, good recall at high QPS, more memory.
+INDEX_KINDS = ("flat", "flat_fp16", "flat_sq8", "ivf_flat", "ivf_pq", "hnsw")
+
+# Kinds that store vectors lossily. Ingest keeps a full-precision copy of their vectors
+# in a memory-mapped file, so the best candidates can be re-scored exactly (see `exact_scores`).
+COMPRESSED_KINDS = ("flat_fp16", "flat_sq8", "ivf_pq")
+
+# Similarity metrics.
+#   l2     - squared euclidean distance on raw vectors.
+#   ip     - raw inner product.
+#   cosine - inner product on L2-normalized vectors; the natural metric for CLIP.
+METRICS = ("l2", "ip", "cosine")
+
+# Index files written before the factory existed have no sidecar and are flat L2.
+LEGACY_INDEX_INFO = {"kind": "flat", "metric": "l2"}
+
+
+def _faiss_metric(metric: str) -> int:
+    return faiss.METRIC_L2 if metric == "l2" else faiss.METRIC_INNER_PRODUCT
+
+
+def prepare_vectors(vectors: np.ndarray, metric: str) -> np.ndarray:
+    """Returns a contiguous float32 copy of `vectors`, L2-normalized for the cosine metric."""
+    vectors = np.array(vectors, dtype='float32', copy=True, order='C')
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    if metric == "cosine":
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def default_nlist(num_vectors: int) -> int:
+    """Rule of thumb for IVF: about 4*sqrt(N) cells, with at least 39 training points per cell."""
+    return int(max(1, min(4 * np.sqrt(num_vectors), num_vectors // 39)))
+
+
+def _as_shards(vectors) -> List[np.ndarray]:
+    """One array, or a list of arrays with the same number of columns, as a list."""
+    if isinstance(vectors, np.ndarray):
+        return [vectors.reshape(1, -1) if vectors.ndim == 1 else vectors]
+    return list(vectors)
+
+
+def _take_rows(shards: List[np.ndarray], rows: np.ndarray) -> np.ndarray:
+    """Rows (in the given order) of the shards read as one array, copying only those rows."""
+    order = np.argsort(rows, kind="stable")
+    sorted_rows = rows[order]
+    offsets = np.cumsum([0] + [len(shard) for shard in shards])
+    taken = []
+    for shard, start, end in zip(shards, offsets[:-1], offsets[1:]):
+        local = sorted_rows[(sorted_rows >= start) & (sorted_rows < end)] - start
+        if len(local):
+            taken.append(np.asarray(shard[local]))
+    result = np.empty((len(rows), shards[0].shape[1]), dtype=np.float32)
+    result[order] = np.concatenate(taken)
+    return result
+
+
+def build_index(embeddings, kind: str = "flat", metric: str = "cosine", nlist: Optional[int] = None,
+                pq_m: int = 64, pq_bits: int = 8, hnsw_m: int = 32, ef_construction: int = 200,
+                train_size: int = 100_000, seed: int = 0):
+    """
+    Builds and fills a FAISS index of the requested kind.
+    `embeddings` is one array or a list of arrays (e.g. memory-mapped shards), which are
+    prepared and added one at a time: besides the index, only one of them and the training
+    sample are in memory at once. IVF indexes are trained on a random sample of at most
+    `train_size` vectors. Returns the index and an info dict describing it, to be saved alongside it.
+    """
+    if kind not in INDEX_KINDS:
+        raise ValueError(f"Unknown index kind '{kind}'. Expected one of {INDEX_KINDS}.")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}'. Expected one of {METRICS}.")
+
+    shards = _as_shards(embeddings)
+    num_vectors, dimension = sum(len(shard) for shard in shards), shards[0].shape[1]
+    faiss_metric = _faiss_metric(metric)
+    info: Dict[str, Any] = {"kind": kind, "metric": metric, "dimension": dimension}
+
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dimension) if metric == "l2" else faiss.IndexFlatIP(dimension)
+    elif kind in ("flat_fp16", "flat_sq8"):
+        quantizer_type = faiss.ScalarQuantizer.QT_fp16 if kind == "flat_fp16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(dimension, quantizer_type, faiss_metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss_metric)
+        index.hnsw.efConstruction = ef_construction
+        info.update({"hnsw_m": hnsw_m, "ef_construction": ef_construction})
+    else:
+        nlist = nlist or default_nlist(num_vectors)
+        quantizer = faiss.IndexFlatL2(dimension) if metric == "l2" else faiss.IndexFlatIP(dimension)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss_metric)
+        else:
+            if dimension % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dimension}.")
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, pq_m, pq_bits, faiss_metric)
+            info.update({"pq_m": pq_m, "pq_bits": pq_bits})
+        info["nlist"] = nlist
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        rows = np.arange(num_vectors)
+        if num_vectors > train_size:
+            rows = rng.choice(num_vectors, size=train_size, replace=False)
+        sample = prepare_vectors(_take_rows(shards, rows), metric)
+        print(f"Training {kind} index on {len(sample)} vectors...")
+        index.train(sample)
+        del sample
+
+    for shard in shards:
+        index.add(prepare_vectors(shard, metric))
+    info["ntotal"] = int(index.ntotal)
+    return index, info
+
+
+def search_parameters(info: Dict[str, Any], nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      exclude=None):
+    """
+    Per-query FAISS search parameters for the index described by `info`.
+    Passing them to `index.search` avoids mutating the shared index, so
+    concurrent searches can use different settings.
+    `exclude` is an IDSelector of ids that must never be returned (e.g. deleted
+    products); FAISS skips them during the search, so results stay exact top-k.
+    """
+    kind = info.get("kind", "flat")
+    selector = {} if exclude is None else {"sel": exclude}
+    if kind in ("ivf_flat", "ivf_pq") and nprobe:
+        return faiss.SearchParametersIVF(nprobe=int(nprobe), **selector)
+    if kind == "hnsw" and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search), **selector)
+    if exclude is not None:
+        return faiss.SearchParameters(sel=exclude)
+    return None
+
+
+def distances_to_scores(distances: np.ndarray, metric: str) -> np.ndarray:
+    """
+    Converts FAISS distances into relevance scores where higher is better.
+    cosine: the cosine similarity itself, in [-1, 1].
+    ip:     the raw inner product.
+    l2:     1 / (1 + squared distance), in (0, 1].
+    """
+    if metric == "l2":
+        return 1.0 / (1.0 + np.maximum(distances, 0.0))
+    return distances
+
+
+def exact_scores(query: np.ndarray, vectors: np.ndarray, metric: str) -> np.ndarray:
+    """Relevance scores (as `distances_to_scores`) of full-precision `vectors` for one prepared query."""
+    if metric == "l2":
+        return distances_to_scores(((vectors - query) ** 2).sum(axis=1), metric)
+    return vectors @ query
+
+
+def vectors_path(metadata_path: str) -> str:
+    """Where the full-precision vectors of a metadata file's rows live."""
+    return os.path.splitext(metadata_path)[0] + ".vectors.npy"
+
+
+def save_vectors(vectors, path: str, metric: Optional[str] = None):
+    """
+    Writes float32 vectors as a .npy file (via a temporary file), to be memory-mapped.
+    `vectors` is one array or a list of arrays written one after another; with `metric`,
+    each is prepared for it on the way (see `prepare_vectors`), else they must be already.
+    """
+    shards = _as_shards(vectors)
+    tmp_path = path + ".tmp"
+    if len(shards) == 1 and metric is None:
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(shards[0], dtype=np.float32))
+    else:
+        shape = (sum(len(shard) for shard in shards), shards[0].shape[1])
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=shape)
+        start = 0
+        for shard in shards:
+            out[start:start + len(shard)] = prepare_vectors(shard, metric) if metric else shard
+            start += len(shard)
+        out.flush()
+        del out
+    os.replace(tmp_path, path)
+
+
+class VectorStore:
+    """
+    Memory-mapped full-precision vectors of several files read as one (as in SegmentedMetadata).
+    Only the pages of the rows actually read are loaded, so it costs disk, not memory.
+    """
+    def __init__(self, arrays):
+        self.arrays = list(arrays)
+        self._starts = np.cumsum([0] + [len(array) for array in self.arrays])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """The vectors of `rows` (sorted rows read the files sequentially)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(self.arrays) == 1:
+            return np.asarray(self.arrays[0][rows])
+        part = np.searchsorted(self._starts, rows, side="right") - 1
+        result = np.empty((len(rows), self.arrays[0].shape[1]), dtype=np.float32)
+        for i in np.unique(part).tolist():
+            mask = part == i
+            result[mask] = self.arrays[i][rows[mask] - self._starts[i]]
+        return result
+
+
+class SegmentedIndex:
+    """
+    Several FAISS indexes over consecutive row ranges searched as one (as VectorStore reads
+    several vector files): each part is searched for the top k, and the results are merged.
+    A catalog update then adds a small part instead of rewriting the whole index.
+    `exclude_rows` (sorted global rows, e.g. deleted products) are skipped inside each part's search.
+    """
+    def __init__(self, parts, exclude_rows: Optional[np.ndarray] = None):
+        self.parts = list(parts)
+        self.metric = self.parts[0][1]["metric"]
+        self.d = self.parts[0][0].d
+        self._starts = np.cumsum([0] + [index.ntotal for index, _ in self.parts])
+        exclude_rows = np.asarray([] if exclude_rows is None else exclude_rows, dtype=np.int64)
+        # The IDSelectorNot only points at its batch selector, so both are kept alive here.
+        self._selectors = []
+        for start, end in zip(self._starts[:-1], self._starts[1:]):
+            local = exclude_rows[(exclude_rows >= start) & (exclude_rows < end)] - start
+            if len(local):
+                deleted = faiss.IDSelectorBatch(local)
+                self._selectors.append((deleted, faiss.IDSelectorNot(deleted)))
+            else:
+                self._selectors.append(None)
+
+    @property
+    def ntotal(self) -> int:
+        return int(self._starts[-1])
+
+    def search(self, queries: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """(distances, rows) of the `k` best rows per query over every part, like `index.search`."""
+        found = []
+        for (index, info), start, selectors in zip(self.parts, self._starts, self._selectors):
+            params = search_parameters(info, nprobe=nprobe, ef_search=ef_search,
+                                       exclude=selectors[1] if selectors else None)
+            distances, rows = index.search(queries, k, params=params)
+            found.append((distances, np.where(rows >= 0, rows + start, -1)))
+        if len(found) == 1:
+            return found[0]
+        distances = np.concatenate([part[0] for part in found], axis=1)
+        rows = np.concatenate([part[1] for part in found], axis=1)
+        # Smaller is better for L2, larger for inner products; padding (-1) goes last.
+        order_key = distances if self.metric == "l2" else -distances
+        order_key = np.where(rows >= 0, order_key, np.inf)
+        best = np.argsort(order_key, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, best, axis=1), np.take_along_axis(rows, best, axis=1)
+
+
+def info_path(index_path: str) -> str:
+    return index_path + ".meta.json"
+
+
+def save_index(index, index_path: str, info: Dict[str, Any]):
+    """Writes the index and its sidecar info file."""
+    faiss.write_index(index, index_path)
+    with open(info_path(index_path), 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+
+
+def load_index(index_path: str):
+    """Reads an index and its sidecar info; indexes without a sidecar are treated as flat L2."""
+    index = faiss.read_index(index_path)
+    info = dict(LEGACY_INDEX_INFO)
+    if os.path.exists(info_path(index_path)):
+        with open(info_path(index_path), 'r', encoding='utf-8') as f:
+            info.update(json.load(f))
+    return index, info
@@ -1,17 +1,48 @@
 # In backend/app/main.py
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from app.api import endpoints
+from app.core import config, tracing
+from app.core.image_io import MultipartBodyLimit
+from app.core.model_registry import model_registry
+import asyncio
 import os
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if config.MODEL_BACKEND == "remote":
+        from app.core.model_client import checked_address
+
+        # Refuse to start rather than fail on every request (raises ModelServerError).
+        for address in {config.CLIP_SERVER_ADDRESS, config.VLM_SERVER_ADDRESS}:
+            checked_address(address, config.MODEL_SERVER_AUTHKEY, config.MODEL_SERVER_ALLOW_REMOTE)
+    # Models load in the background so the server accepts connections (and
+    # answers /api/health) immediately; /api/ready reports when they are done.
+    warmup = None
+    if config.MODEL_WARMUP:
+        print(f"Warming up models in the background: {', '.join(config.MODEL_WARMUP)}")
+        warmup = asyncio.create_task(asyncio.to_thread(model_registry.warm_up, config.MODEL_WARMUP))
+    yield
+    if warmup is not None and not warmup.done():
+        print("Shutting down while models are still loading.")
+
+
 app = FastAPI(
     title="Multi-Agent Shopping Assistant API",
     description="An API for a team of AI agents that help you find the perfect product.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Oversized uploads are refused while they arrive, before Starlette spools them.
+# Added before CORSMiddleware, so CORS wraps it and its 413 responses reach the browser.
+app.add_middleware(MultipartBodyLimit, max_bytes=config.UPLOAD_MAX_BYTES + config.UPLOAD_FORM_OVERHEAD_BYTES)
+
 # Your CORS settings
 origins = ["*"]
 app.add_middleware(
@@ -22,9 +53,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-
 app.include_router(endpoints.router, prefix="/api")
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms and VLM token counters."""
+    return PlainTextResponse(tracing.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # This serves your frontend app. This part is correct and should come last.
 frontend_dir = os.path.join(os.path.dirname(__file__), "..", "..", "frontend", "build")
 if not os.path.exists(frontend_dir):
@@ -2,12 +2,16 @@
 // This is the main application component with the new UI and fixed logic.
 import React, { useState } from 'react';
 import Agent from './components/Agent'; // Correctly imports the separate Agent component
+import { applyContextEvent } from './contextStream';
+
+// 'snapshot' (every context event is whole) or 'delta' (patches); see backend/app/core/sse.py.
+const SSE_PROTOCOL = process.env.REACT_APP_SSE_PROTOCOL || 'snapshot';
 
 // Helper to initialize agent states
 const initialAgentState = {
   LeadAgent: { status: 'inactive', message: '' },
   ProductResearcher: { status: 'inactive', output: '' },
-  PriceQualityAgent: { status: 'inactive', output: '' },
+  PriceQuality: { status: 'inactive', output: '' },
   BudgetAdvisor: { status: 'inactive', output: '' },
 };
 
@@ -24,6 +28,8 @@ function App() {
   const [agentStates, setAgentStates] = useState(initialAgentState);
   const [finalRecommendation, setFinalRecommendation] = useState(null);
   const [errorMessage, setErrorMessage] = useState('');
+  // Position in the server's queue while the request waits to be admitted (0 = running).
+  const [queuePosition, setQueuePosition] = useState(0);
 
   const handleImageChange = (e) => {
     if (e.target.files && e.target.files[0]) {
@@ -43,6 +49,7 @@ function App() {
     setAgentStates(initialAgentState);
     setFinalRecommendation(null);
     setErrorMessage('');
+    setQueuePosition(0);
 
     const formData = new FormData();
     // === THIS IS THE FIX for the 422 Error ===
@@ -51,16 +58,28 @@ function App() {
     formData.append('budget', budget); // Use 'budget' to match the backend
     formData.append('image_file', imageFile); // Use 'image_file' to match the backend
 
-    fetch('/api/get-recommendation', {
+    // Browsers accept gzip and the server compresses the stream by default, which makes
+    // snapshots about as small as deltas. Builds against a server with SSE_COMPRESSION=none
+    // set REACT_APP_SSE_PROTOCOL=delta; either way contextStream.js rebuilds the context.
+    fetch(`/api/get-recommendation?protocol=${SSE_PROTOCOL}`, {
       method: 'POST',
       body: formData,
     })
     .then(response => {
+      if (response.status === 429 || response.status === 503) {
+        // The server is busy: it rejects right away and says when to come back.
+        const retryAfter = response.headers.get('Retry-After');
+        throw new Error(`The squad is busy right now. Please try again${retryAfter ? ` in ${retryAfter}s` : ' shortly'}.`);
+      }
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      // Events can be split across network chunks; keep the incomplete tail until the next read.
+      let buffer = '';
+      // The context as rebuilt from the snapshot and the patches received so far.
+      let context = null;
 
       function push() {
         reader.read().then(({ done, value }) => {
@@ -78,8 +97,10 @@ function App() {
             return;
           }
           
-          const chunk = decoder.decode(value, { stream: true });
-          const events = chunk.split('\n\n').filter(Boolean);
+          buffer += decoder.decode(value, { stream: true });
+          const parts = buffer.split('\n\n');
+          buffer = parts.pop();
+          const events = parts.filter(Boolean);
 
           events.forEach(eventString => {
             // Find the event type line and the data line
@@ -91,21 +112,49 @@ function App() {
                 const eventData = dataLine.substring(5).trim();
                 
                 try {
-                    const data = JSON.parse(eventData);
-                    
-                    if(eventType === 'context_update') {
+                    let data = JSON.parse(eventData);
+                    if (['context_update', 'final_recommendation', 'visual_summary'].includes(eventType)) {
+                        context = applyContextEvent(context, data);
+                        data = context;
+                    }
+
+                    if (eventType === 'queued') {
+                        setQueuePosition(data.position);
+                    } else if(eventType === 'context_update') {
+                        setQueuePosition(0);
                         // Update individual agent states based on context
                         Object.keys(data.agent_outputs).forEach(agentName => {
+                            const agentOutput = data.agent_outputs[agentName];
                             setAgentStates(prev => ({
                                 ...prev,
                                 [agentName]: {
-                                    status: 'thinking',
-                                    output: data.agent_outputs[agentName].message || JSON.stringify(data.agent_outputs[agentName].data)
+                                    status: agentOutput.message ? 'complete' : 'thinking',
+                                    // Keep text streamed so far while the agent is still working.
+                                    output: agentOutput.message || (prev[agentName] && prev[agentName].output) || ''
                                 }
                             }));
                         });
-                    } else if (eventType === 'final_recommendation') {
-                        setFinalRecommendation(data);
+                    } else if (eventType === 'partial') {
+                        // Newly generated text from an agent that is still working.
+                        setAgentStates(prev => ({
+                            ...prev,
+                            [data.agent]: {
+                                status: 'thinking',
+                                output: ((prev[data.agent] && prev[data.agent].output) || '') + data.delta
+                            }
+                        }));
+                    } else if (eventType === 'final_recommendation' || eventType === 'visual_summary') {
+                        // 'visual_summary' follows a recommendation that was sent before the image
+                        // analysis finished (latency budget); it carries the updated recommendation.
+                        const leadOutput = data.agent_outputs && data.agent_outputs.LeadAgent;
+                        setFinalRecommendation((leadOutput && leadOutput.data) || data);
+                        const researcher = data.agent_outputs && data.agent_outputs.ProductResearcher;
+                        if (eventType === 'visual_summary' && researcher) {
+                            setAgentStates(prev => ({
+                                ...prev,
+                                ProductResearcher: { status: 'complete', output: researcher.message }
+                            }));
+                        }
                     } else if (eventType === 'error') {
                         setErrorMessage(data.message || 'An unknown error occurred.');
                         setIsAnalyzing(false);
@@ -180,7 +229,7 @@ function App() {
                   {imagePreview && <img src={imagePreview} alt="Preview" className="mt-4 rounded-lg shadow-md w-full h-auto object-cover" />}
                 </div>
                 <button type="button" onClick={handleGetRecommendation} disabled={isAnalyzing} className="w-full flex justify-center py-3 px-4 border border-transparent rounded-md shadow-sm text-lg font-medium text-white bg-orange-600 hover:bg-orange-700 focus:outline-none focus:ring-2 focus:ring-offset-2 focus:ring-orange-500 disabled:bg-gray-400 disabled:cursor-not-allowed transition-colors">
-                  {isAnalyzing ? 'Analyzing...' : 'Assemble the Squad'}
+                  {isAnalyzing ? (queuePosition > 0 ? `Waiting in line (#${queuePosition})...` : 'Analyzing...') : 'Assemble the Squad'}
                 </button>
               </form>
             </div>
@@ -193,16 +242,21 @@ function App() {
               <div className="grid grid-cols-1 md:grid-cols-2 gap-6">
                 <Agent name="Lead Agent" status={isAnalyzing ? 'thinking' : 'inactive'} output={agentStates.LeadAgent.message} />
                 <Agent name="Product Researcher" status={agentStates.ProductResearcher.status} output={agentStates.ProductResearcher.output} />
-                <Agent name="Price-Quality Agent" status={agentStates.PriceQualityAgent.status} output={agentStates.PriceQualityAgent.output} />
+                <Agent name="Price-Quality Agent" status={agentStates.PriceQuality.status} output={agentStates.PriceQuality.output} />
                 <Agent name="Budget Advisor" status={agentStates.BudgetAdvisor.status} output={agentStates.BudgetAdvisor.output} />
               </div>
             </div>
 
-            {finalRecommendation && !isAnalyzing && (
+            {finalRecommendation && (!isAnalyzing || finalRecommendation.visual_summary_deferred) && (
               <div className="bg-white p-6 rounded-xl shadow-lg border border-gray-200 animate-fade-in">
                 <h2 className="text-2xl font-semibold text-[#0A2540] mb-4">Final Recommendation: <span className="text-orange-600">{finalRecommendation.title}</span></h2>
                 <div className="space-y-4 text-gray-700">
-                    <p><strong>Visual Summary:</strong> {finalRecommendation.visual_summary}</p>
+                    <p>
+                      <strong>Visual Summary:</strong> {finalRecommendation.visual_summary}
+                      {finalRecommendation.visual_summary_deferred && (
+                        <span className="block text-sm text-gray-500 mt-1">Based on similar products; the full image analysis will appear here when it is ready.</span>
+                      )}
+                    </p>
                     <p><strong>Value Assessment:</strong> {finalRecommendation.value_assessment}</p>
                     <p><strong>Budget Advice:</strong> {finalRecommendation.budget_advice}</p>
                 </div>
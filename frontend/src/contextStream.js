@@ -0,0 +1,38 @@
+// FILE: frontend/src/contextStream.js
+// Rebuilds the ProductContext from the recommendation stream's delta protocol
+// (/api/get-recommendation?protocol=delta, with REACT_APP_SSE_PROTOCOL=delta). The
+// first context event carries { snapshot: context }; every later one { patch: ops },
+// a JSON Patch against the context sent before it (see backend/app/core/sse.py).
+
+// Copies each object on the path it changes and shares everything else, so React
+// sees a new object wherever something changed.
+function setIn(node, keys, op) {
+  const [key, ...rest] = keys;
+  const copy = Array.isArray(node) ? [...node] : { ...node };
+  const index = Array.isArray(node) ? Number(key) : key;
+  if (rest.length) {
+    copy[index] = setIn(node[index], rest, op);
+  } else if (op.op === 'remove') {
+    if (Array.isArray(copy)) copy.splice(index, 1);
+    else delete copy[index];
+  } else {
+    copy[index] = op.value;
+  }
+  return copy;
+}
+
+export function applyPatch(document, ops) {
+  return ops.reduce((current, op) => {
+    if (op.path === '') return op.value;
+    const keys = op.path.split('/').slice(1).map(key => key.replace(/~1/g, '/').replace(/~0/g, '~'));
+    return setIn(current, keys, op);
+  }, document);
+}
+
+// The context after one context event (context_update, final_recommendation,
+// visual_summary). Events of the snapshot protocol are whole contexts already.
+export function applyContextEvent(context, data) {
+  if (data.snapshot) return data.snapshot;
+  if (data.patch) return applyPatch(context, data.patch);
+  return data;
+}
@@ -0,0 +1,135 @@
+# FILE: scripts/bench_hybrid_retrieval.py
+# Compares vector-only retrieval with hybrid (vector + BM25, reciprocal rank fusion)
+# retrieval, with and without the re-rank stage, on a synthetic catalog where products
+# of one category look alike (near-identical vectors) and differ by brand and model
+# name - the case the lexical search is for. Reports recall@1/@5 and per-query latency.
+# No models are needed.
+#
+#   python scripts/bench_hybrid_retrieval.py --products 20000
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config
+from app.core.catalog import load_version
+from app.core.lexical_index import LexicalIndex, lexical_path
+from app.core.metadata_store import write_metadata_store
+from app.core.vector_index import build_index, save_index
+from app.agents.review_analyzer_agent import ReviewAnalyzerAgent
+
+DIMENSION = 128
+BRANDS = ["Acme", "Zenith", "Nordic", "Orbit", "Vertex", "Lumen", "Pioneer", "Kestrel", "Halcyon", "Summit"]
+NOUNS = ["kettle", "headphones", "backpack", "desk lamp", "blender", "running shoes", "camera", "chair",
+         "watch", "speaker", "jacket", "toaster", "drill", "monitor", "tent", "keyboard"]
+FILLER = ("durable lightweight compact classic modern everyday portable premium quality design comfort "
+          "black white grey steel wood cotton fast easy clean quiet").split()
+
+
+def synthetic_catalog(count: int, per_category: int, rng: np.random.Generator):
+    """Products in categories of `per_category` look-alikes; returns records and embeddings."""
+    records, embeddings = [], []
+    categories = max(1, count // per_category)
+    for category in range(categories):
+        centre = rng.standard_normal(DIMENSION)
+        noun = NOUNS[category % len(NOUNS)]
+        for member in range(per_category):
+            brand = BRANDS[int(rng.integers(len(BRANDS)))]
+            model = f"{chr(65 + category % 26)}{chr(65 + member % 26)}{int(rng.integers(100, 999))}"
+            words = " ".join(FILLER[i] for i in rng.choice(len(FILLER), 8, replace=False))
+            records.append({
+                "product_id": f"P{len(records)}",
+                "product_title": f"{brand} {model} {noun}",
+                "product_description": f"A {words} {noun} by {brand}.",
+            })
+            embeddings.append(centre + 0.15 * rng.standard_normal(DIMENSION))
+    return records, np.asarray(embeddings, dtype="float32")
+
+
+def write_catalog(root: str, records, embeddings, kind: str):
+    index, info = build_index(embeddings, kind=kind, metric="cosine")
+    save_index(index, os.path.join(root, "product_reviews.index"), info)
+    store_path = os.path.join(root, "product_data.bin")
+    write_metadata_store(records, store_path)
+    started = time.perf_counter()
+    lexical = LexicalIndex.build(records)
+    build_s = time.perf_counter() - started
+    lexical.save(lexical_path(store_path))
+    return build_s, os.path.getsize(lexical_path(store_path))
+
+
+def evaluate(agent, catalog, queries, texts, targets, mode: str, top_k: int = 5):
+    """recall@1, recall@top_k and per-query latencies (ms) of one retrieval mode, one query at a time."""
+    config.HYBRID_RERANK = mode == "hybrid+rerank"
+    hits_at_1 = hits_at_k = 0
+    latencies = []
+    for query, text, target in zip(queries, texts, targets):
+        started = time.perf_counter()
+        result = agent._search_many(query[None, :], top_k, catalog=catalog, texts=None if mode == "vector" else [text])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        ids = [hit["product_id"] for hit in result["top_products"]]
+        hits_at_1 += ids[:1] == [target]
+        hits_at_k += target in ids
+    return hits_at_1 / len(targets), hits_at_k / len(targets), np.asarray(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hybrid against vector-only retrieval.")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--per-category", type=int, default=25, help="Look-alike products per category.")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--kind", default="flat", help="FAISS index kind.")
+    parser.add_argument("--query-noise", type=float, default=0.8,
+                        help="Noise added to a product's vector to make a query (look-alikes differ by 0.15).")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    records, embeddings = synthetic_catalog(args.products, args.per_category, rng)
+    # Queries are photos of a catalog product: its vector plus noise comparable to the spread
+    # between look-alikes, so the vector search finds the category but often not the model.
+    targets = rng.choice(len(records), args.queries, replace=False)
+    queries = embeddings[targets] + args.query_noise * rng.standard_normal((args.queries, DIMENSION)).astype("float32")
+    question = random.Random(0)
+    named = [f"Is the {records[t]['product_title'].rsplit(' ', 1)[0]} a good deal?" for t in targets]
+    # Brand and product type only: matches about a tenth of the look-alikes.
+    brand = [f"Is this {records[t]['product_title'].split(' ', 1)[0]} {records[t]['product_title'].split(' ', 2)[2]} any good?"
+             for t in targets]
+    # Words found all over the catalog, which must not pull in unrelated products.
+    vague = [question.choice(["Is this durable?", "Is it lightweight and portable?", "Is this a good deal?"]) for _ in targets]
+    target_ids = [records[t]["product_id"] for t in targets]
+
+    with tempfile.TemporaryDirectory() as root:
+        build_s, lexical_bytes = write_catalog(root, records, embeddings, args.kind)
+        print(f"{len(records)} products: BM25 index built in {build_s:.2f}s, {lexical_bytes / 1e6:.1f} MB on disk")
+        agent = ReviewAnalyzerAgent(rag_data_path=root)
+        catalog = load_version(root)
+        catalog.lexical  # loaded up front, as the first hybrid search would
+
+        print(f"{'mode':<15} {'query text':<12} {'recall@1':>9} {'recall@5':>9} {'p50 ms':>8} {'p99 ms':>8}")
+        results = {}
+        for label, texts in (("names model", named), ("names brand", brand), ("vague", vague)):
+            for mode in ("vector", "hybrid", "hybrid+rerank"):
+                if mode == "vector" and label != "names model":
+                    continue
+                evaluate(agent, catalog, queries[:20], texts[:20], target_ids[:20], mode)  # warm-up
+                recall_1, recall_5, latencies = evaluate(agent, catalog, queries, texts, target_ids, mode)
+                results[(mode, label)] = (recall_1, recall_5, np.percentile(latencies, 50))
+                print(f"{mode:<15} {label:<12} {recall_1:9.3f} {recall_5:9.3f} "
+                      f"{np.percentile(latencies, 50):8.2f} {np.percentile(latencies, 99):8.2f}")
+
+    vector_1, vector_5, vector_ms = results[("vector", "names model")]
+    for mode in ("hybrid", "hybrid+rerank"):
+        recall_1, recall_5, p50 = results[(mode, "names model")]
+        assert recall_5 >= vector_5 and recall_1 > vector_1, (mode, results)
+        assert p50 - vector_ms < 10, f"{mode} adds {p50 - vector_ms:.1f} ms per query"
+        # Without a product name in the question, hybrid retrieval must not hurt.
+        assert results[(mode, "vague")][1] >= vector_5 - 0.02, (mode, results)
+        assert results[(mode, "names brand")][1] >= vector_5, (mode, results)
+    print("OK: hybrid retrieval finds named products more often, within single-digit ms of vector-only search.")
@@ -0,0 +1,111 @@
+# FILE: scripts/bench_image_decode.py
+# Compares the old upload handling (full-resolution decode, which CLIP then
+# resizes) with app.core.image_io.decode_for_models (one reduced
+# JPEG decode that yields both the VLM and the CLIP input) on synthetic photos
+# of typical phone and web sizes.
+#
+#   python scripts/bench_image_decode.py --repeats 20 --json bench_decode.json
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config
+from app.core.image_io import decode_for_models
+
+SIZES = {
+    "web 800x600": (800, 600),
+    "2MP 1920x1080": (1920, 1080),
+    "8MP 3264x2448": (3264, 2448),
+    "12MP 4032x3024": (4032, 3024),
+    "48MP 8000x6000": (8000, 6000),
+}
+
+
+def synthetic_photo(size, quality: int = 90, seed: int = 0) -> bytes:
+    """A smooth gradient plus noise, so the JPEG has realistic size and decode cost."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                     np.broadcast_to((x + y) / 2, (height, width))], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels, "RGB").save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def clip_resize(image: Image.Image) -> Image.Image:
+    """The resize CLIP's preprocessing applies (shorter side to 224, bicubic), paid on either path."""
+    scale = 224 / min(image.size)
+    return image.resize((round(image.width * scale), round(image.height * scale)), Image.Resampling.BICUBIC)
+
+
+def baseline(data: bytes):
+    """What the endpoint used to do: decode everything at full resolution; CLIP then resizes that."""
+    image = Image.open(BytesIO(data)).convert("RGB")
+    clip_resize(image)
+    return image
+
+
+def optimized(data: bytes):
+    decoded = decode_for_models(data, config.VLM_IMAGE_MAX_SIDE, config.CLIP_IMAGE_SIZE, config.UPLOAD_MAX_PIXELS)
+    clip_resize(decoded.clip)
+    return decoded
+
+
+def time_ms(func, data: bytes, repeats: int):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = func(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark upload image decoding.")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    # Pillow refuses images above its decompression-bomb threshold by default.
+    Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS or 0, config.UPLOAD_MAX_PIXELS)
+
+    rows = []
+    print(f"{'image':<16} {'bytes':>9} {'full ms':>9} {'full MB':>8} {'new ms':>8} {'new MB':>7} "
+          f"{'vlm':>10} {'clip':>9} {'speedup':>8}")
+    for label, size in SIZES.items():
+        data = synthetic_photo(size)
+        full_ms, full = time_ms(baseline, data, args.repeats)
+        new_ms, decoded = time_ms(optimized, data, args.repeats)
+        # Decoded RGB buffers held per request (Pillow allocates these outside the Python heap).
+        full_mb = full.width * full.height * 3 / 1e6
+        new_mb = (decoded.vlm.width * decoded.vlm.height + decoded.clip.width * decoded.clip.height) * 3 / 1e6
+        row = {
+            "image": label, "bytes": len(data),
+            "baseline_ms": round(full_ms, 2), "baseline_decoded_mb": round(full_mb, 2),
+            "decode_ms": round(new_ms, 2), "decoded_mb": round(new_mb, 2),
+            "vlm_size": list(decoded.vlm.size), "clip_size": list(decoded.clip.size),
+            "speedup": round(full_ms / new_ms, 2),
+        }
+        rows.append(row)
+        print(f"{label:<16} {len(data):>9} {full_ms:>9.1f} {full_mb:>8.1f} {new_ms:>8.1f} {new_mb:>7.1f} "
+              f"{'x'.join(map(str, decoded.vlm.size)):>10} {'x'.join(map(str, decoded.clip.size)):>9} "
+              f"{row['speedup']:>7.1f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"vlm_image_max_side": config.VLM_IMAGE_MAX_SIDE, "clip_image_size": config.CLIP_IMAGE_SIZE,
+                       "repeats": args.repeats, "results": rows}, f, indent=2)
+        print(f"Wrote {args.json}")
@@ -0,0 +1,429 @@
+# FILE: scripts/bench_pipeline.py
+# Offline benchmark of the full /api/get-recommendation pipeline. CLIP and Qwen2.5-VL are
+# replaced through the model registry by deterministic stubs with configurable costs, and
+# the catalog is a synthetic FAISS index of configurable size, so it runs without a GPU,
+# network or model downloads (e.g. in CI). Everything else - admission, the agent
+# scheduler, VLM micro-batching and token streaming, retrieval, SSE - is the real code.
+#
+# For each number of concurrent clients it reports SSE time-to-first-event, time to the
+# first streamed token and time-to-complete, throughput, per-stage latencies (from the
+# tracing timings of each request) and the process's memory high-water mark, and writes
+# everything to JSON. With --baseline, it compares against an earlier run's JSON and
+# fails if throughput or latency regressed by more than --max-regression.
+#
+#   python scripts/bench_pipeline.py --products 50000 --clients 1 4 16
+#   python scripts/bench_pipeline.py --baseline bench_output/bench_pipeline.json --json bench_output/new.json
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import httpx
+import numpy as np
+from PIL import Image
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config, sse
+from app.core.lexical_index import LexicalIndex, lexical_path
+from app.core.metadata_store import write_metadata_store
+from app.core.model_registry import model_registry
+from app.core.vector_index import COMPRESSED_KINDS, build_index, prepare_vectors, save_index, save_vectors, vectors_path
+from app.agents.review_analyzer_agent import ReviewAnalyzerAgent
+from app.main import app
+import app.api.endpoints as endpoints
+
+NOUNS = ["kettle", "headphones", "backpack", "desk lamp", "blender", "running shoes", "camera", "chair", "watch", "jacket"]
+WORDS = ("durable lightweight compact classic modern everyday portable premium quality design comfort black white "
+         "steel wood cotton fast easy clean quiet great value excellent cheap").split()
+
+
+def seeded_rng(data: bytes) -> np.random.Generator:
+    return np.random.default_rng(int(hashlib.sha1(data).hexdigest()[:8], 16))
+
+
+# --- Stub models ---
+
+class StubCLIP:
+    """Deterministic CLIP stand-in: a pseudo-random vector per distinct input, `ms_per_item` each."""
+    def __init__(self, dimension: int, ms_per_item: float):
+        self.dimension = dimension
+        self.ms_per_item = ms_per_item
+
+    def encode(self, inputs, **kwargs):
+        time.sleep(self.ms_per_item * len(inputs) / 1000)
+        return np.asarray([
+            seeded_rng(item.tobytes() if isinstance(item, Image.Image) else item.encode()).standard_normal(self.dimension)
+            for item in inputs
+        ], dtype='float32')
+
+
+class StubTensor(np.ndarray):
+    """A numpy array answering the torch-style calls ProductResearchAgent makes on its tensors."""
+    def sum(self, axis=None, dim=None, **kwargs):
+        return super().sum(axis=dim if dim is not None else axis, **kwargs)
+
+
+class StubBatch(dict):
+    def to(self, device):
+        return self
+
+
+class StubTokenizer:
+    """Token i is the word VOCABULARY[i]; 0 is padding."""
+    VOCABULARY = ["<pad>"] + WORDS + NOUNS + ["the", "a", "with", "and", "of", "is", "it", "for"]
+    pad_token_id = 0
+    padding_side = "left"
+
+    def token_ids(self, text: str):
+        return [1 + int(hashlib.sha1(word.encode()).hexdigest()[:6], 16) % (len(self.VOCABULARY) - 1) for word in text.split()]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return " ".join(self.VOCABULARY[i] for i in ids if i != self.pad_token_id)
+
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return [self.decode(row.tolist()) for row in rows]
+
+
+class StubProcessor:
+    """Qwen2.5-VL processor stand-in: each image costs `image_tokens` prompt tokens."""
+    def __init__(self, image_tokens: int = 256):
+        self.tokenizer = StubTokenizer()
+        self.image_tokens = image_tokens
+
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return self.tokenizer.batch_decode(rows, skip_special_tokens=skip_special_tokens)
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        return " ".join(part.get("text", "") for message in messages for part in message["content"])
+
+    def __call__(self, text_prompts, images=None, padding=True, return_tensors="pt"):
+        rows = []
+        for prompt, image in zip(text_prompts, images):
+            # The image's pixels decide its tokens, so different images get different answers.
+            rows.append(list(seeded_rng(image.tobytes()).integers(1, len(self.tokenizer.VOCABULARY), self.image_tokens))
+                        + self.tokenizer.token_ids(prompt))
+        width = max(len(row) for row in rows)
+        input_ids = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            input_ids[i, width - len(row):] = row  # left padding
+        return StubBatch(input_ids=input_ids.view(StubTensor), attention_mask=(input_ids != 0).astype(np.int64).view(StubTensor))
+
+
+class StubVLM:
+    """
+    Qwen2.5-VL stand-in with the cost shape of batched generation: prefill costs
+    `prefill_ms` per request in the batch, each decode step `token_ms` for the whole batch.
+    Streams through the agent's streamer exactly like transformers' `generate`.
+    """
+    def __init__(self, prefill_ms: float, token_ms: float, tokens: int):
+        self.prefill_ms = prefill_ms
+        self.token_ms = token_ms
+        self.tokens = tokens
+
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=1024, do_sample=False, streamer=None):
+        batch = len(input_ids)
+        if streamer is not None:
+            streamer.put(input_ids)
+        time.sleep(self.prefill_ms * batch / 1000)
+        answers = np.zeros((batch, min(self.tokens, max_new_tokens)), dtype=np.int64)
+        for i, row in enumerate(input_ids):
+            length = int(seeded_rng(row.tobytes()).integers(len(answers[i]) // 2, len(answers[i]) + 1))
+            answers[i, :length] = seeded_rng(row.tobytes()[::-1]).integers(1, len(StubTokenizer.VOCABULARY), length)
+        for step in range(answers.shape[1]):
+            time.sleep(self.token_ms / 1000)
+            if streamer is not None:
+                streamer.put(answers[:, step])
+        if streamer is not None:
+            streamer.end()
+        return np.concatenate([np.asarray(input_ids), answers], axis=1).view(StubTensor)
+
+
+# --- Synthetic catalog ---
+
+def write_catalog(root: str, products: int, dimension: int, kind: str, seed: int = 0):
+    """A catalog of `products` clustered vectors with titles, descriptions and prices, as ingest writes it."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, products // 50), dimension)).astype('float32')
+    cluster = rng.integers(0, len(centers), products)
+    embeddings = centers[cluster] + 0.35 * rng.standard_normal((products, dimension)).astype('float32')
+    records = []
+    for i in range(products):
+        noun = NOUNS[cluster[i] % len(NOUNS)]
+        words = " ".join(WORDS[j] for j in rng.choice(len(WORDS), 10, replace=False))
+        records.append({"product_id": f"P{i}", "product_title": f"Model {i:06d} {noun}",
+                        "product_description": f"A {words} {noun}.", "image_url": "",
+                        "price": round(float(rng.uniform(5, 300)), 2)})
+    index, info = build_index(embeddings, kind=kind, metric="cosine")
+    save_index(index, os.path.join(root, "product_reviews.index"), info)
+    store_path = os.path.join(root, "product_data.bin")
+    write_metadata_store(records, store_path)
+    LexicalIndex.build(records).save(lexical_path(store_path))
+    if kind in COMPRESSED_KINDS:
+        save_vectors(prepare_vectors(embeddings, "cosine"), vectors_path(store_path))
+
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    """The process's memory high-water mark so far (None where the platform does not report it)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    return {"p50": round(float(np.percentile(values, 50)), 2), "p95": round(float(np.percentile(values, 95)), 2),
+            "max": round(float(max(values)), 2)}
+
+
+def upload(i: int) -> bytes:
+    """A distinct JPEG per request, so neither the review cache nor request coalescing short-circuits it."""
+    image = Image.new("RGB", (320, 240), (i % 251, (i * 7) % 253, (i * 13) % 241))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+async def one_request(i: int, client_id: str, protocol: str = "snapshot", compression: str = "none"):
+    """
+    Sends one request straight to the ASGI app (httpx's ASGITransport only returns the body
+    once it is complete) and returns when each kind of event was first seen, in ms, the
+    bytes received and the final context, rebuilt from the events as a client would.
+    """
+    request = httpx.Request(
+        "POST", "http://bench/api/get-recommendation",
+        params={"protocol": protocol},
+        data={"query": f"Is the model {i:06d} worth it?", "price": "60", "budget": "100"},
+        files={"image_file": ("p.jpg", upload(i), "image/jpeg")},
+        headers={"X-Client-Id": client_id, "Accept-Encoding": "gzip" if compression == "gzip" else "identity"},
+    )
+    body = request.read()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": request.url.path, "raw_path": request.url.raw_path, "query_string": request.url.query,
+        "root_path": "", "headers": [(k.lower(), v) for k, v in request.headers.raw],
+        "client": ("127.0.0.1", 5000), "server": ("bench", 80),
+    }
+    started = time.perf_counter()
+    result = {"status": None, "first_event_ms": None, "first_token_ms": None, "complete_ms": None,
+              "bytes": 0, "timings": {}, "context": None}
+    text, sent_body, decompressor = "", False, None
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal text, decompressor
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+            if (b"content-encoding", b"gzip") in [(k.lower(), v) for k, v in message.get("headers", [])]:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            return
+        chunk = message.get("body", b"")
+        result["bytes"] += len(chunk)
+        text += (decompressor.decompress(chunk) if decompressor else chunk).decode()
+        while "\n\n" in text:
+            block, text = text.split("\n\n", 1)
+            lines = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+            event = lines.get("event")
+            if result["first_event_ms"] is None:
+                result["first_event_ms"] = elapsed_ms
+            if event in ("context_update", "final_recommendation", "visual_summary"):
+                data = json.loads(lines["data"])
+                if "snapshot" in data:
+                    result["context"] = data["snapshot"]
+                elif "patch" in data:
+                    result["context"] = sse.apply_patch(result["context"], data["patch"])
+                else:
+                    result["context"] = data
+            if event == "partial" and result["first_token_ms"] is None:
+                result["first_token_ms"] = elapsed_ms
+            elif event == "final_recommendation":
+                result["complete_ms"] = elapsed_ms
+                result["timings"] = result["context"].get("timings", {})
+            elif event == "error":
+                result["status"] = "error"
+
+    await app(scope, receive, send)
+    return result
+
+
+async def run_clients(clients: int, requests_per_client: int, first_request: int, **stream_options):
+    """`clients` closed-loop clients, each sending its requests one after the other."""
+    async def client(c: int):
+        return [await one_request(first_request + c * requests_per_client + r, f"bench-{c}", **stream_options)
+                for r in range(requests_per_client)]
+
+    started = time.perf_counter()
+    per_client = await asyncio.gather(*(client(c) for c in range(clients)))
+    return [result for results in per_client for result in results], time.perf_counter() - started
+
+
+def summarize(clients: int, results, wall_s: float):
+    completed = [r for r in results if r["complete_ms"] is not None]
+    stages = {}
+    for r in completed:
+        for stage, timing in r["timings"].items():
+            stages.setdefault(stage, []).append(timing["ms"])
+    return {
+        "clients": clients,
+        "requests": len(results),
+        "completed": len(completed),
+        "throughput_rps": round(len(completed) / wall_s, 3),
+        "first_event_ms": percentiles([r["first_event_ms"] for r in results if r["first_event_ms"] is not None]),
+        "first_token_ms": percentiles([r["first_token_ms"] for r in completed if r["first_token_ms"] is not None]),
+        "complete_ms": percentiles([r["complete_ms"] for r in completed]),
+        "response_bytes": percentiles([r["bytes"] for r in completed]),
+        "stage_ms": {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, max_regression: float):
+    """Prints the change against `baseline` per client count; returns the regressions beyond `max_regression`."""
+    regressions = []
+    previous = {run["clients"]: run for run in baseline["runs"]}
+    print(f"\nAgainst baseline {baseline.get('commit') or '?'}:")
+    for run in report["runs"]:
+        old = previous.get(run["clients"])
+        if old is None:
+            continue
+        for label, new_value, old_value, higher_is_better in (
+            ("throughput", run["throughput_rps"], old["throughput_rps"], True),
+            ("first event p50", run["first_event_ms"]["p50"], old["first_event_ms"]["p50"], False),
+            ("complete p50", run["complete_ms"]["p50"], old["complete_ms"]["p50"], False),
+            ("complete p95", run["complete_ms"]["p95"], old["complete_ms"]["p95"], False),
+        ):
+            if not old_value or new_value is None:
+                continue
+            change = new_value / old_value - 1
+            worse = -change if higher_is_better else change
+            flag = "  REGRESSION" if worse > max_regression else ""
+            print(f"  {run['clients']:>3} clients  {label:<16} {old_value:>10.2f} -> {new_value:>10.2f} ({change:+.1%}){flag}")
+            if flag:
+                regressions.append((run["clients"], label, change))
+    return regressions
+
+
+async def main(args):
+    runs, next_request = [], 0
+    # One request first, so lazy loading (index, stub models, batching worker) is not measured.
+    await one_request(10**6, "warm-up")
+    for clients in args.clients:
+        with contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext():
+            results, wall_s = await run_clients(clients, args.requests_per_client, next_request,
+                                                protocol=args.protocol, compression=args.compression)
+        next_request += clients * args.requests_per_client
+        run = summarize(clients, results, wall_s)
+        runs.append(run)
+        stage_p50 = {stage: run["stage_ms"][stage]["p50"] for stage in
+                     ("agent.ReviewAnalyzer", "agent.ProductResearcher", "agent.PriceQuality", "agent.BudgetAdvisor")
+                     if stage in run["stage_ms"]}
+        print(f"{clients:>3} clients: {run['completed']}/{run['requests']} complete, {run['throughput_rps']:6.2f} req/s | "
+              f"first event p50 {run['first_event_ms']['p50']} ms, first token p50 {run['first_token_ms']['p50']} ms, "
+              f"complete p50 {run['complete_ms']['p50']} / p95 {run['complete_ms']['p95']} ms | "
+              f"peak RSS {run['peak_rss_mb']} MB")
+        print("             agent p50 ms: " + ", ".join(f"{stage[6:]} {ms}" for stage, ms in stage_p50.items()))
+    return runs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the full agent pipeline offline, with stub models.")
+    parser.add_argument("--products", type=int, default=20000, help="Size of the synthetic catalog.")
+    parser.add_argument("--dimension", type=int, default=512, help="512 matches clip-ViT-B-32.")
+    parser.add_argument("--index-kind", default="flat")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients, one run each.")
+    parser.add_argument("--requests-per-client", type=int, default=6)
+    parser.add_argument("--clip-ms", type=float, default=8, help="Stub CLIP time per encoded input.")
+    parser.add_argument("--vlm-prefill-ms", type=float, default=60, help="Stub VLM prefill time per request in a batch.")
+    parser.add_argument("--vlm-token-ms", type=float, default=20, help="Stub VLM time per decode step of a batch.")
+    parser.add_argument("--vlm-tokens", type=int, default=24, help="Most tokens the stub VLM generates per answer.")
+    parser.add_argument("--json", dest="json_path", default=os.path.join("bench_output", "bench_pipeline.json"),
+                        help="Where to write the results (bench_output/ is git-ignored).")
+    parser.add_argument("--baseline", default=None, help="An earlier run's JSON to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Relative change in throughput or latency counted as a regression with --baseline.")
+    parser.add_argument("--protocol", choices=sse.PROTOCOLS, default="delta", help="SSE protocol, as the frontend uses it.")
+    parser.add_argument("--compression", choices=["none", "gzip"], default="gzip", help="Accept-Encoding sent by the clients.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the agents' log output during the runs.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    config.ADMISSION_CLIENT_HEADER = "X-Client-Id"
+    config.REVIEW_CACHE_DISK_PATH = ""
+    config.TRACING_ENABLED = True
+    model_registry.override("clip", StubCLIP(args.dimension, args.clip_ms))
+    model_registry.override("qwen_vl", (StubVLM(args.vlm_prefill_ms, args.vlm_token_ms, args.vlm_tokens), StubProcessor()))
+
+    with tempfile.TemporaryDirectory() as root:
+        started = time.perf_counter()
+        write_catalog(root, args.products, args.dimension, args.index_kind)
+        build_s = time.perf_counter() - started
+        model_registry.unload("product_index")
+        endpoints.lead_agent.review_agent = ReviewAnalyzerAgent(rag_data_path=root)
+        print(f"Synthetic catalog: {args.products} x {args.dimension} {args.index_kind} index built in {build_s:.1f}s; "
+              f"peak RSS {peak_rss_mb()} MB")
+        runs = asyncio.run(main(args))
+
+    report = {
+        "commit": git_commit(),
+        "created_at": time.time(),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ("json_path", "baseline", "verbose")},
+        "catalog_build_s": round(build_s, 3),
+        "runs": runs,
+    }
+    if args.json_path:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json_path)), exist_ok=True)
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json_path}")
+
+    for run in runs:
+        assert run["completed"] == run["requests"], run
+        assert run["first_event_ms"]["p50"] < run["complete_ms"]["p50"], run
+        assert run["first_token_ms"]["p50"] is not None, "the stub VLM's tokens must be streamed"
+    if len(runs) > 1 and runs[-1]["clients"] >= config.VLM_MAX_BATCH_SIZE > 1:
+        # Concurrent requests share VLM batches, so more clients must mean more throughput.
+        assert runs[-1]["throughput_rps"] > runs[0]["throughput_rps"], runs
+    if baseline is not None:
+        regressions = compare(report, baseline, args.max_regression)
+        assert not regressions, f"{len(regressions)} regression(s) beyond {args.max_regression:.0%}"
+    print("OK: pipeline benchmark completed.")
@@ -0,0 +1,145 @@
+# FILE: scripts/bench_sse_protocol.py
+# Compares the snapshot and delta SSE protocols of /api/get-recommendation, each with and
+# without gzip: bytes on the wire and the CPU spent formatting (and compressing) a stream.
+# Checks that a client rebuilding the context from the delta events (as
+# frontend/src/contextStream.js does) ends with the same context as a snapshot client,
+# that deltas are smaller without compression, and reports how they compare under gzip.
+# Models are replaced by the stubs of bench_pipeline.py.
+#
+#   python scripts/bench_sse_protocol.py --vlm-tokens 100 1000
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config, sse
+from app.core.context import ProductContext
+from app.core.image_io import decode_for_models
+from app.core.model_registry import model_registry
+from app.agents.review_analyzer_agent import ReviewAnalyzerAgent
+import app.api.endpoints as endpoints
+from bench_pipeline import StubCLIP, StubProcessor, StubVLM, one_request, upload, write_catalog
+
+PROTOCOLS = [(protocol, compression) for protocol in sse.PROTOCOLS for compression in ("none", "gzip")]
+
+
+class ReplayLeadAgent:
+    """Replays recorded LeadAgent events instantly, so only the stream formatting is timed."""
+    def __init__(self, events):
+        self.events = events
+
+    async def run_analysis_events(self, *args, **kwargs):
+        for event in self.events:
+            yield event
+
+
+async def record_events(i: int):
+    """The LeadAgent events of one real (stubbed) analysis."""
+    decoded = decode_for_models(upload(i), config.VLM_IMAGE_MAX_SIDE, config.CLIP_IMAGE_SIZE, config.UPLOAD_MAX_PIXELS)
+    return [event async for event in endpoints.lead_agent.run_analysis_events(
+        f"Is the model {i:06d} worth it?", decoded.vlm, 60.0, 100.0, clip_image=decoded.clip)]
+
+
+async def format_stream(events, protocol: str, compression: str, i: int):
+    """Streams recorded `events` through the endpoint's pipeline; returns (wire bytes, CPU seconds)."""
+    context = ProductContext(session_id=f"replay-{i}", user_query="replay", user_budget=100.0)
+    context.identified_product.identified_price = 60.0
+    image = types.SimpleNamespace(vlm=None, clip=None)  # the replayed agents never look at it
+    messages = endpoints.research_pipeline_stream_mcp(context, image, ("replay", protocol, compression, i), protocol=protocol)
+    if compression == "gzip":
+        messages = sse.gzip_stream(messages, config.SSE_COMPRESSION_LEVEL)
+    started = time.process_time()
+    size = 0
+    async for message in messages:
+        size += len(message) if isinstance(message, bytes) else len(message.encode("utf-8"))
+    return size, time.process_time() - started
+
+
+def comparable(context):
+    """The context without what legitimately differs between two runs of the same request."""
+    return {key: value for key, value in context.items() if key not in ("session_id", "timings")}
+
+
+async def main(args):
+    results = []
+    for tokens in args.vlm_tokens:
+        model_registry.override("qwen_vl", (StubVLM(0, 0.2, tokens), StubProcessor()))
+        endpoints.product_agent.model = None  # pick up the new stub
+
+        # 1. End to end: the same requests with each protocol; every client must end with the same context.
+        final_contexts, wire = {}, {}
+        for protocol, compression in PROTOCOLS:
+            with contextlib.redirect_stdout(io.StringIO()):
+                runs = [await one_request(tokens * 1000 + i, "sse", protocol=protocol, compression=compression)
+                        for i in range(args.requests)]
+            assert all(run["complete_ms"] is not None for run in runs), runs
+            final_contexts[(protocol, compression)] = [comparable(run["context"]) for run in runs]
+            wire[(protocol, compression)] = sum(run["bytes"] for run in runs) / len(runs)
+        reference = final_contexts[("snapshot", "none")]
+        for key, contexts in final_contexts.items():
+            assert contexts == reference, f"{key}: rebuilt context differs from the snapshot protocol's"
+
+        # 2. Formatting CPU: recorded events replayed through the endpoint's stream, without the agents.
+        with contextlib.redirect_stdout(io.StringIO()):
+            events = await record_events(tokens * 1000)
+        lead_agent, endpoints.lead_agent = endpoints.lead_agent, ReplayLeadAgent(events)
+        try:
+            for protocol, compression in PROTOCOLS:
+                sizes, seconds = zip(*[await format_stream(events, protocol, compression, i) for i in range(args.replays)])
+                results.append({
+                    "vlm_tokens": tokens, "protocol": protocol, "compression": compression,
+                    "events": len(events), "wire_bytes": round(wire[(protocol, compression)]),
+                    "replay_bytes": sizes[0], "cpu_us_per_stream": sum(seconds) / len(seconds) * 1e6,
+                })
+        finally:
+            endpoints.lead_agent = lead_agent
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the snapshot and delta SSE protocols.")
+    parser.add_argument("--vlm-tokens", type=int, nargs="+", default=[100, 1000],
+                        help="Length of the stub VLM's answers, one comparison each.")
+    parser.add_argument("--requests", type=int, default=3, help="End-to-end requests per protocol.")
+    parser.add_argument("--replays", type=int, default=200, help="Replays per protocol for the CPU measurement.")
+    parser.add_argument("--products", type=int, default=5000)
+    args = parser.parse_args()
+
+    config.REVIEW_CACHE_DISK_PATH = ""
+    config.TRACING_ENABLED = True
+    endpoints.analysis_flights.result_ttl_s = 0
+    model_registry.override("clip", StubCLIP(512, 0))
+    with tempfile.TemporaryDirectory() as root:
+        write_catalog(root, args.products, 512, "flat")
+        model_registry.unload("product_index")
+        endpoints.lead_agent.review_agent = ReviewAnalyzerAgent(rag_data_path=root)
+        results = asyncio.run(main(args))
+
+    print(f"{'VLM tokens':>10} {'protocol':<9} {'gzip':<5} {'events':>6} {'bytes/request':>14} {'CPU us/stream':>14}")
+    by_key = {}
+    for row in results:
+        by_key[(row["vlm_tokens"], row["protocol"], row["compression"])] = row
+        print(f"{row['vlm_tokens']:>10} {row['protocol']:<9} {row['compression']:<5} {row['events']:>6} "
+              f"{row['wire_bytes']:>14} {row['cpu_us_per_stream']:>14.0f}")
+
+    for tokens in args.vlm_tokens:
+        snapshot, delta = by_key[(tokens, "snapshot", "none")], by_key[(tokens, "delta", "none")]
+        snapshot_gzip, delta_gzip = by_key[(tokens, "snapshot", "gzip")], by_key[(tokens, "delta", "gzip")]
+        assert delta["wire_bytes"] < snapshot["wire_bytes"], (snapshot, delta)
+        assert snapshot_gzip["wire_bytes"] < delta["wire_bytes"], "gzip should beat deltas on their own"
+        # gzip already removes the snapshots' repetition: deltas then save little or nothing.
+        assert abs(delta_gzip["wire_bytes"] - snapshot_gzip["wire_bytes"]) < 0.1 * snapshot_gzip["wire_bytes"], \
+            (snapshot_gzip, delta_gzip)
+        print(f"{tokens} VLM tokens, without compression: delta is "
+              f"{1 - delta['wire_bytes'] / snapshot['wire_bytes']:.0%} smaller; with gzip: delta is "
+              f"{delta_gzip['wire_bytes'] / snapshot_gzip['wire_bytes'] - 1:+.1%} in bytes and "
+              f"{delta_gzip['cpu_us_per_stream'] / snapshot_gzip['cpu_us_per_stream'] - 1:+.0%} in CPU vs snapshot")
+    print("OK: delta streams rebuild the same context; they are smaller only without compression.")
@@ -0,0 +1,78 @@
+# FILE: scripts/bench_startup.py
+# Measures how long it takes to import the API (what every worker, test and CLI
+# pays up front) and, optionally, how long each registered model takes to load.
+#
+#   python scripts/bench_startup.py            # import time only
+#   python scripts/bench_startup.py --load     # plus per-model load time (needs the real models)
+
+import argparse
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+
+def time_import(module: str, repeats: int):
+    """Wall time of `import module` in a fresh interpreter, `repeats` times."""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=BACKEND_DIR, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def slowest_packages(module: str, top: int):
+    """
+    Import time attributed to each top-level package (fastapi, faiss, numpy, ...),
+    summed from the per-module self times reported by `python -X importtime`.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=BACKEND_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    totals = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(self_us)
+    return sorted(((us, package) for package, us in totals.items()), reverse=True)[:top]
+
+
+def time_model_loads():
+    sys.path.insert(0, BACKEND_DIR)
+    # Importing the agents registers their loaders without loading anything.
+    importlib.import_module("app.agents.lead_agent")
+    from app.core.model_registry import model_registry
+
+    for name in model_registry.status():
+        started = time.perf_counter()
+        model_registry.get(name)
+        state = model_registry.status()[name]["state"]
+        print(f"  {name:<15} {state:<8} {time.perf_counter() - started:8.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure API import time and model load time.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Show the N packages that take longest to import.")
+    parser.add_argument("--load", action="store_true", help="Also load every registered model and time it.")
+    args = parser.parse_args()
+
+    timings = time_import(args.module, args.repeats)
+    print(f"import {args.module}: median {statistics.median(timings):.2f}s, "
+          f"min {min(timings):.2f}s, max {max(timings):.2f}s over {args.repeats} runs")
+
+    print("Import time by package:")
+    for self_us, package in slowest_packages(args.module, args.top):
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+    if args.load:
+        print("Model load times:")
+        time_model_loads()
@@ -0,0 +1,134 @@
+# FILE: scripts/bench_value_scoring.py
+# Checks the compiled lexicon scorer against a phrase-by-phrase reference, checks price
+# normalization against similar products, and times batch scoring against the previous
+# per-request keyword checks. No models are needed.
+#
+#   python scripts/bench_value_scoring.py --products 20000
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.agents.price_quality_agent import PriceQualityAgent
+
+FILLER = ("the this kettle bag chair works fine arrived on time colour size product professionally "
+          "surplus metallic goods lovely not really as described would buy again").split()
+
+
+def random_text(rng: random.Random, phrases, words: int = 60) -> str:
+    tokens = [rng.choice(FILLER) for _ in range(words)]
+    for _ in range(rng.randint(0, 4)):
+        phrase = rng.choice(phrases)
+        tokens.insert(rng.randrange(len(tokens) + 1), phrase.upper() if rng.random() < 0.2 else phrase)
+    return " ".join(tokens)
+
+
+def reference_scores(lexicons, texts):
+    """One regex per phrase; overlapping matches are resolved longest-first, as in LexiconScorer."""
+    signals = list(lexicons)
+    phrases = sorted(((p, signals.index(s), w) for s in signals for p, w in lexicons[s].items()),
+                     key=lambda item: len(item[0]), reverse=True)
+    scores = np.zeros((len(texts), len(signals)))
+    for row, text in enumerate(texts):
+        taken = np.zeros(len(text), dtype=bool)
+        found = []
+        for phrase, column, weight in phrases:
+            pattern = re.compile(r"(?<!\w)" + r"\s+".join(map(re.escape, phrase.split())) + r"(?!\w)", re.IGNORECASE)
+            for match in pattern.finditer(text):
+                found.append((match.start(), match.end(), column, weight))
+        # Leftmost match first, longest first at the same position, skipping overlaps.
+        for start, end, column, weight in sorted(found, key=lambda item: (item[0], -(item[1] - item[0]))):
+            if not taken[start:end].any():
+                taken[start:end] = True
+                scores[row, column] += weight
+    return scores
+
+
+def previous_assess(price, review_summary, product_features):
+    """The keyword checks PriceQualityAgent used before, for timing."""
+    score = 0
+    if any(word in review_summary.lower() for word in ["good", "excellent", "great", "love", "durable", "high quality", "amazing"]):
+        score += 1
+    if any(word in product_features.lower() for word in ["premium", "pro", "plus", "metal", "advanced"]):
+        score += 1
+    if price < 50:
+        score += 1
+    return score
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and time value scoring.")
+    parser.add_argument("--products", type=int, default=20000)
+    args = parser.parse_args()
+
+    agent = PriceQualityAgent()
+    lexicons = agent.DEFAULT_LEXICONS
+    phrases = [phrase for signal in lexicons.values() for phrase in signal]
+    rng = random.Random(7)
+
+    # 1. The single compiled pattern scores exactly like matching each phrase on its own.
+    texts = [random_text(rng, phrases) for _ in range(500)]
+    assert np.allclose(agent.scorer.score_many(texts), reference_scores(lexicons, texts))
+    assert agent.scorer.score("A product for professionals")["premium"] == 0, "'pro' must not match inside words"
+    assert agent.scorer.score("It was cheaply   made")["sentiment"] == -1.5
+    assert agent.scorer.matches("Great kettle, STAINLESS steel") == {"sentiment": ["great"], "premium": ["stainless steel"]}
+    print("compiled scorer matches the phrase-by-phrase reference on 500 texts")
+
+    # 2. Price is judged against similar products when enough of them have prices.
+    similar = [{"product_id": str(i), "product_title": title, "review_snippet": snippet, "price": price}
+               for i, (title, snippet, price) in enumerate([
+                   ("Steel kettle", "Durable stainless steel, great value", 40),
+                   ("Plastic kettle", "Flimsy lid, broke after a week", "$25.00"),
+                   ("Glass kettle", "Good kettle", 60),
+                   ("Travel kettle", "Compact", None),
+               ])]
+    result = agent.assess_value(70, "Reviews are great.", "A stainless steel kettle.", similar_products=similar)
+    assert "above most of the 3 similar products" in result["assessment"], result
+    assert result["score"] == 2, result
+    result = agent.assess_value(30, "Reviews are great.", "A stainless steel kettle.", similar_products=similar)
+    assert "below most" in result["assessment"] and result["score"] == 3, result
+    candidates = {c["product_id"]: c for c in result["candidates"]}
+    assert candidates["0"]["value_score"] > candidates["2"]["value_score"] > candidates["1"]["value_score"], candidates
+    assert candidates["3"]["price_percentile"] is None
+    result = agent.assess_value(30, "Reviews are great.", "A stainless steel kettle.", similar_products=similar[2:])
+    assert "is very affordable" in result["assessment"], "too few priced products: fixed price bands"
+    print("price normalization against similar products checked")
+
+    # 3. Timing: one request (uploaded item + its top-5 similar products) and batch scoring.
+    catalog = [{"product_id": str(i), "product_title": random_text(rng, phrases, 8),
+                "review_snippet": random_text(rng, phrases, 60), "price": rng.uniform(5, 300)}
+               for i in range(args.products)]
+    review, features = random_text(rng, phrases), random_text(rng, phrases, 120)
+
+    runs = 2000
+    started = time.perf_counter()
+    for _ in range(runs):
+        previous_assess(70, review, features)
+    previous_us = (time.perf_counter() - started) / runs * 1e6
+
+    started = time.perf_counter()
+    for i in range(runs):
+        agent.assess_value(70, review, features, similar_products=catalog[i % 100 * 5:i % 100 * 5 + 5])
+    request_us = (time.perf_counter() - started) / runs * 1e6
+
+    started = time.perf_counter()
+    agent.score_products(catalog)
+    batch_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for product in catalog[:2000]:
+        agent.score_products([product])
+    single_us = (time.perf_counter() - started) / 2000 * 1e6
+
+    print(f"previous keyword checks (uploaded item only):   {previous_us:8.1f} us/request")
+    print(f"compiled scorer, uploaded item + 5 candidates:  {request_us:8.1f} us/request")
+    print(f"batch scoring {args.products} products:           {batch_s * 1000:8.1f} ms "
+          f"({batch_s / args.products * 1e6:.1f} us/product; {single_us:.1f} us/product one at a time)")
+    print("OK: value scoring checks passed.")
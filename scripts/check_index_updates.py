@@ -0,0 +1,227 @@
+# FILE: scripts/check_index_updates.py
+# Verifies incremental catalog updates on a small synthetic catalog: deletes
+# (tombstones), additions, replacements, hot reload of a version published by
+# another writer, hybrid search over added products, atomic swaps under concurrent
+# searches, version pruning, cache scoping and the /api/index endpoints, including a compressed
+# index re-scored from full-precision vectors. CLIP is replaced by a stand-in, so no models are needed.
+#
+#   python scripts/check_index_updates.py --products 20000
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config
+from app.core.catalog import current_version, load_version, publish
+from app.core.metadata_store import write_metadata_store
+from app.core.model_registry import model_registry
+from app.core.vector_index import COMPRESSED_KINDS, build_index, prepare_vectors, save_index, save_vectors, vectors_path
+from app.agents.review_analyzer_agent import ReviewAnalyzerAgent
+
+DIMENSION = 64
+
+
+class StandInCLIP:
+    """Maps every image to a fixed pseudo-random vector derived from its pixels."""
+    def encode(self, inputs):
+        vectors = []
+        for item in inputs:
+            seed = int(hashlib.sha1(item.tobytes() if isinstance(item, Image.Image) else item.encode()).hexdigest()[:8], 16)
+            vectors.append(np.random.default_rng(seed).standard_normal(DIMENSION))
+        return np.asarray(vectors, dtype='float32')
+
+
+def product_image(i: int) -> Image.Image:
+    return Image.new("RGB", (8, 8), (i % 256, (i // 256) % 256, 200))
+
+
+def build_catalog(root: str, count: int, kind: str, clip: StandInCLIP):
+    embeddings = clip.encode([product_image(i) for i in range(count)])
+    index, info = build_index(embeddings, kind=kind, metric="cosine")
+    save_index(index, os.path.join(root, "product_reviews.index"), info)
+    records = [{"product_id": f"P{i}", "product_title": f"Product {i}", "product_description": f"Item number {i}"}
+               for i in range(count)]
+    write_metadata_store(records, os.path.join(root, "product_data.bin"))
+    if kind in COMPRESSED_KINDS:
+        save_vectors(prepare_vectors(embeddings, "cosine"), vectors_path(os.path.join(root, "product_data.bin")))
+
+
+def top_ids(agent, image: Image.Image, top_k: int = 5):
+    embedding = agent.model.encode([image])
+    return [hit["product_id"] for hit in agent._search_many(embedding, top_k)[0]["top_products"]]
+
+
+def check_updates(root: str, count: int, kind: str, clip: StandInCLIP):
+    build_catalog(root, count, kind, clip)
+    # Each check builds its own catalog, so the previous one's index is dropped first.
+    model_registry.unload("product_index")
+    agent = ReviewAnalyzerAgent(rag_data_path=root)
+    assert agent._ensure_loaded() and agent.catalog.name == "base"
+    assert top_ids(agent, product_image(5))[0] == "P5"
+
+    # Deleting a product removes it from results, which still have top_k entries.
+    started = time.perf_counter()
+    report = agent.delete_products(["P5", "NOPE"])
+    delete_ms = (time.perf_counter() - started) * 1000
+    assert report["deleted"] == 1 and report["not_found"] == ["NOPE"], report
+    assert current_version(root) == agent.catalog.name == "000001"
+    ids = top_ids(agent, product_image(5))
+    assert "P5" not in ids and len(ids) == 5, ids
+
+    # Additions are searchable at once; re-adding an existing id replaces it.
+    new_image, replacement = product_image(count + 1), product_image(count + 2)
+    started = time.perf_counter()
+    report = agent.add_products(
+        [{"product_id": "NEW", "product_title": "New product"}, {"product_id": "P7", "product_title": "Product 7 v2"}],
+        [new_image, replacement],
+    )
+    add_ms = (time.perf_counter() - started) * 1000
+    assert report["added"] == 1 and report["replaced"] == 1, report
+    assert top_ids(agent, new_image)[0] == "NEW"
+    hit = agent._search_many(agent.model.encode([replacement]), 1)[0]["top_products"][0]
+    assert hit["product_id"] == "P7" and hit["product_title"] == "Product 7 v2", hit
+    assert "P7" not in top_ids(agent, product_image(7))
+
+    # A version published by another writer (e.g. update_index.py) is picked up in the background.
+    config.INDEX_RELOAD_CHECK_S = 0.05
+    other_writer_base = load_version(root)
+    publish(other_writer_base, delete_ids=["P9"])
+    deadline = time.monotonic() + 5
+    while agent.catalog.name != current_version(root) and time.monotonic() < deadline:
+        time.sleep(0.06)
+        agent._ensure_loaded()
+    assert agent.catalog.name == current_version(root), (agent.catalog.name, current_version(root))
+    assert "P9" not in top_ids(agent, product_image(9))
+
+    # Hybrid text search covers added segments (their BM25 index is written on publish) and skips tombstones.
+    # (The stand-in's text vectors are random, so only the lexical half can find it.)
+    hybrid_ids = [hit["product_id"] for hit in agent.analyze_batch(["New product"], mode="hybrid")[0]["top_products"]]
+    assert "NEW" in hybrid_ids, hybrid_ids
+    assert os.path.exists(os.path.join(root, "segments", "seg_000002.bm25.npz"))
+    hybrid_ids = [hit["product_id"] for hit in agent.analyze_batch(["Product 9"], mode="hybrid")[0]["top_products"]]
+    assert "P9" not in hybrid_ids, hybrid_ids
+    if kind in COMPRESSED_KINDS:
+        # Added segments get their full-precision vectors too, so every row can be re-scored.
+        assert os.path.exists(os.path.join(root, "segments", "seg_000002.vectors.npy"))
+        assert agent.catalog.vectors is not None and len(agent.catalog.vectors) == len(agent.catalog.metadata)
+        hit = agent._search_many(agent.model.encode([new_image]), 1)[0]["top_products"][0]
+        assert hit["product_id"] == "NEW" and abs(hit["relevance_score"] - 1.0) < 1e-5, hit
+
+    # Cached results belong to the version they were found in; cached embeddings outlive it.
+    assert "P11" in [hit["product_id"] for hit in agent.analyze_batch(["Product 11"], mode="hybrid")[0]["top_products"]]
+    before = agent.cache.stats()
+    agent.delete_products(["P11"])
+    hybrid_ids = [hit["product_id"] for hit in agent.analyze_batch(["Product 11"], mode="hybrid")[0]["top_products"]]
+    after = agent.cache.stats()
+    assert "P11" not in hybrid_ids, hybrid_ids
+    assert after["misses"] == before["misses"] + 1 and after["memory_hits"] == before["memory_hits"] + 1, (before, after)
+
+    # Searches keep running while versions are swapped underneath them.
+    errors, searches, stop = [], [0], threading.Event()
+
+    def search_loop():
+        queries = clip.encode([product_image(i) for i in range(100, 132)])
+        while not stop.is_set():
+            try:
+                results = agent._search_many(queries, 5)
+                assert all(len(result["top_products"]) == 5 for result in results)
+                searches[0] += 1
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=search_loop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(10):
+        agent.add_products([{"product_id": f"X{i}", "product_title": f"Extra {i}"}], [product_image(count + 10 + i)])
+        agent.delete_products([f"P{200 + i}"])
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    # An update writes an index part with only its own rows; past INDEX_MAX_PARTS they are merged.
+    parts = agent.catalog.index_files
+    assert 1 < len(parts) <= config.INDEX_MAX_PARTS + 1, parts
+    assert all(part["rows"] < count // 10 for part in parts[1:]), parts
+    # Pruning keeps the newest versions and the index parts they use, and nothing else.
+    versions = sorted(os.listdir(os.path.join(root, "versions")))
+    assert len(versions) == config.INDEX_KEEP_VERSIONS, versions
+    used = {part["path"] for name in versions for part in load_version(root, name).index_files}
+    on_disk = {os.path.join("segments", f) for f in os.listdir(os.path.join(root, "segments")) if f.endswith(".index")}
+    assert on_disk == used - {"product_reviews.index"}, (on_disk, used)
+    # Old versions were pruned, but the live one reloads from disk intact.
+    reloaded = load_version(root)
+    assert reloaded.stats() == agent.catalog.stats(), (reloaded.stats(), agent.catalog.stats())
+    return agent, {"delete_ms": delete_ms, "add_ms": add_ms, "searches_during_swaps": searches[0]}
+
+
+def check_api(agent):
+    from app.main import app
+    import app.api.endpoints as endpoints
+
+    endpoints.review_agent = agent
+    buffer = io.BytesIO()
+    product_image(999_999).save(buffer, "PNG")
+    image_base64 = base64.b64encode(buffer.getvalue()).decode()
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+            # Without a configured token the write endpoints are closed.
+            config.INDEX_ADMIN_TOKEN = ""
+            response = await client.post("/api/index/reload")
+            assert response.status_code == 403, response.status_code
+            config.INDEX_ADMIN_TOKEN = "secret"
+            response = await client.post("/api/index/products/delete", json={"product_ids": ["P1"]})
+            assert response.status_code == 403, response.status_code
+            response = await client.post("/api/index/products/delete", headers={"X-Admin-Token": "secrex"},
+                                         json={"product_ids": ["P1"]})
+            assert response.status_code == 403, response.status_code
+            headers = {"X-Admin-Token": "secret"}
+            response = await client.post("/api/index/products", headers=headers, json={"products": [
+                {"product_id": "API1", "product_title": "From the API", "image_base64": image_base64}]})
+            assert response.status_code == 200 and response.json()["added"] == 1, response.text
+            response = await client.post("/api/index/products", headers=headers, json={"products": [
+                {"product_id": "BAD", "image_base64": "not base64!"}]})
+            assert response.status_code == 400, response.text
+            response = await client.post("/api/index/products/delete", headers=headers, json={"product_ids": ["P1"]})
+            assert response.status_code == 200 and response.json()["deleted"] == 1, response.text
+            status = (await client.get("/api/index")).json()
+            assert status["version"] == status["version_on_disk"], status
+            return status
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check incremental catalog updates.")
+    parser.add_argument("--products", type=int, default=5000)
+    args = parser.parse_args()
+
+    clip = StandInCLIP()
+    model_registry.override("clip", clip)
+    config.REVIEW_CACHE_DISK_PATH = ""
+    for kind in ("flat", "hnsw", "ivf_flat", "flat_sq8"):
+        with tempfile.TemporaryDirectory() as root:
+            agent, timings = check_updates(root, args.products, kind, clip)
+            print(f"{kind:<9} delete {timings['delete_ms']:7.1f} ms  add {timings['add_ms']:7.1f} ms  "
+                  f"{timings['searches_during_swaps']} batch searches ran during 20 swaps, all consistent")
+            if kind == "flat":
+                status = check_api(agent)
+                print(f"API: add, delete and auth checks passed; serving {status['version']} "
+                      f"({status['live']} live of {status['rows']} rows)")
+    print("OK: incremental index update checks passed.")
@@ -0,0 +1,193 @@
+# FILE: scripts/check_latency_budget.py
+# Verifies the latency-budget fast path of /api/get-recommendation in-process,
+# with the ReviewAnalyzer and ProductResearcher replaced by stand-ins (the VLM
+# one just sleeps). No models are needed.
+#
+#   python scripts/check_latency_budget.py
+
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+
+import httpx
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config
+from app.main import app
+import app.api.endpoints as endpoints
+
+VLM_SECONDS = 1.5
+
+
+class StandInReviewAgent:
+    seconds = 0.02
+
+    def analyze_with_image(self, image, top_k: int = 5, query=None):
+        time.sleep(self.seconds)
+        return {"summary": "Found several similar products. The top match is 'Steel Kettle'.",
+                "top_products": [{"product_id": "1", "product_title": "Steel Kettle",
+                                  "review_snippet": "A 1.7 litre brushed steel kettle.", "image_url": "",
+                                  "relevance_score": 0.9}]}
+
+
+class StandInProductAgent:
+    def __init__(self):
+        self.start_deadlines = []
+
+    def analyze_image(self, image, query, on_chunk=None, start_deadline=None):
+        # The real agent withdraws requests still queued at `start_deadline`; this one starts at once.
+        self.start_deadlines.append(start_deadline)
+        time.sleep(VLM_SECONDS)
+        if on_chunk:
+            on_chunk("A shiny steel kettle.")
+        return {"analysis": "A shiny steel kettle."}
+
+
+class RecordingPriceAgent:
+    """The real PriceQuality agent, slowed down by `seconds`, recording the features it was given."""
+    def __init__(self, agent):
+        self.agent = agent
+        self.seconds = 0.0
+        self.features = []
+
+    def assess_value(self, **kwargs):
+        self.features.append(kwargs["product_features"])
+        time.sleep(self.seconds)
+        return self.agent.assess_value(**kwargs)
+
+
+async def run_request(image_bytes: bytes, query: str, budget_ms=None):
+    """
+    Returns (seconds until each event type was first seen, the parsed events).
+    Calls the ASGI app directly, since httpx's ASGITransport only returns the body once it is complete.
+    """
+    request = httpx.Request(
+        "POST", "http://check/api/get-recommendation",
+        params={} if budget_ms is None else {"latency_budget_ms": budget_ms},
+        data={"query": query, "price": "30", "budget": "50"},
+        files={"image_file": ("p.jpg", image_bytes, "image/jpeg")},
+    )
+    body = request.read()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": request.url.path, "raw_path": request.url.raw_path, "query_string": request.url.query,
+        "root_path": "", "headers": [(k.lower(), v) for k, v in request.headers.raw],
+        "client": ("127.0.0.1", 5000), "server": ("check", 80),
+    }
+    started = time.perf_counter()
+    seen, events, text = {}, [], ""
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        nonlocal text
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200, message["status"]
+        elif message["type"] == "http.response.body":
+            text += message.get("body", b"").decode()
+            while "\n\n" in text:
+                block, text = text.split("\n\n", 1)
+                lines = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+                seen.setdefault(lines["event"], time.perf_counter() - started)
+                events.append((lines["event"], json.loads(lines["data"])))
+
+    await app(scope, receive, send)
+    seen["end"] = time.perf_counter() - started
+    return seen, events
+
+
+async def main(image_bytes: bytes, product_agent: StandInProductAgent, review_agent: StandInReviewAgent,
+               price_agent: RecordingPriceAgent):
+    # 1. No budget: the recommendation waits for the VLM, as before.
+    seen, events = await run_request(image_bytes, "no budget")
+    final = dict(events)["final_recommendation"]
+    assert seen["final_recommendation"] >= VLM_SECONDS, seen
+    assert not final["identified_product"]["visual_summary_deferred"]
+    assert "visual_summary" not in seen
+    print(f"no budget:        final after {seen['final_recommendation']:.2f}s (full visual summary)")
+
+    # 2. A 500 ms budget: the recommendation comes from catalog data, the visual summary follows.
+    seen, events = await run_request(image_bytes, "with budget", budget_ms=500)
+    by_type = dict(events)
+    final, late = by_type["final_recommendation"], by_type["visual_summary"]
+    assert seen["final_recommendation"] < 0.5, seen
+    assert final["identified_product"]["visual_summary_deferred"]
+    assert "Steel Kettle" in final["identified_product"]["visual_summary"]
+    assert final["agent_outputs"]["LeadAgent"]["data"]["value_assessment"]
+    assert late["identified_product"]["visual_summary"] == "A shiny steel kettle."
+    assert not late["agent_outputs"]["LeadAgent"]["data"]["visual_summary_deferred"]
+    assert seen["visual_summary"] >= VLM_SECONDS, seen
+    print(f"500 ms budget:    final after {seen['final_recommendation']:.2f}s (catalog-based), "
+          f"visual summary pushed after {seen['visual_summary']:.2f}s")
+    # A run that missed its budget is not replayed to the next identical request.
+    replayed = endpoints.analysis_flights.stats()["replayed"]
+    seen, events = await run_request(image_bytes, "with budget", budget_ms=500)
+    assert endpoints.analysis_flights.stats()["replayed"] == replayed
+    assert "visual_summary" in seen, seen
+
+    # 3. Budget without pushing the summary later: the stream ends with the recommendation,
+    #    and the VLM request carries a start deadline so it can be withdrawn if still queued.
+    config.DEFERRED_VISUAL_SUMMARY = False
+    try:
+        seen, events = await run_request(image_bytes, "no push", budget_ms=500)
+    finally:
+        config.DEFERRED_VISUAL_SUMMARY = True
+    assert seen["end"] < 0.5 and "visual_summary" not in seen, seen
+    assert product_agent.start_deadlines[-1] is not None
+    print(f"without push:     stream closed after {seen['end']:.2f}s")
+
+    # 4. The VLM misses the budget but finishes before the review search (and so PriceQuality):
+    #    its analysis is used after all, by the value assessment too.
+    review_agent.seconds = VLM_SECONDS + 0.3
+    try:
+        seen, events = await run_request(image_bytes, "late vlm, slow search", budget_ms=500)
+    finally:
+        review_agent.seconds = 0.02
+    final = dict(events)["final_recommendation"]
+    assert not final["identified_product"]["visual_summary_deferred"], final
+    assert final["identified_product"]["visual_summary"] == "A shiny steel kettle."
+    assert price_agent.features[-1] == "A shiny steel kettle.", price_agent.features
+    assert "visual_summary" not in seen, seen
+    print(f"slow search:      final after {seen['final_recommendation']:.2f}s (VLM result used after the budget)")
+
+    # 5. The VLM finishes while PriceQuality is already assessing the catalog stand-in: the
+    #    recommendation stays deferred, and the real summary is pushed after it.
+    price_agent.seconds = VLM_SECONDS
+    try:
+        seen, events = await run_request(image_bytes, "late vlm, slow pricing", budget_ms=500)
+    finally:
+        price_agent.seconds = 0.0
+    by_type = dict(events)
+    final, late = by_type["final_recommendation"], by_type["visual_summary"]
+    assert price_agent.features[-1] != "A shiny steel kettle.", price_agent.features
+    assert final["identified_product"]["visual_summary_deferred"], final
+    assert "Steel Kettle" in final["identified_product"]["visual_summary"]
+    assert late["identified_product"]["visual_summary"] == "A shiny steel kettle."
+    assert seen["visual_summary"] >= seen["final_recommendation"], seen
+    print(f"slow pricing:     final after {seen['final_recommendation']:.2f}s (catalog-based), "
+          f"visual summary pushed after {seen['visual_summary']:.2f}s")
+
+
+if __name__ == "__main__":
+    product_agent, review_agent = StandInProductAgent(), StandInReviewAgent()
+    price_agent = RecordingPriceAgent(endpoints.lead_agent.price_agent)
+    endpoints.lead_agent.review_agent = review_agent
+    endpoints.lead_agent.product_agent = product_agent
+    endpoints.lead_agent.price_agent = price_agent
+    config.LATENCY_BUDGET_RESERVE_MS = 100
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), (90, 90, 90)).save(buffer, "JPEG")
+    asyncio.run(main(buffer.getvalue(), product_agent, review_agent, price_agent))
+    print("OK: latency budget checks passed.")
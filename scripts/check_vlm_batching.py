@@ -0,0 +1,82 @@
+# FILE: scripts/check_vlm_batching.py
+# Verifies the ProductResearchAgent micro-batching logic on CPU, using a tiny
+# stand-in model instead of Qwen2.5-VL. No GPU or model download is needed.
+#
+#   python scripts/check_vlm_batching.py
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core.batching import BatchingWorker
+
+
+class TinyStandInModel:
+    """
+    Mimics the cost profile of a generative model: every `generate` call pays a
+    fixed overhead (kernel launches, weight reads) plus a small per-row cost.
+    The "answer" is derived from the prompt so results can be checked per caller.
+    """
+    def __init__(self, call_overhead_s: float = 0.05, per_row_s: float = 0.005):
+        self.call_overhead_s = call_overhead_s
+        self.per_row_s = per_row_s
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def generate(self, requests):
+        with self._lock:
+            self.batch_sizes.append(len(requests))
+        time.sleep(self.call_overhead_s + self.per_row_s * len(requests))
+        return [f"analysis of {image} for '{query}'" for image, query in requests]
+
+
+def run(num_requests: int, concurrency: int, max_batch_size: int, max_wait_ms: float):
+    model = TinyStandInModel()
+    worker = BatchingWorker(model.generate, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def one_request(i):
+        return i, worker((f"image-{i}", f"query-{i}"))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one_request, range(num_requests)))
+    elapsed = time.perf_counter() - started
+
+    for i, answer in results:
+        assert answer == f"analysis of image-{i} for 'query-{i}'", f"request {i} got the wrong result: {answer!r}"
+    assert sum(model.batch_sizes) == num_requests, "every request must be generated exactly once"
+    assert max(model.batch_sizes) <= max_batch_size, "a batch exceeded max_batch_size"
+
+    return elapsed, model.batch_sizes, worker.stats()
+
+
+def check_failure_propagates():
+    def broken(requests):
+        raise RuntimeError("out of memory")
+
+    worker = BatchingWorker(broken, max_batch_size=4, max_wait_ms=5)
+    try:
+        worker(("image", "query"), timeout=5)
+    except RuntimeError as e:
+        assert "out of memory" in str(e)
+    else:
+        raise AssertionError("batch errors must be raised to every caller")
+
+
+if __name__ == "__main__":
+    num_requests, concurrency = 64, 16
+
+    sequential_time, sequential_batches, _ = run(num_requests, concurrency, max_batch_size=1, max_wait_ms=0)
+    batched_time, batched_batches, stats = run(num_requests, concurrency, max_batch_size=8, max_wait_ms=20)
+    check_failure_propagates()
+
+    assert max(batched_batches) > 1, "concurrent requests were never grouped into a batch"
+
+    print(f"batch size 1: {len(sequential_batches)} generate calls, {num_requests / sequential_time:.1f} req/s")
+    print(f"batch size 8: {len(batched_batches)} generate calls, {num_requests / batched_time:.1f} req/s "
+          f"(avg batch {stats['avg_batch_size']:.1f}, avg latency {stats['avg_latency_ms']:.1f} ms)")
+    print("OK: batching worker groups requests and dispatches results to the right callers.")
@@ -0,0 +1,44 @@
+# FILE: scripts/convert_metadata.py
+# Converts a legacy product_data.json into the memory-mapped metadata store
+# (product_data.bin) read by ReviewAnalyzerAgent. Row ids are preserved, so the
+# existing FAISS index keeps working unchanged.
+#
+#   python scripts/convert_metadata.py backend/app/rag_data/product_data.json
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core.metadata_store import MetadataStore, write_metadata_store
+
+
+def convert(json_path: str, store_path: str):
+    print(f"Reading {json_path}")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        records = json.load(f)
+
+    started = time.perf_counter()
+    write_metadata_store(records, store_path)
+    print(f"Wrote {len(records)} rows to {store_path} in {time.perf_counter() - started:.2f}s "
+          f"({os.path.getsize(json_path) / 2**20:.1f} MB JSON -> {os.path.getsize(store_path) / 2**20:.1f} MB store)")
+
+    # Spot-check that the store reads back what the JSON file contained.
+    store = MetadataStore(store_path)
+    for row in {0, len(records) // 2, len(records) - 1}:
+        if 0 <= row < len(records) and store[row] != records[row]:
+            raise SystemExit(f"Row {row} does not round-trip: {store[row]!r} != {records[row]!r}")
+    store.close()
+    print("Round-trip check passed.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert product_data.json into a memory-mapped metadata store.")
+    parser.add_argument("json_path")
+    parser.add_argument("--output", default=None, help="Defaults to product_data.bin next to the input.")
+    args = parser.parse_args()
+
+    convert(args.json_path, args.output or os.path.join(os.path.dirname(args.json_path), 'product_data.bin'))
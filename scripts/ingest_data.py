@@ -1,96 +1,459 @@
 # FILE: scripts/ingest_data.py
-# ACTION: Replace your existing file with this code.
-# REASON: This adds 'ValueError' to the try...except block, making the script
-#         robust by simply skipping any image that causes the channel dimension error.
+# Builds the product FAISS index, BM25 index and metadata used by ReviewAnalyzerAgent.
+#
+# The ingester is a three-stage pipeline:
+#   fetch  - images are downloaded (or read from disk) by a thread pool that reuses
+#            HTTP connections, while the other stages keep working;
+#   encode - CLIP embeddings are computed in batches;
+#   write  - embeddings and metadata are flushed to numbered shards, and a
+#            checkpoint manifest is updated after every shard.
+# A crashed or interrupted run picks up where it stopped, and running again with a
+# new source appends to the existing shards. Images that fail to load are retried
+# (--fetch-retries) and, if they still fail, tried again by the next run.
+#
+# The indexes are built from all shards at the end. Embedding shards are memory-mapped
+# and added to the FAISS index one at a time, so the build needs memory for the index
+# itself (N x 512 x 4 bytes for flat and hnsw, less for compressed kinds), one shard, the
+# IVF training sample (at most 100k vectors) and the metadata of every product.
+#
+#   python scripts/ingest_data.py                              # Hugging Face sample
+#   python scripts/ingest_data.py --source dir:./my_images     # offline, local folder
+#   python scripts/ingest_data.py --source jsonl:./products.jsonl
 
-import datasets
+import argparse
 import numpy as np
-import faiss
 from sentence_transformers import SentenceTransformer
 import os
+import sys
 import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
 from io import BytesIO
 
-def setup_rag_pipeline():
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core.lexical_index import LexicalIndex, lexical_path
+from app.core.metadata_store import write_metadata_store
+from app.core.vector_index import (
+    COMPRESSED_KINDS, INDEX_KINDS, METRICS, build_index, save_index, save_vectors, vectors_path,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+MANIFEST_VERSION = 1
+
+
+# --- Sources ---
+
+def hf_source(sample_size: int):
+    """Products from the crossingminds/shopping-queries-image-dataset on Hugging Face."""
+    import datasets
+
+    print("Loading dataset: crossingminds/shopping-queries-image-dataset")
+    ds = datasets.load_dataset("crossingminds/shopping-queries-image-dataset", "product_image_urls")
+    product_data = ds['train']
+    sample_size = min(sample_size, len(product_data))
+    print(f"Using a sample of {sample_size} products.")
+    return (dict(item) for item in product_data.select(range(sample_size)))
+
+
+def directory_source(path: str):
     """
-    Downloads the dataset from Hugging Face, creates embeddings using the CLIP model,
-    and saves the FAISS index and corresponding data.
+    Every image file in a local folder becomes a product. Metadata can be supplied
+    in an optional `metadata.jsonl` keyed by file name; otherwise the file name is the title.
     """
-    print("--- Starting RAG pipeline setup with CLIP model from Hugging Face ---")
+    metadata = {}
+    metadata_path = os.path.join(path, "metadata.jsonl")
+    if os.path.exists(metadata_path):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    metadata[record["file_name"]] = record
 
-    print("Loading CLIP model: clip-ViT-B-32")
-    model = SentenceTransformer('clip-ViT-B-32')
+    file_names = sorted(os.listdir(path))
 
-    print("Loading dataset: crossingminds/shopping-queries-image-dataset")
-    try:
-        ds = datasets.load_dataset("crossingminds/shopping-queries-image-dataset", "product_image_urls")
-        product_data = ds['train']
-    except Exception as e:
-        print(f"FATAL ERROR: Could not download dataset from Hugging Face: {e}")
-        return
+    def items():
+        for file_name in file_names:
+            stem, extension = os.path.splitext(file_name)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            item = {"product_id": stem, "product_title": stem.replace("_", " "), "image_url": os.path.join(path, file_name)}
+            item.update(metadata.get(file_name, {}))
+            yield item
+    return items()
 
-    sample_size = 5000
-    product_data = product_data.select(range(sample_size))
-    print(f"Using a sample of {sample_size} products.")
 
-    print("Generating image embeddings using CLIP (this may take a while)...")
-    
-    embeddings = []
-    valid_products = []
-    skipped_count = 0
+def jsonl_source(path: str):
+    """One product per line; `image_url` may be an http(s) URL, a file:// URL or a local path."""
+    f = open(path, 'r', encoding='utf-8')
+
+    def items():
+        with f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    return items()
+
+
+def open_source(spec: str, sample_size: int):
+    """
+    Opens a source eagerly (dataset download, folder listing, file open), so that a
+    source that cannot be opened fails here; returns an iterator over its products.
+    """
+    if spec == "hf":
+        return hf_source(sample_size)
+    kind, _, path = spec.partition(":")
+    if kind == "dir":
+        return directory_source(path)
+    if kind == "jsonl":
+        return jsonl_source(path)
+    raise ValueError(f"Unknown source '{spec}'. Use 'hf', 'dir:<folder>' or 'jsonl:<file>'.")
 
-    for item in product_data:
-        image_url = item.get('image_url')
+
+def item_key(item: dict) -> str:
+    """Stable identity of a product, used to skip work that is already checkpointed."""
+    return str(item.get("product_id") or item.get("image_url"))
+
+
+# --- Stage statistics ---
+
+class StageStats:
+    """Counts items and busy time per pipeline stage (thread-safe)."""
+    def __init__(self, *stages):
+        self._lock = threading.Lock()
+        self.items = {stage: 0 for stage in stages}
+        self.busy_s = {stage: 0.0 for stage in stages}
+        self.started = time.perf_counter()
+
+    def add(self, stage: str, items: int, busy_s: float):
+        with self._lock:
+            self.items[stage] += items
+            self.busy_s[stage] += busy_s
+
+    def report(self, skipped: int):
+        elapsed = time.perf_counter() - self.started
+        print(f"--- Ingestion stats ({elapsed:.1f}s wall, {skipped} skipped) ---")
+        for stage, items in self.items.items():
+            busy = self.busy_s[stage]
+            per_busy = items / busy if busy else 0.0
+            print(f"  {stage:<6} {items:>7} images  {items / elapsed if elapsed else 0:8.1f} img/s wall"
+                  f"  {per_busy:8.1f} img/s per busy second")
+
+
+# --- Fetch stage ---
+
+_thread_local = threading.local()
+
+
+def _session(pool_size: int) -> requests.Session:
+    """One pooled session per fetch thread, so connections are reused across downloads."""
+    if not hasattr(_thread_local, "session"):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return _thread_local.session
+
+
+def fetch_image(item: dict, stats: StageStats, pool_size: int, timeout: float):
+    """Returns (item, RGB image), or (item, None) if the image cannot be loaded."""
+    started = time.perf_counter()
+    image_url = item.get('image_url')
+    try:
         if not image_url:
-            continue
-        try:
-            response = requests.get(image_url, timeout=10)
+            return item, None
+        if image_url.startswith(("http://", "https://")):
+            response = _session(pool_size).get(image_url, timeout=timeout)
             response.raise_for_status()
             img = Image.open(BytesIO(response.content))
-            
-            img = img.convert("RGB")
-            
-            # --- THIS IS THE FIX ---
-            # The model.encode() call is now inside the try...except block
-            # to catch ValueErrors from problematic images.
-            embedding = model.encode([img])[0]
-            
-            embeddings.append(embedding)
-            valid_products.append(item)
-
-        except (requests.exceptions.RequestException, IOError, OSError, ValueError) as e:
-            # If any error occurs (download, file format, or value error), skip this image.
-            skipped_count += 1
-            continue
-
-    if not embeddings:
-        print("Error: No images could be processed at all. Aborting.")
+        else:
+            img = Image.open(image_url[len("file://"):] if image_url.startswith("file://") else image_url)
+        img = img.convert("RGB")
+        stats.add("fetch", 1, time.perf_counter() - started)
+        return item, img
+    except (requests.exceptions.RequestException, IOError, OSError, ValueError):
+        # If any error occurs (download or file format), skip this image.
+        return item, None
+
+
+# --- Encode stage ---
+
+def encode_batch(model, batch, batch_size: int):
+    """
+    Encodes (item, image) pairs in one call. If the batch contains an image
+    the model rejects (e.g. a channel dimension error), falls back to one-by-one
+    encoding so only the problematic images are skipped.
+    """
+    try:
+        embeddings = model.encode([img for _, img in batch], batch_size=batch_size, convert_to_numpy=True)
+        return [item for item, _ in batch], np.asarray(embeddings, dtype='float32')
+    except ValueError:
+        items, embeddings = [], []
+        for item, img in batch:
+            try:
+                embeddings.append(model.encode([img], convert_to_numpy=True)[0])
+                items.append(item)
+            except ValueError:
+                continue
+        return items, np.asarray(embeddings, dtype='float32').reshape(len(items), -1)
+
+
+# --- Write stage / checkpointing ---
+
+class ShardWriter:
+    """
+    Writes embeddings and metadata to numbered shards under `work_dir` and keeps a
+    manifest of completed shards. Every file is written to a temporary name and
+    renamed into place, so a crash never leaves a half-written shard in the manifest.
+    """
+    def __init__(self, work_dir: str, model_name: str, fresh: bool = False):
+        self.work_dir = work_dir
+        self.shard_dir = os.path.join(work_dir, "shards")
+        self.manifest_path = os.path.join(work_dir, "manifest.json")
+        os.makedirs(self.shard_dir, exist_ok=True)
+
+        if fresh and os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            if self.manifest.get("model") != model_name:
+                raise ValueError(f"Checkpoint in {work_dir} was built with '{self.manifest.get('model')}'. "
+                                 f"Use --fresh to start over with '{model_name}'.")
+            print(f"Resuming from checkpoint: {self.total_items()} products in {len(self.manifest['shards'])} shards.")
+        else:
+            self.manifest = {"version": MANIFEST_VERSION, "model": model_name, "shards": []}
+
+    def total_items(self) -> int:
+        return sum(shard["count"] for shard in self.manifest["shards"])
+
+    def done_keys(self) -> set:
+        keys = set()
+        for shard in self.manifest["shards"]:
+            with open(os.path.join(self.shard_dir, shard["metadata"]), 'r', encoding='utf-8') as f:
+                keys.update(item_key(json.loads(line)) for line in f if line.strip())
+        return keys
+
+    def write(self, items, embeddings: np.ndarray):
+        shard_id = len(self.manifest["shards"])
+        name = f"shard_{shard_id:05d}"
+        embeddings_file, metadata_file = f"{name}.npy", f"{name}.jsonl"
+
+        tmp_embeddings = os.path.join(self.shard_dir, embeddings_file + ".tmp")
+        with open(tmp_embeddings, 'wb') as f:
+            np.save(f, embeddings)
+        os.replace(tmp_embeddings, os.path.join(self.shard_dir, embeddings_file))
+
+        tmp_metadata = os.path.join(self.shard_dir, metadata_file + ".tmp")
+        with open(tmp_metadata, 'w', encoding='utf-8') as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+        os.replace(tmp_metadata, os.path.join(self.shard_dir, metadata_file))
+
+        self.manifest["shards"].append({"embeddings": embeddings_file, "metadata": metadata_file, "count": len(items)})
+        tmp_manifest = self.manifest_path + ".tmp"
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_manifest, self.manifest_path)
+
+    def load_all(self):
+        """Every shard's embeddings (memory-mapped, not concatenated) and the metadata of all products."""
+        embeddings, products = [], []
+        for shard in self.manifest["shards"]:
+            embeddings.append(np.load(os.path.join(self.shard_dir, shard["embeddings"]), mmap_mode='r'))
+            with open(os.path.join(self.shard_dir, shard["metadata"]), 'r', encoding='utf-8') as f:
+                products.extend(json.loads(line) for line in f if line.strip())
+        return embeddings, products
+
+
+# --- Pipeline ---
+
+def run_ingestion(source, writer: ShardWriter, model, fetch_workers: int = 16, batch_size: int = 64,
+                  shard_size: int = 1024, timeout: float = 10, fetch_retries: int = 1):
+    """
+    Streams `source` through fetch, encode and write, returning the number of skipped items.
+    An image that fails to load is fetched again up to `fetch_retries` times. Items count as
+    done once they are encoded; skipped ones are not, so a later run tries them again.
+    """
+    stats = StageStats("fetch", "encode", "write")
+    done = writer.done_keys()
+    # Keys being fetched or waiting to be encoded, with their failed fetch attempts so far.
+    in_progress = {}
+    skipped = 0
+    pending_items, pending_embeddings = [], []
+    batch = []
+
+    def flush_shard():
+        if not pending_items:
+            return
+        started = time.perf_counter()
+        count = len(pending_items)
+        writer.write(list(pending_items), np.concatenate(pending_embeddings))
+        stats.add("write", count, time.perf_counter() - started)
+        pending_items.clear()
+        pending_embeddings.clear()
+        print(f"Checkpointed {writer.total_items()} products.")
+
+    def encode_pending():
+        started = time.perf_counter()
+        items, embeddings = encode_batch(model, batch, batch_size)
+        stats.add("encode", len(items), time.perf_counter() - started)
+        for item, _ in batch:
+            in_progress.pop(item_key(item), None)
+        done.update(item_key(item) for item in items)
+        batch.clear()
+        pending_items.extend(items)
+        pending_embeddings.append(embeddings)
+        if len(pending_items) >= shard_size:
+            flush_shard()
+        return len(items)
+
+    # Keep a bounded window of downloads in flight so memory stays flat for any catalog size.
+    max_in_flight = fetch_workers * 4
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="fetch") as pool:
+        def drain_one():
+            nonlocal skipped
+            item, img = in_flight.popleft().result()
+            if img is None:
+                key = item_key(item)
+                if in_progress[key] < fetch_retries:
+                    in_progress[key] += 1
+                    in_flight.append(pool.submit(fetch_image, item, stats, fetch_workers, timeout))
+                else:
+                    del in_progress[key]
+                    skipped += 1
+                return
+            batch.append((item, img))
+            if len(batch) >= batch_size:
+                skipped += batch_size - encode_pending()
+
+        for item in source:
+            key = item_key(item)
+            if key in done or key in in_progress:
+                continue
+            in_progress[key] = 0
+            in_flight.append(pool.submit(fetch_image, item, stats, fetch_workers, timeout))
+            if len(in_flight) >= max_in_flight:
+                drain_one()
+
+        while in_flight:
+            drain_one()
+
+    if batch:
+        batch_len = len(batch)
+        skipped += batch_len - encode_pending()
+    flush_shard()
+    stats.report(skipped)
+    return skipped
+
+
+def setup_rag_pipeline(source_spec="hf", sample_size=5000, output_dir='backend/app/rag_data', fresh=False,
+                       fetch_workers=16, batch_size=64, shard_size=1024, fetch_retries=1,
+                       index_kind="flat", metric="cosine", nlist=None, pq_m=64, hnsw_m=32, write_json=False):
+    """
+    Ingests products from `source_spec`, creates embeddings using the CLIP model,
+    and saves the FAISS index and corresponding data.
+    `index_kind` and `metric` select the FAISS index built by `app.core.vector_index.build_index`.
+    Metadata is written as a memory-mapped store (product_data.bin); `write_json` also
+    writes the legacy product_data.json. Compressed index kinds also get the full-precision
+    vectors (product_data.vectors.npy), used to re-score their candidates exactly.
+    """
+    print("--- Starting RAG pipeline setup with CLIP model ---")
+
+    model_name = 'clip-ViT-B-32'
+    print(f"Loading CLIP model: {model_name}")
+    model = SentenceTransformer(model_name)
+
+    writer = ShardWriter(os.path.join(output_dir, 'ingest'), model_name, fresh=fresh)
+    try:
+        source = open_source(source_spec, sample_size)
+    except Exception as e:
+        print(f"FATAL ERROR: Could not open source '{source_spec}': {e}")
         return
 
+    print("Generating image embeddings using CLIP (this may take a while)...")
+    skipped_count = run_ingestion(source, writer, model, fetch_workers=fetch_workers,
+                                  batch_size=batch_size, shard_size=shard_size, fetch_retries=fetch_retries)
     print(f"Total images skipped due to errors: {skipped_count}")
-    embeddings = np.array(embeddings)
-    print(f"Embeddings created successfully with shape: {embeddings.shape}")
 
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(np.array(embeddings, dtype='float32'))
+    embedding_shards, valid_products = writer.load_all()
+    if len(valid_products) == 0:
+        print("Error: No images could be processed at all. Aborting.")
+        return
+    print(f"Embeddings of {len(valid_products)} products in {len(embedding_shards)} checkpoint shards.")
+
+    print(f"Building '{index_kind}' index with metric '{metric}'...")
+    index, index_info = build_index(embedding_shards, kind=index_kind, metric=metric, nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
 
-    rag_data_path = 'backend/app/rag_data'
-    os.makedirs(rag_data_path, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
 
-    index_path = os.path.join(rag_data_path, 'product_reviews.index')
+    index_path = os.path.join(output_dir, 'product_reviews.index')
     print(f"Saving FAISS index to {index_path}")
-    faiss.write_index(index, index_path)
+    save_index(index, index_path, index_info)
 
-    data_path = os.path.join(rag_data_path, 'product_data.json')
-    print(f"Saving metadata for {len(valid_products)} valid products to {data_path}")
-    
-    with open(data_path, 'w', encoding='utf-8') as f:
-        json.dump(valid_products, f)
+    store_path = os.path.join(output_dir, 'product_data.bin')
+    print(f"Saving metadata for {len(valid_products)} valid products to {store_path}")
+    write_metadata_store(valid_products, store_path)
 
-    print("--- RAG pipeline setup from Hugging Face complete! ---")
+    lexical_index_path = lexical_path(store_path)
+    print(f"Building the BM25 index of product titles and descriptions at {lexical_index_path}")
+    LexicalIndex.build(valid_products).save(lexical_index_path)
+
+    full_vectors_path = vectors_path(store_path)
+    if index_kind in COMPRESSED_KINDS:
+        print(f"Saving full-precision vectors for re-scoring to {full_vectors_path}")
+        save_vectors(embedding_shards, full_vectors_path, metric=metric)
+    elif os.path.exists(full_vectors_path):
+        # Left over from a compressed build; an exact index does not need it.
+        os.remove(full_vectors_path)
+
+    if write_json:
+        data_path = os.path.join(output_dir, 'product_data.json')
+        print(f"Saving legacy JSON metadata to {data_path}")
+        with open(data_path, 'w', encoding='utf-8') as f:
+            json.dump(valid_products, f)
+
+    # The new base replaces every incremental version built on the old one.
+    current_path = os.path.join(output_dir, 'CURRENT')
+    if os.path.exists(current_path):
+        print("Resetting the catalog to the new base; products added with update_index.py or the API "
+              "since the last ingest must be added again.")
+        os.remove(current_path)
+
+    print("--- RAG pipeline setup complete! ---")
 
 if __name__ == "__main__":
-    setup_rag_pipeline()
+    parser = argparse.ArgumentParser(description="Build the product FAISS index and metadata.")
+    parser.add_argument("--source", default="hf",
+                        help="'hf' (Hugging Face sample), 'dir:<folder>' or 'jsonl:<file>'.")
+    parser.add_argument("--sample-size", type=int, default=5000, help="Products taken from the 'hf' source.")
+    parser.add_argument("--output-dir", default='backend/app/rag_data')
+    parser.add_argument("--fresh", action="store_true", help="Discard the checkpoint instead of resuming/appending.")
+    parser.add_argument("--fetch-workers", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per CLIP encode call.")
+    parser.add_argument("--shard-size", type=int, default=1024, help="Products per checkpointed shard.")
+    parser.add_argument("--fetch-retries", type=int, default=1, help="Extra attempts for an image that fails to load.")
+    parser.add_argument("--index-kind", choices=INDEX_KINDS, default="flat")
+    parser.add_argument("--metric", choices=METRICS, default="cosine",
+                        help="'cosine' normalizes CLIP vectors and uses inner product.")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF cells (default: about 4*sqrt(N)).")
+    parser.add_argument("--pq-m", type=int, default=64, help="IVF-PQ sub-quantizers; must divide the embedding size.")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node.")
+    parser.add_argument("--write-json", action="store_true", help="Also write the legacy product_data.json.")
+    args = parser.parse_args()
+
+    setup_rag_pipeline(
+        source_spec=args.source, sample_size=args.sample_size, output_dir=args.output_dir, fresh=args.fresh,
+        fetch_workers=args.fetch_workers, batch_size=args.batch_size, shard_size=args.shard_size,
+        fetch_retries=args.fetch_retries,
+        index_kind=args.index_kind, metric=args.metric, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m,
+        write_json=args.write_json,
+    )
@@ -0,0 +1,160 @@
+# FILE: scripts/load_test_admission.py
+# Load-tests /api/get-recommendation in-process with the LeadAgent replaced by
+# a stub that holds a simulated VLM (a few concurrent slots, fixed service time).
+# Requests arrive faster than the stub can serve them, first with admission
+# control effectively off and then with the configured limits, and the script
+# reports latency percentiles of served requests and how fast overload is rejected.
+#
+#   python scripts/load_test_admission.py --rate 40 --duration 10
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+
+import httpx
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config
+from app.core.admission import AdmissionController
+from app.main import app
+import app.api.endpoints as endpoints
+
+
+def make_stub_pipeline(vlm_slots: int, service_s: float):
+    """A LeadAgent stand-in whose cost is dominated by a contended VLM."""
+    vlm = asyncio.Semaphore(vlm_slots)
+
+    async def run_analysis_events(query, image, price, user_budget, clip_image=None, deadline=None):
+        yield {'agent': 'ProductResearcher', 'status': 'thinking'}
+        async with vlm:
+            await asyncio.sleep(service_s)
+        yield {'agent': 'ProductResearcher', 'status': 'responded', 'output': 'stub analysis'}
+        yield {'agent': 'LeadAgent', 'status': 'complete',
+               'output': {'title': 'Stub', 'visual_summary': 'stub analysis', 'visual_summary_deferred': False,
+                          'review_summary': 'stub', 'similar_products': []}}
+
+    return run_analysis_events
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def one_request(client, image_bytes, i, num_clients, results):
+    started = time.perf_counter()
+    queued_events = 0
+    status = None
+    try:
+        async with client.stream(
+            "POST", "/api/get-recommendation",
+            # Unique queries, so requests are not coalesced into one run.
+            data={"query": f"load test {i}", "price": "10", "budget": "20"},
+            files={"image_file": ("p.jpg", image_bytes, "image/jpeg")},
+            headers={"X-Client-Id": f"client-{i % num_clients}"},
+        ) as response:
+            status = response.status_code
+            if status == 200:
+                async for line in response.aiter_lines():
+                    if line.startswith("event: queued"):
+                        queued_events += 1
+                    elif line.startswith("event: final_recommendation"):
+                        status = "served"
+                    elif line.startswith("event: error"):
+                        status = "error"
+    except httpx.HTTPError as e:
+        status = f"transport error: {e}"
+    results.append({"status": status, "latency_s": time.perf_counter() - started, "queued_events": queued_events})
+
+
+async def run_load(rate: float, duration_s: float, num_clients: int, image_bytes: bytes):
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        tasks = []
+        started = time.perf_counter()
+        i = 0
+        # Open-loop arrivals: requests keep coming whether or not earlier ones finished.
+        while time.perf_counter() - started < duration_s:
+            tasks.append(asyncio.create_task(one_request(client, image_bytes, i, num_clients, results)))
+            i += 1
+            await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(label: str, results):
+    served = [r["latency_s"] for r in results if r["status"] == "served"]
+    rejected = [r["latency_s"] for r in results if r["status"] in (429, 503)]
+    other = [r for r in results if r["status"] not in ("served", 429, 503)]
+    summary = {
+        "run": label, "requests": len(results), "served": len(served), "rejected": len(rejected), "other": len(other),
+        "served_p50_s": round(percentile(served, 50), 3), "served_p99_s": round(percentile(served, 99), 3),
+        "served_max_s": round(max(served), 3) if served else None,
+        "rejected_p99_ms": round(percentile(rejected, 99) * 1000, 1) if rejected else None,
+        "saw_queue_position": sum(1 for r in results if r["queued_events"]),
+    }
+    print(f"{label:<12} served {summary['served']:>4}/{summary['requests']:<4} "
+          f"p50 {summary['served_p50_s']:>6.2f}s  p99 {summary['served_p99_s']:>6.2f}s  "
+          f"rejected {summary['rejected']:>4} (p99 {summary['rejected_p99_ms']} ms)  other {summary['other']}")
+    return summary
+
+
+def controller(max_active_full: int, max_queue: int, max_per_client: int):
+    return AdmissionController(
+        lanes={"search": {"priority": 0, "max_active": config.ADMISSION_MAX_ACTIVE_SEARCH},
+               "full": {"priority": 1, "max_active": max_active_full}},
+        max_active=max(config.ADMISSION_MAX_ACTIVE, max_active_full),
+        max_queue=max_queue, max_per_client=max_per_client,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test admission control with a stubbed agent.")
+    parser.add_argument("--rate", type=float, default=40, help="Arrivals per second.")
+    parser.add_argument("--duration", type=float, default=8, help="Seconds of arrivals.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--vlm-slots", type=int, default=4)
+    parser.add_argument("--service-ms", type=float, default=200, help="Simulated VLM time per request.")
+    parser.add_argument("--json", help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    config.ADMISSION_CLIENT_HEADER = "X-Client-Id"
+    # Both runs send the same queries; don't replay the first run's results in the second.
+    endpoints.analysis_flights.result_ttl_s = 0
+    capacity = args.vlm_slots / (args.service_ms / 1000)
+    print(f"Offered load {args.rate:.0f} req/s against a capacity of {capacity:.0f} req/s for {args.duration:.0f}s.")
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (120, 80, 40)).save(buffer, "JPEG")
+
+    runs = {}
+    for label, limits in (
+        ("unbounded", (10_000, 10_000, 10_000)),
+        ("admission", (config.ADMISSION_MAX_ACTIVE_FULL, config.ADMISSION_MAX_QUEUE, config.ADMISSION_MAX_PER_CLIENT)),
+    ):
+        # A fresh stub per run: its semaphore belongs to that run's event loop.
+        endpoints.lead_agent.run_analysis_events = make_stub_pipeline(args.vlm_slots, args.service_ms / 1000)
+        endpoints.admission = controller(*limits)
+        runs[label] = summarize(label, asyncio.run(run_load(args.rate, args.duration, args.clients, buffer.getvalue())))
+
+    # With admission control, a served request waits behind at most max_queue others.
+    bound_s = (config.ADMISSION_MAX_QUEUE / min(config.ADMISSION_MAX_ACTIVE_FULL, args.vlm_slots) + 2) * args.service_ms / 1000
+    if args.rate > capacity:
+        assert runs["admission"]["served_max_s"] <= bound_s * 1.5, f"admitted latency exceeded the queue bound ({bound_s:.2f}s)"
+        assert runs["admission"]["served_p99_s"] < runs["unbounded"]["served_p99_s"], "admission control did not cut p99"
+        assert runs["admission"]["rejected"] > 0, "overload was never rejected"
+    print(f"OK: with admission control every served request finished within {bound_s * 1.5:.2f}s.")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "runs": runs}, f, indent=2)
+        print(f"Wrote {args.json}")
@@ -0,0 +1,86 @@
+# FILE: scripts/update_index.py
+# Adds or deletes products without rebuilding the catalog. Changes are published as
+# a new catalog version (see app.core.catalog); running API processes swap it in
+# within INDEX_RELOAD_CHECK_S seconds, or immediately on POST /api/index/reload.
+#
+#   python scripts/update_index.py --add jsonl:./new_products.jsonl
+#   python scripts/update_index.py --add dir:./new_images --delete B000123,B000456
+#   python scripts/update_index.py --status
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from app.core import config
+from app.core.catalog import current_version, load_version, prune_versions, publish
+
+
+def embed_source(spec: str, fetch_workers: int, batch_size: int, timeout: float):
+    """Fetches and CLIP-encodes every product of `spec`, reusing the ingest pipeline's stages."""
+    from ingest_data import StageStats, encode_batch, fetch_image, open_source
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer('clip-ViT-B-32')
+    stats = StageStats("fetch", "encode")
+    records, embeddings, batch, skipped = [], [], [], 0
+
+    def encode_pending():
+        items, vectors = encode_batch(model, batch, batch_size)
+        records.extend(items)
+        embeddings.append(vectors)
+        batch.clear()
+        return len(items)
+
+    with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="fetch") as pool:
+        for item, image in pool.map(lambda item: fetch_image(item, stats, fetch_workers, timeout),
+                                    open_source(spec, sample_size=0)):
+            if image is None:
+                skipped += 1
+                continue
+            batch.append((item, image))
+            if len(batch) >= batch_size:
+                skipped += batch_size - encode_pending()
+    if batch:
+        pending = len(batch)
+        skipped += pending - encode_pending()
+    stats.report(skipped)
+    if not records:
+        return [], None
+    return records, np.concatenate(embeddings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update the product catalog.")
+    parser.add_argument("--rag-data", default='backend/app/rag_data')
+    parser.add_argument("--add", help="Products to add or replace: 'dir:<folder>' or 'jsonl:<file>'.")
+    parser.add_argument("--delete", default="", help="Comma-separated product_ids to delete.")
+    parser.add_argument("--status", action="store_true", help="Only print the live version.")
+    parser.add_argument("--fetch-workers", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+
+    base = load_version(args.rag_data)
+    if args.status or not (args.add or args.delete):
+        print(json.dumps(dict(base.stats(), version_on_disk=current_version(args.rag_data)), indent=2))
+        sys.exit(0)
+
+    records, embeddings = [], None
+    if args.add and not args.add.startswith(("dir:", "jsonl:")):
+        sys.exit("--add takes 'dir:<folder>' or 'jsonl:<file>'; rebuild with ingest_data.py to load a dataset.")
+    if args.add:
+        records, embeddings = embed_source(args.add, args.fetch_workers, args.batch_size, args.timeout)
+        missing_ids = [record for record in records if not record.get("product_id")]
+        if missing_ids:
+            sys.exit(f"{len(missing_ids)} products have no product_id; every added product needs one.")
+    delete_ids = [product_id.strip() for product_id in args.delete.split(",") if product_id.strip()]
+
+    version, report = publish(base, add_records=records, add_embeddings=embeddings, delete_ids=delete_ids)
+    prune_versions(args.rag_data, config.INDEX_KEEP_VERSIONS)
+    print(json.dumps(report, indent=2))
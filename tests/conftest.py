@@ -0,0 +1,7 @@
+# FILE: tests/conftest.py
+# Makes the backend's `app` package importable, as the scripts in scripts/ do.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
@@ -0,0 +1,81 @@
+# FILE: tests/test_review_cache.py
+# Perceptually keyed image entries of ReviewAnalyzerAgent's cache: re-encoded copies of a
+# photo share them, other photos with the same dHash do not. CLIP and the index are stand-ins.
+#
+#   python -m pytest tests
+
+import hashlib
+import io
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core import config
+from app.core.cache import image_cache_key
+from app.agents.review_analyzer_agent import ReviewAnalyzerAgent
+
+
+class StandInCLIP:
+    """Maps every image to a pseudo-random vector derived from its pixels, counting the images encoded."""
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, images):
+        self.encoded += len(images)
+        seeds = [int(hashlib.sha1(image.tobytes()).hexdigest()[:8], 16) for image in images]
+        return np.asarray([np.random.default_rng(seed).standard_normal(8) for seed in seeds], dtype='float32')
+
+
+def search_by_colour(query_embeddings, top_k, catalog=None, texts=None):
+    """Stands in for the FAISS search: one 'product' per query, named after the query vector."""
+    return [{"summary": "", "top_products": [{"product_id": f"{row[0]:.6f}"}]} for row in query_embeddings]
+
+
+def gradient(rgb) -> Image.Image:
+    """A left-to-right fade of `rgb`: every colour gets the same grayscale layout, and so the same dHash."""
+    fade = np.linspace(0.3, 1.0, 96)[None, :, None]
+    return Image.fromarray((np.array(rgb)[None, None, :] * fade).repeat(64, axis=0).astype(np.uint8))
+
+
+def reencoded(image: Image.Image) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=80)
+    return Image.open(buffer).convert("RGB")
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setattr(config, "REVIEW_CACHE_IMAGE_HASH", "perceptual")
+    monkeypatch.setattr(config, "REVIEW_CACHE_DISK_PATH", "")
+    agent = ReviewAnalyzerAgent()
+    agent.model, agent.catalog = StandInCLIP(), types.SimpleNamespace(fingerprint="v1")
+    monkeypatch.setattr(agent, "_search_many", search_by_colour)
+    return agent
+
+
+def top_id(agent, image):
+    return agent._cached_search([image], top_k=1, mode="vector")[0]["top_products"][0]["product_id"]
+
+
+def test_reencoded_copy_is_served_from_the_cache(agent):
+    photo = gradient((200, 40, 40))
+    copy = reencoded(photo)
+    assert copy.tobytes() != photo.tobytes()
+    assert image_cache_key(copy, "perceptual") == image_cache_key(photo, "perceptual")
+
+    assert top_id(agent, copy) == top_id(agent, photo)
+    assert agent.model.encoded == 1
+
+
+def test_other_photo_with_the_same_dhash_is_not(agent):
+    red, blue = gradient((200, 40, 40)), gradient((40, 40, 200))
+    assert image_cache_key(red, "perceptual") == image_cache_key(blue, "perceptual")
+
+    red_id, blue_id = top_id(agent, red), top_id(agent, blue)
+    assert red_id != blue_id and agent.model.encoded == 2
+    # In one batch, too, each is encoded and searched on its own.
+    agent.cache.clear()
+    results = agent._cached_search([red, blue], top_k=1, mode="vector")
+    assert [r["top_products"][0]["product_id"] for r in results] == [red_id, blue_id]
@@ -0,0 +1,84 @@
+# FILE: tests/test_single_flight.py
+# Coalescing and replay rules of app.core.single_flight.SingleFlight.
+#
+#   python -m pytest tests
+
+import asyncio
+
+from app.core.single_flight import SingleFlight
+
+
+class Producer:
+    """Counts its runs; yields `events`, then waits on `gate` if given."""
+    def __init__(self, events, gate: asyncio.Event = None, swallow_cancel: bool = False):
+        self.events = events
+        self.gate = gate
+        self.swallow_cancel = swallow_cancel
+        self.runs = 0
+
+    async def __call__(self):
+        self.runs += 1
+        for event in self.events:
+            yield event
+        if self.gate is not None:
+            try:
+                await self.gate.wait()
+            except asyncio.CancelledError:
+                if not self.swallow_cancel:
+                    raise
+
+
+async def collect(flights, key, producer, cacheable=None):
+    return [event async for event in flights.stream(key, producer, cacheable=cacheable)]
+
+
+def test_complete_runs_are_replayed():
+    async def run():
+        flights, producer = SingleFlight(), Producer(["a", "b"])
+        assert await collect(flights, "k", producer) == ["a", "b"]
+        assert await collect(flights, "k", producer) == ["a", "b"]
+        return producer.runs, flights.stats()["replayed"]
+
+    assert asyncio.run(run()) == (1, 1)
+
+
+def test_runs_rejected_by_cacheable_run_again():
+    async def run():
+        flights, producer = SingleFlight(), Producer(["partial"])
+        for _ in range(2):
+            assert await collect(flights, "k", producer, cacheable=lambda events: "complete" in events) == ["partial"]
+        return producer.runs
+
+    assert asyncio.run(run()) == 2
+
+
+def test_abandoned_run_is_cancelled_and_not_cached():
+    async def run(swallow_cancel):
+        flights, gate = SingleFlight(), asyncio.Event()
+        producer = Producer(["a"], gate=gate, swallow_cancel=swallow_cancel)
+        events = flights.stream("k", producer)
+        assert await events.__anext__() == "a"
+        task = next(iter(flights._flights.values())).task
+        await events.aclose()  # the only subscriber leaves
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled(), flights.has("k")
+
+    # The producer's cancellation propagates out of its task, and nothing is cached...
+    assert asyncio.run(run(swallow_cancel=False)) == (True, False)
+    # ...even when the producer itself swallows it and ends early.
+    assert asyncio.run(run(swallow_cancel=True)) == (False, False)
+
+
+def test_subscribers_see_the_cancelled_run_end():
+    async def run():
+        flights, gate = SingleFlight(), asyncio.Event()
+        events = flights.stream("k", Producer(["a"], gate=gate))
+        assert await events.__anext__() == "a"
+        flights._flights["k"].task.cancel()
+        try:
+            await events.__anext__()
+        except asyncio.CancelledError:
+            return "cancelled"
+        return "not cancelled"
+
+    assert asyncio.run(run()) == "cancelled"
@@ -0,0 +1,25 @@
+# FILE: tests/test_upload_limit.py
+# The multipart size limit answers oversized uploads with a 413 the browser can read.
+#
+#   python -m pytest tests
+
+import asyncio
+
+import httpx
+
+from app.core import config
+from app.main import app
+
+
+def test_oversized_upload_gets_a_413_with_cors_headers():
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post(
+                "/api/get-recommendation",
+                content=b"x" * (config.UPLOAD_MAX_BYTES + config.UPLOAD_FORM_OVERHEAD_BYTES + 1),
+                headers={"Origin": "http://frontend.example", "Content-Type": "multipart/form-data; boundary=b"},
+            )
+
+    response = asyncio.run(post())
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "http://frontend.example"
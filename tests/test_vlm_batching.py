@@ -0,0 +1,157 @@
+# FILE: tests/test_vlm_batching.py
+# Runs ProductResearchAgent's real batched generation path (_generate_batch, BatchTextStreamer
+# and the batching worker) on CPU, with a tiny stand-in for Qwen2.5-VL and its processor.
+#
+#   python -m pytest tests
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.core import config
+from app.agents.product_research_agent import ProductResearchAgent
+
+COLOURS = {(200, 30, 30): "red", (30, 200, 30): "green", (30, 30, 200): "blue", (90, 90, 90): "grey"}
+
+
+class StandInTensor(np.ndarray):
+    """A numpy array answering the torch-style calls the agent makes on its tensors."""
+    def sum(self, axis=None, dim=None, **kwargs):
+        return super().sum(axis=dim if dim is not None else axis, **kwargs)
+
+
+class StandInInputs(dict):
+    def to(self, device):
+        return self
+
+
+class StandInTokenizer:
+    """One token per UTF-8 byte, so multi-byte characters arrive in pieces; 0 is padding."""
+    pad_token_id = 0
+
+    def encode(self, text: str):
+        return list(text.encode("utf-8"))
+
+    def decode(self, ids, skip_special_tokens=True):
+        return bytes(i for i in ids if i != self.pad_token_id).decode("utf-8", errors="replace")
+
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return [self.decode(row.tolist()) for row in rows]
+
+
+class StandInProcessor:
+    """Puts the image's colour name in front of the prompt, left-padding the batch like Qwen2.5-VL's processor."""
+    def __init__(self):
+        self.tokenizer = StandInTokenizer()
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        return "".join(part.get("text", "") for message in messages for part in message["content"])
+
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return self.tokenizer.batch_decode(rows, skip_special_tokens=skip_special_tokens)
+
+    def __call__(self, text_prompts, images=None, padding=True, return_tensors="pt"):
+        rows = [self.tokenizer.encode(f"<{COLOURS[image.getpixel((0, 0))]}>{prompt}")
+                for prompt, image in zip(text_prompts, images)]
+        width = max(len(row) for row in rows)
+        input_ids = np.zeros((len(rows), width), dtype=np.int64)
+        for i, row in enumerate(rows):
+            input_ids[i, width - len(row):] = row
+        return StandInInputs(input_ids=input_ids.view(StandInTensor),
+                             attention_mask=(input_ids != 0).astype(np.int64).view(StandInTensor))
+
+
+def expected_answer(colour: str, query: str) -> str:
+    # Answers differ in length per request, span a line break and contain two-byte characters.
+    return f"A {colour} product.\nAsked: {query} — café"
+
+
+class StandInVLM:
+    """Answers each row from its own prompt, one token per step, streaming like transformers' `generate`."""
+    def __init__(self):
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=1024, do_sample=False, streamer=None):
+        with self._lock:
+            self.batch_sizes.append(len(input_ids))
+        tokenizer = StandInTokenizer()
+        answers = []
+        for row in input_ids:
+            prompt = tokenizer.decode(row.tolist())
+            colour, query = prompt[1:].split(">", 1)
+            answers.append(tokenizer.encode(expected_answer(colour, query))[:max_new_tokens])
+        new_tokens = np.zeros((len(answers), max(len(answer) for answer in answers)), dtype=np.int64)
+        for i, answer in enumerate(answers):
+            new_tokens[i, :len(answer)] = answer  # finished rows are padded
+        if streamer is not None:
+            streamer.put(input_ids)
+            for step in range(new_tokens.shape[1]):
+                streamer.put(new_tokens[:, step])
+            streamer.end()
+        return np.concatenate([np.asarray(input_ids), new_tokens], axis=1).view(StandInTensor)
+
+
+@pytest.fixture
+def agent():
+    agent = ProductResearchAgent()
+    agent.model, agent.processor = StandInVLM(), StandInProcessor()
+    return agent
+
+
+def image(colour: str) -> Image.Image:
+    rgb = next(rgb for rgb, name in COLOURS.items() if name == colour)
+    return Image.new("RGB", (4, 4), rgb)
+
+
+def test_generate_batch_returns_and_streams_each_answer_to_its_request(agent):
+    requests = [("red", "Is it sturdy?"), ("green", "Worth it?"), ("blue", "How big is this one, exactly?")]
+    streamed = {0: [], 2: []}
+    results = agent._generate_batch([
+        (image(colour), query, streamed[i].append if i in streamed else None, None)
+        for i, (colour, query) in enumerate(requests)
+    ])
+
+    assert agent.model.batch_sizes == [3]
+    assert results == [expected_answer(colour, query) for colour, query in requests]
+    for i, chunks in streamed.items():
+        assert "".join(chunks) == results[i]
+        assert len(chunks) > 1, "text should arrive as it is generated"
+        assert not any("�" in chunk for chunk in chunks), "a multi-byte character was split"
+
+
+def test_failing_callback_only_drops_its_own_stream(agent):
+    def broken(text):
+        raise ConnectionError("client went away")
+
+    streamed = []
+    results = agent._generate_batch([
+        (image("red"), "first", broken, None),
+        (image("grey"), "second", streamed.append, None),
+    ])
+
+    assert results == [expected_answer("red", "first"), expected_answer("grey", "second")]
+    assert "".join(streamed) == results[1]
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_results(agent, monkeypatch):
+    monkeypatch.setattr(config, "VLM_MAX_BATCH_SIZE", 4)
+    monkeypatch.setattr(config, "VLM_MAX_WAIT_MS", 200)
+    requests = [(colour, f"question {i}") for i, colour in enumerate(["red", "green", "blue", "grey"] * 2)]
+    streams = [[] for _ in requests]
+
+    def call(i):
+        colour, query = requests[i]
+        return agent.analyze_image(image(colour), query, on_chunk=streams[i].append)["analysis"]
+
+    assert agent._ensure_loaded()
+    with ThreadPoolExecutor(max_workers=len(requests)) as pool:
+        results = list(pool.map(call, range(len(requests))))
+
+    assert results == [expected_answer(colour, query) for colour, query in requests]
+    assert ["".join(chunks) for chunks in streams] == results
+    assert sum(agent.model.batch_sizes) == len(requests)
+    assert max(agent.model.batch_sizes) > 1, agent.model.batch_sizes